@@ -1,21 +1,37 @@
-from reporting_tools import gen_report
+from reporting_tools import gen_report, gen_report_chunks, gen_report_paginated, save_report
 
 site_list = ['catmaid_fafb', 'catmaid_fanc', 'catmaid_l1em', 'neuronbridge', \
              'neuprint_JRC_Hemibrain_1point1', 'FlyCircuit']
 
+# follows a MATCH of each neuron n and its cross reference d to the site
+NEURON_IDS = ("OPTIONAL MATCH (n)-[:INSTANCEOF]->(f:Class:Anatomy) "
+              "WHERE f.short_form STARTS WITH \"FBbt\""
+              "RETURN DISTINCT n.short_form AS VFB_ID, d.accession[0] AS external_ID, "
+              "apoc.coll.sort(COLLECT(f.label)) AS cell_types")
 
-def get_ids(site_name, vfb_server=('http://pdb.virtualflybrain.org', 'neo4j', 'vfb')):
+
+def get_ids(site_name, vfb_server=('http://pdb.virtualflybrain.org', 'neo4j', 'vfb'), chunk_size=None,
+            page_size=None):
     """Gets neuron IDs from VFB for a given :Site (e.g. catmaid_fafb).
     site_name should be the short_form of the :Site
-    Default server is pdb.v4"""
+    Default server is pdb.v4
+    If chunk_size is given, returns an iterator of dataframe chunks instead
+    (see reporting_tools.gen_report_chunks).  If page_size is given, returns an iterator
+    of pages of about page_size neurons each, fetched in parallel
+    (see reporting_tools.gen_report_paginated)."""
 
-    neuron_data = gen_report(server=vfb_server,
-                             query=("MATCH (n:Neuron:Individual)-[d:database_cross_reference]->(s) "
-                                    "WHERE s.short_form=\"%s\" OPTIONAL MATCH (n)-[:INSTANCEOF]->(f:Class:Anatomy) "
-                                    "WHERE f.short_form STARTS WITH \"FBbt\""
-                                    "RETURN DISTINCT n.short_form AS VFB_ID, d.accession[0] AS external_ID, "
-                                    "apoc.coll.sort(COLLECT(f.label)) AS cell_types" % site),
-                             report_name='neuron_data')
+    site_neurons = "MATCH (n:Neuron:Individual)-[d:database_cross_reference]->(s) WHERE s.short_form=$site "
+    if page_size:
+        return gen_report_paginated(server=vfb_server,
+                                    query=(site_neurons +
+                                           "AND n.short_form >= $page_from "
+                                           "AND ($page_to IS NULL OR n.short_form < $page_to) " + NEURON_IDS),
+                                    report_name='neuron_data', key='n.short_form', key_match=site_neurons,
+                                    page_size=page_size, parameters={'site': site_name})
+    report = gen_report_chunks if chunk_size else gen_report
+    kwargs = {'chunk_size': chunk_size} if chunk_size else {}
+    neuron_data = report(server=vfb_server, query=site_neurons + NEURON_IDS,
+                         report_name='neuron_data', parameters={'site': site_name}, **kwargs)
 
     return neuron_data
 
@@ -23,5 +39,6 @@ def get_ids(site_name, vfb_server=('http://pdb.virtualflybrain.org', 'neo4j', 'v
 if __name__ == "__main__":
     for site in site_list:
         print("Getting IDs for %s" % site)
-        id_table = get_ids(site)
-        id_table.to_csv("../VFB_reporting_results/ID_tables/%s_ID_table.tsv" % site, sep='\t', index=False)
+        id_table = get_ids(site, page_size=50000)
+        # also saved as Parquet/Arrow etc if listed in VFB_REPORT_FORMATS (read back with reporting_tools.read_report)
+        save_report(id_table, "../VFB_reporting_results/ID_tables/%s_ID_table.tsv" % site)
@@ -2,11 +2,11 @@
 are not on the classes that they are annotated with."""
 
 import pandas as pd
-from uk.ac.ebi.vfb.neo4j.neo4j_tools import neo4j_connect, results_2_dict_list
+from reporting_tools import compact_frame, get_connection, plain_frame, results_2_frame
 import wget
 import pathlib
 
-nc = neo4j_connect('http://pdb.virtualflybrain.org', 'neo4j', 'vfb')
+nc = get_connection(('http://pdb.virtualflybrain.org', 'neo4j', 'vfb'))
 
 # nt labels
 neurotransmitter_labels = ['Cholinergic', 'Glutamatergic', 'GABAergic', 'Octopaminergic', 'Dopaminergic',
@@ -47,7 +47,7 @@ query = ("MATCH (i:Individual:Neuron:has_neuron_connectivity)-[:INSTANCEOF]->(c:
          "RETURN i.short_form AS instance_id, i.label AS instance_label, labels(i) AS instance_tags, "
          "c.short_form AS FBbt_id, c.label AS FBbt_label, labels(c) AS class_tags")
 output = nc.commit_list([query])
-all_neo_labels = pd.DataFrame(results_2_dict_list(output))
+all_neo_labels = compact_frame(results_2_frame(output))  # FBbt ids and labels repeat for every instance
 all_neo_labels['FBbt_id'] = all_neo_labels['FBbt_id'].apply(lambda x: x.replace('_', ':'))
 all_neo_labels = all_neo_labels[~all_neo_labels['FBbt_id'].isin(excluded_ids)]
 
@@ -66,7 +66,10 @@ def label_conflict_report(query_labels, VFB_labels, report_filename):
     all_relevant_labels['new_labels'] = all_relevant_labels.apply(lambda x:
                                         label_filter(x['instance_tags'], x['instance_tags'], x['class_tags']), axis=1)
 
-    all_labels_with_new = all_relevant_labels[all_relevant_labels['new_labels'].str.len() > 0].reset_index(drop=True)
+    # back to plain strings for the (few) conflicts, as value_counts of categoricals
+    # would also count combinations that never occur
+    all_labels_with_new = plain_frame(
+        all_relevant_labels[all_relevant_labels['new_labels'].str.len() > 0].reset_index(drop=True))
     all_labels_with_new['new_labels'] = all_labels_with_new['new_labels'].apply(lambda x: x[0])
 
     old_labels = all_labels_with_new[['FBbt_id', 'class_tags']].copy()
@@ -1,4 +1,15 @@
-from reporting_tools import gen_report
+import argparse
+import json
+import numbers
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import deadlines
+import reporting_tools
+from reporting_tools import census_query, gen_reports_batch, label_census
+from report_history import ReportHistory
 import mdutils
 import datetime
 
@@ -8,6 +19,269 @@ VFB_servers = {'pdb': ('http://pdb.virtualflybrain.org', 'neo4j', 'vfb'),
 output_files = {'pdb': "../VFB_reporting_results/content_report.md",
                 'pdb-alpha': "../VFB_reporting_results/content_report_alpha.md",
                 'pdb-preview': "../VFB_reporting_results/content_report_preview.md"}
+# the report data, from which the report can be rendered again (see VFBContentReport.save)
+snapshot_files = {s: os.path.splitext(f)[0] + '.json' for s, f in output_files.items()}
+# every server's counts side by side (see prepare_delta_report)
+delta_file = "../VFB_reporting_results/content_report_delta.md"
+
+# Ontology content is counted with conditional aggregation (see reporting_tools.census_query):
+# one scan over the FBbt classes (and other neurons) and their publications counts the classes
+# and publications in each category, and one scan over their relationships counts those.
+# The subclasses of cell body rind (FBbt_00100200) and sense organ (FBbt_00005155) are
+# collected first, from those terms.  Every FBbt term is assumed to be a :Class.
+CLASS_CATEGORIES = {
+    'all_terms': "fbbt",
+    'all_nervous_system': "fbbt AND 'Nervous_system' IN l",
+    'all_neurons': "fbbt AND 'Neuron' IN l",
+    'provisional_neurons': "'Neuron' IN l AND c.short_form STARTS WITH 'FBbt_2'",
+    'characterized_neurons': "'Neuron' IN l AND NOT c.short_form STARTS WITH 'FBbt_2'",
+    'synaptic_neuropils': "fbbt AND 'Synaptic_neuropil' IN l",
+    'neuron_projection_bundles': "fbbt AND 'Neuron_projection_bundle' IN l",
+    'cell_body_rinds': "fbbt AND c IN rinds",
+    'other_regions': ("fbbt AND (ANY(x IN ['Synaptic_neuropil', 'Neuron_projection_bundle', 'Ganglion', "
+                      "'Neuromere'] WHERE x IN l) OR c IN rind_children)"),
+    'sense_organs': "fbbt AND c IN sense_organs"}
+
+RELATIONSHIP_CATEGORIES = {
+    'isa': "isa", 'non_isa': "non_isa", 'total': "true",
+    'ns_isa': "ns AND isa", 'ns_non_isa': "ns AND non_isa", 'ns_total': "ns"}
+
+ONTOLOGY_CENSUS = {
+    'classes': census_query(
+        "OPTIONAL MATCH (:Class {short_form: 'FBbt_00100200'})<-[:SUBCLASSOF]-(x:Class) "
+        "WITH collect(DISTINCT x) AS rind_children "
+        "OPTIONAL MATCH (:Class {short_form: 'FBbt_00100200'})<-[:SUBCLASSOF*1..2]-(x:Class) "
+        "WITH rind_children, collect(DISTINCT x) AS rinds "
+        "OPTIONAL MATCH (:Class {short_form: 'FBbt_00005155'})<-[:SUBCLASSOF*]-(x:Class) "
+        "WITH rind_children, rinds, collect(DISTINCT x) AS sense_organs "
+        "MATCH (c:Class) WHERE c.short_form STARTS WITH 'FBbt' OR c:Neuron "
+        "WITH c, labels(c) AS l, c.short_form STARTS WITH 'FBbt' AS fbbt, rind_children, rinds, sense_organs "
+        "OPTIONAL MATCH (c)-[]->(p:pub)",
+        CLASS_CATEGORIES, {'': 'c', '_pubs': 'p'}),
+    'relationships': census_query(
+        "MATCH (c:Class)-[r]->(d:Class) "
+        "WHERE c.short_form STARTS WITH 'FBbt' AND ((r.type = 'Related') OR (type(r) = 'SUBCLASSOF')) "
+        "WITH r, 'Nervous_system' IN labels(c) AS ns, type(r) = 'SUBCLASSOF' AS isa, "
+        "coalesce(r.type = 'Related', false) AS non_isa",
+        RELATIONSHIP_CATEGORIES, {'': 'r'})}
+
+
+CONTENT_QUERIES = {
+    **ONTOLOGY_CENSUS,
+    # images (excluding hemibrain 1.0.1)
+    'all_images': ("MATCH (i:Individual:has_image)-[:has_source]->(n:DataSet) "
+                   "WHERE n.production "
+                   "AND n.short_form<>\"Xu2020Neurons\" "
+                   "RETURN COUNT(DISTINCT i) AS images, "
+                   "COUNT(DISTINCT n) AS ds"),
+    'single_neuron_images': ("MATCH (n:DataSet)<-[:has_source]-"
+                             "(i:Individual:Neuron:has_image)-"
+                             "[:INSTANCEOF]->(c:Class:Neuron) "
+                             "WHERE n.production "
+                             "AND n.short_form<>\"Xu2020Neurons\" "
+                             "RETURN COUNT(DISTINCT i) AS images, "
+                             "COUNT(DISTINCT c) AS types"),
+    'exp_pattern_images': ("MATCH (n:DataSet)<-[:has_source]-"
+                           "(i:Individual:Expression_pattern:has_image)-"
+                           "[:INSTANCEOF]->(c:Class:Expression_pattern) "
+                           "WHERE n.production "
+                           "RETURN COUNT(DISTINCT i) AS images, "
+                           "COUNT(DISTINCT c) AS drivers"),
+    'split_images': ("MATCH (n:DataSet)<-[]-(i:Split:has_image)-"
+                     "[:INSTANCEOF]->(c:Class:Split) "
+                     "WHERE n.production "
+                     "RETURN COUNT(DISTINCT i) AS images, "
+                     "COUNT(DISTINCT c) AS split_classes"),
+    'exp_pattern_fragment_images': ("MATCH (n:DataSet)<-[:has_source]-"
+                                    "(i:Individual:Expression_pattern_fragment:has_image)-"
+                                    "[:part_of]->(c:Class:Expression_pattern) "
+                                    "WHERE n.production "
+                                    "RETURN COUNT(DISTINCT i) AS images, "
+                                    "COUNT(DISTINCT c) AS drivers"),
+    # annotations
+    'driver_anatomy_annotations': ("MATCH (ep:Class:Expression_pattern)<-"
+                                   "[r:part_of|overlaps]-(j:Individual)-[:INSTANCEOF]->(n:Class) "
+                                   "WHERE r.pub IS NOT NULL AND n.short_form STARTS WITH 'FBbt' "
+                                   "RETURN COUNT(DISTINCT ep) AS EPs, COUNT(r) AS annotations, "
+                                   "COUNT(DISTINCT n) AS anatomy"),
+    'driver_ns_annotations': ("MATCH (ep:Class:Expression_pattern)<-[r:part_of|overlaps]-"
+                              "(j:Individual)-[:INSTANCEOF]->(n:Nervous_system:Class) "
+                              "WHERE r.pub IS NOT NULL AND n.short_form STARTS WITH 'FBbt' "
+                              "RETURN COUNT(DISTINCT ep) AS EPs, COUNT(r) AS annotations, "
+                              "COUNT(DISTINCT n) AS anatomy"),
+    'driver_neuron_annotations': ("MATCH (ep:Class:Expression_pattern)<-[r:part_of]-"
+                                  "(j:Individual)-[:INSTANCEOF]->(n:Neuron:Class) "
+                                  "WHERE r.pub IS NOT NULL AND n.short_form STARTS WITH 'FBbt' "
+                                  "RETURN COUNT(DISTINCT ep) AS EPs, COUNT(r) AS annotations, "
+                                  "COUNT(DISTINCT n) AS neurons"),
+    'split_neuron_annotations': ("MATCH (split:Class:Split)<-[r:part_of]-(j:Individual)-"
+                                 "[:INSTANCEOF]->(n:Neuron:Class) "
+                                 "WHERE r.pub IS NOT NULL AND n.short_form STARTS WITH 'FBbt' "
+                                 "RETURN COUNT(DISTINCT split) AS Splits, COUNT(r) AS "
+                                 "annotations, COUNT(DISTINCT n) AS neurons"),
+    # connectivity, and per-EM-project neuron and synapse counts
+    'synaptic_connections': ("MATCH (i:Individual:Neuron)-[r:synapsed_to]->"
+                             "(j:Individual:Neuron) "
+                             "WITH COLLECT(r) AS rels, COLLECT(DISTINCT i) AS ci, "
+                             "COLLECT(DISTINCT j) AS cj "
+                             "RETURN SIZE(apoc.coll.union(ci,cj)) AS neurons, "
+                             "SIZE(rels) AS connections"),
+    'region_connections': ("MATCH (n:Individual:Neuron)-"
+                           "[r:has_presynaptic_terminals_in|has_postsynaptic_terminal_in]"
+                           "->(m:Individual) "
+                           "RETURN COUNT(DISTINCT n) AS neurons, COUNT(DISTINCT m) AS regions, "
+                           "COUNT(DISTINCT r) AS connections"),
+    'muscle_connections': ("MATCH (n:Neuron)-[r:synapsed_to|"
+                           "synapsed_via_type_Is_bouton_to|"
+                           "synapsed_via_type_Ib_bouton_to|"
+                           "synapsed_via_type_II_bouton_to|"
+                           "synapsed_via_type_III_bouton_to]->(m:Muscle) "
+                           "WITH n, r, m OPTIONAL MATCH (n2:Neuron)-[:SUBCLASSOF*]->(n) "
+                           "WITH COLLECT(DISTINCT r) AS rels, COLLECT(DISTINCT n) AS cn, "
+                           "COLLECT(DISTINCT n2) AS cn2, COLLECT(DISTINCT m) AS cm "
+                           "RETURN SIZE(apoc.coll.union(cn,cn2)) AS neurons, "
+                           "SIZE(cm) AS muscles, SIZE(rels) AS connections"),
+    'sensory_connections': ("MATCH (n:Neuron)-[r:has_sensory_dendrite_in]->(s:Sense_organ) "
+                            "WITH n, r, s OPTIONAL MATCH (n2:Neuron)-[:SUBCLASSOF*]->(n) "
+                            "WITH COLLECT(DISTINCT r) AS rels, COLLECT(DISTINCT n) AS cn, "
+                            "COLLECT(DISTINCT n2) AS cn2, COLLECT(DISTINCT s) AS cs "
+                            "RETURN SIZE(apoc.coll.union(cn,cn2)) AS neurons, "
+                            "SIZE(cs) AS sense_organs, SIZE(rels) AS connections"),
+    'em_project_data': ("MATCH (n:Neuron:Individual)-[:database_cross_reference]->"
+                        "(d:Site:Connectome:Individual) "
+                        "OPTIONAL MATCH (n)-[r:synapsed_to]->(m:Neuron:Individual) "
+                        "RETURN d.short_form AS `EM Project`, "
+                        "count(distinct n) AS Neurons, "
+                        "sum(r.weight[0]) AS Synapses, "
+                        "count(r) AS Edges ORDER BY Neurons DESC"),
+    # template data (excluding hemibrain v1.0.1) and scRNAseq totals
+    'templates_data': ("MATCH (d:DataSet)<-[:has_source]-(i:Individual)<-[:depicts]-"
+                       "(m:Individual)-[:in_register_with]->"
+                       "(:Template)-[:depicts]->(t:Template) "
+                       "WHERE d.short_form<>\"Xu2020Neurons\" "
+                       "OPTIONAL MATCH (m)-[:depicts]->(n:Individual:Neuron) "
+                       "OPTIONAL MATCH em = (m)-[:is_specified_output_of]->(e) "
+                       "WHERE e.label CONTAINS \"electron microscopy\" "
+                       "OPTIONAL MATCH (m)-[:depicts]->(ep:Individual:Expression_pattern) "
+                       "OPTIONAL MATCH (m)-[:depicts]->"
+                       "(epf:Individual:Expression_pattern_fragment) "
+                       "OPTIONAL MATCH (m)-[:depicts]->"
+                       "(s:Individual:Expression_pattern:Split) "
+                       "OPTIONAL MATCH pd = (m)-[:is_specified_output_of]->"
+                       "({label:\"computer graphic\"}) "
+                       "RETURN DISTINCT t.label AS template, COUNT(DISTINCT m) AS images, "
+                       "COUNT(DISTINCT d) AS datasets, "
+                       "COUNT(DISTINCT n) AS single_neuron_images, "
+                       "COUNT(DISTINCT em) AS em_images, "
+                       "COUNT(DISTINCT ep) AS expression_patterns, "
+                       "COUNT(DISTINCT s) AS split_images, "
+                       "COUNT(DISTINCT epf) AS expression_pattern_fragments, "
+                       "COUNT(DISTINCT pd) AS painted_domains"),
+    'scrnaseq_totals': ("MATCH (cl:Cluster:Individual)-[:has_source]->"
+                        "(ds:scRNAseq_DataSet:Individual) "
+                        "WITH COLLECT(DISTINCT cl) AS clusters, "
+                        "COLLECT(DISTINCT ds) AS datasets "
+                        "UNWIND clusters AS cl "
+                        "OPTIONAL MATCH (cl)-[:composed_primarily_of]->(a:Class) "
+                        "WHERE a.short_form STARTS WITH 'FBbt' "
+                        "OPTIONAL MATCH (cl)-[:expresses]->(g:Gene) "
+                        "RETURN SIZE(clusters) AS total_clusters, "
+                        "COUNT(DISTINCT a) AS distinct_anatomy, "
+                        "COUNT(DISTINCT g) AS distinct_genes, "
+                        "SIZE(datasets) AS datasets")}
+
+# Queries in a block are sent together, in one request (see reporting_tools.gen_reports_batch);
+# the blocks are independent and run concurrently (see VFBContentReport.get_info).
+CONTENT_BLOCKS = {
+    'anatomy': ['classes'],
+    'relationships': ['relationships'],
+    'images': ['all_images', 'single_neuron_images', 'exp_pattern_images', 'split_images',
+               'exp_pattern_fragment_images'],
+    'annotations': ['driver_anatomy_annotations', 'driver_ns_annotations', 'driver_neuron_annotations',
+                    'split_neuron_annotations'],
+    'connectivity': ['synaptic_connections', 'region_connections', 'muscle_connections', 'sensory_connections'],
+    'em_projects': ['em_project_data'],
+    'templates': ['templates_data'],
+    'scrnaseq': ['scrnaseq_totals']}
+
+# blocks run at once against a server
+PARALLELISM = int(os.environ.get('VFB_CONTENT_REPORT_PARALLELISM', 4))
+
+# The node labels and relationship types each query counts ('*' for any relationship type).
+# A query is only rerun when the number of nodes or relationships with one of these changes
+# (or its last result is older than REUSE_DAYS, to pick up changes to properties); otherwise
+# its result from the last run is reused (see VFBContentReport.get_info).
+CONTENT_DEPENDENCIES = {
+    'classes': (['Class', 'Neuron', 'Nervous_system', 'Synaptic_neuropil', 'Neuron_projection_bundle',
+                 'Ganglion', 'Neuromere', 'pub'], ['*']),
+    'relationships': (['Class', 'Nervous_system'], ['*']),
+    'all_images': (['Individual', 'has_image', 'DataSet'], ['has_source']),
+    'single_neuron_images': (['DataSet', 'Individual', 'Neuron', 'has_image', 'Class'], ['has_source', 'INSTANCEOF']),
+    'exp_pattern_images': (['DataSet', 'Individual', 'Expression_pattern', 'has_image', 'Class'],
+                           ['has_source', 'INSTANCEOF']),
+    'split_images': (['DataSet', 'Split', 'has_image', 'Class'], ['*']),
+    'exp_pattern_fragment_images': (['DataSet', 'Individual', 'Expression_pattern_fragment', 'has_image', 'Class',
+                                     'Expression_pattern'], ['has_source', 'part_of']),
+    'driver_anatomy_annotations': (['Class', 'Expression_pattern', 'Individual'],
+                                   ['part_of', 'overlaps', 'INSTANCEOF']),
+    'driver_ns_annotations': (['Class', 'Expression_pattern', 'Individual', 'Nervous_system'],
+                              ['part_of', 'overlaps', 'INSTANCEOF']),
+    'driver_neuron_annotations': (['Class', 'Expression_pattern', 'Individual', 'Neuron'], ['part_of', 'INSTANCEOF']),
+    'split_neuron_annotations': (['Class', 'Split', 'Individual', 'Neuron'], ['part_of', 'INSTANCEOF']),
+    'synaptic_connections': (['Individual', 'Neuron'], ['synapsed_to']),
+    'region_connections': (['Individual', 'Neuron'], ['has_presynaptic_terminals_in', 'has_postsynaptic_terminal_in']),
+    'muscle_connections': (['Neuron', 'Muscle'], ['synapsed_to', 'synapsed_via_type_Is_bouton_to',
+                                                  'synapsed_via_type_Ib_bouton_to', 'synapsed_via_type_II_bouton_to',
+                                                  'synapsed_via_type_III_bouton_to', 'SUBCLASSOF']),
+    'sensory_connections': (['Neuron', 'Sense_organ'], ['has_sensory_dendrite_in', 'SUBCLASSOF']),
+    'em_project_data': (['Neuron', 'Individual', 'Site', 'Connectome'], ['database_cross_reference', 'synapsed_to']),
+    'templates_data': (['DataSet', 'Individual', 'Template', 'Neuron', 'Expression_pattern',
+                        'Expression_pattern_fragment', 'Split'],
+                       ['has_source', 'depicts', 'in_register_with', 'is_specified_output_of']),
+    'scrnaseq_totals': (['Cluster', 'Individual', 'scRNAseq_DataSet', 'Class', 'Gene'],
+                        ['has_source', 'composed_primarily_of', 'expresses'])}
+
+# query results of the last run, with the counts they depended on, by server
+CONTENT_STATE_FILE = os.environ.get('VFB_CONTENT_STATE', '../VFB_reporting_results/content_report_state.json')
+REUSE_DAYS = float(os.environ.get('VFB_CONTENT_REUSE_DAYS', 7))
+SNAPSHOT_VERSION = 1
+_state_lock = threading.Lock()
+
+
+def dependency_counts(census, name):
+    """The counts of the labels and relationship types a query depends on (see CONTENT_DEPENDENCIES),
+    given a label census (see reporting_tools.label_census), as a dict.  A label or type not in the
+    census has none; one that could not be counted is None."""
+    labels, rel_types = CONTENT_DEPENDENCIES[name]
+    counts = {'%s:%s' % (t, label): None if pd.isna(c) else int(c) for t, label, c in census.itertuples(index=False)}
+    fingerprint = {'node:' + label: counts.get('node:' + label, 0) for label in labels}
+    for t in rel_types:
+        if t == '*':
+            fingerprint['relationship:*'] = int(census.loc[census['type'] == 'relationship', 'count'].sum())
+        else:
+            fingerprint['relationship:' + t] = counts.get('relationship:' + t, 0)
+    return fingerprint
+
+
+def load_state(state_file):
+    if not state_file or not os.path.exists(state_file):
+        return {}
+    with open(state_file) as f:
+        return json.load(f)
+
+
+def save_state(state_file, server, results):
+    """Saves the query results (dict of name: {'counts', 'computed', 'columns', 'data'}) from a server,
+    keeping those of other servers."""
+    with _state_lock:
+        state = load_state(state_file)
+        state[server] = results
+        os.makedirs(os.path.dirname(os.path.abspath(state_file)), exist_ok=True)
+        part_file = state_file + '.part'
+        with open(part_file, 'w') as f:
+            json.dump(state, f, indent=1, sort_keys=True)
+        os.replace(part_file, state_file)
+
 
 class VFBContentReport:
     """Class for storing data about the amount of content in VFB."""
@@ -80,399 +354,218 @@ class VFBContentReport:
         self.scrnaseq_cluster_number = None
         self.scrnaseq_anatomy_number = None
         self.scrnaseq_gene_number = None
-
-    def get_info(self):
-        """Gets content info from VFB and assigns to attributes."""
+        self.reused = {}
+
+    def get_info(self, max_per_server=PARALLELISM, state_file=None, refresh=False):
+        """Gets content info from VFB and assigns to attributes.
+        The blocks of CONTENT_BLOCKS are run concurrently, max_per_server at a time, each sent
+        as one request (see reporting_tools.gen_reports_batch); a metric whose query fails
+        is left as None.
+        Given a state_file (e.g. CONTENT_STATE_FILE), a query whose dependencies (see CONTENT_DEPENDENCIES)
+        have the same counts as when it last ran, less than REUSE_DAYS ago, is not run again: its
+        last result is reused, and recorded in self.reused (name: when it was computed).
+        refresh runs every query (still saving the results to state_file)."""
         self.timestamp = datetime.datetime.now(tz=datetime.timezone.utc)
+        self.reused = {}
 
-        def safe_gen_report(*args, **kwargs):
+        def safe_gen_reports(names):
+            queries = {name: CONTENT_QUERIES[name] for name in names}
             try:
-                return gen_report(*args, **kwargs)
+                return gen_reports_batch(server=self.server, queries=queries)
             except Exception as e:
-                print(f"Error generating report {kwargs.get('report_name')}: {e}")
-                return None
-
-        # all terms
-        all_terms = safe_gen_report(server=self.server,
-                               query=("MATCH (c:Class) "
-                                      "WHERE c.short_form STARTS WITH 'FBbt' "
-                                      "WITH c OPTIONAL MATCH (c)-[]->(p:pub) "
-                                      "RETURN COUNT(DISTINCT c) AS parts, "
-                                      "COUNT(DISTINCT p) AS pubs"),
-                               report_name='all_terms')
-        if all_terms is not None:
-              self.all_terms_number = all_terms['parts'][0]
-              self.all_terms_pubs = all_terms['pubs'][0]
-
-        # total nervous system parts
-        all_nervous_system = safe_gen_report(server=self.server,
-                                        query=("MATCH (c:Nervous_system) "
-                                               "WHERE c.short_form STARTS WITH 'FBbt' "
-                                               "WITH c OPTIONAL MATCH (c)-[]->(p:pub) "
-                                               "RETURN COUNT(DISTINCT c) AS parts, "
-                                               "COUNT(DISTINCT p) AS pubs"),
-                                        report_name='all_nervous_system')
-        if all_nervous_system is not None:
-              self.all_nervous_system_number = all_nervous_system['parts'][0]
-              self.all_nervous_system_pubs = all_nervous_system['pubs'][0]
-
-        # numbers of neurons
-        all_neurons = safe_gen_report(server=self.server,
-                                 query=("MATCH (c:Class:Neuron) "
-                                        "WHERE c.short_form STARTS WITH 'FBbt' "
-                                        "WITH c OPTIONAL MATCH (c)-[]->(p:pub) "
-                                        "RETURN COUNT(DISTINCT c) AS neurons, "
-                                        "COUNT(DISTINCT p) AS pubs"),
-                                 report_name='all_neurons')
-
-        provisional_neurons = safe_gen_report(server=self.server,
-                                         query=("MATCH (c:Class:Neuron) "
-                                                "WHERE c.short_form STARTS WITH 'FBbt_2' "
-                                                "WITH c OPTIONAL MATCH (c)-[]->(p:pub) "
-                                                "RETURN COUNT(DISTINCT c) AS neurons, "
-                                                "COUNT(DISTINCT p) AS pubs"),
-                                         report_name='provisional_neurons')
-
-        characterised_neurons = safe_gen_report(server=self.server,
-                                           query=("MATCH (c:Class:Neuron) "
-                                                  "WHERE NOT c.short_form STARTS WITH 'FBbt_2' "
-                                                  "WITH c OPTIONAL MATCH (c)-[]->(p:pub) "
-                                                  "RETURN COUNT(DISTINCT c) AS neurons, "
-                                                  "COUNT(DISTINCT p) AS pubs"),
-                                           report_name='characterized_neurons')
-        if all_neurons is not None:
-              self.total_neuron_number = all_neurons['neurons'][0]
-              self.total_neuron_pub_number = all_neurons['pubs'][0]
-              self.provisional_neuron_number = provisional_neurons['neurons'][0]
-              self.provisional_neuron_pub_number = provisional_neurons['pubs'][0]
-              self.characterised_neuron_number = characterised_neurons['neurons'][0]
-              self.characterised_neuron_pub_number = characterised_neurons['pubs'][0]
-
-        # numbers of regions
-        synaptic_neuropils = safe_gen_report(server=self.server,
-                                        query=("MATCH (c:Synaptic_neuropil) "
-                                               "WHERE c.short_form STARTS WITH 'FBbt' "
-                                               "WITH c OPTIONAL MATCH (c)-[]->(p:pub) "
-                                               "RETURN COUNT(DISTINCT c) AS regions, "
-                                               "COUNT(DISTINCT p) AS pubs"),
-                                        report_name='synaptic_neuropils')
-
-        neuron_projection_bundles = safe_gen_report(server=self.server,
-                                               query=("MATCH (c:Neuron_projection_bundle) "
-                                                      "WHERE c.short_form STARTS WITH 'FBbt' "
-                                                      "WITH c OPTIONAL MATCH "
-                                                      "(c)-[]->(p:pub) "
-                                                      "RETURN COUNT(DISTINCT c) "
-                                                      "AS regions, "
-                                                      "COUNT(DISTINCT p) AS pubs"),
-                                               report_name='neuron_projection_bundles')
-
-        cell_body_rinds = safe_gen_report(server=self.server,
-                                     query=("MATCH (c:Class)-[:SUBCLASSOF*1..2]"
-                                            "->(b:Class) "
-                                            "WHERE c.short_form STARTS WITH 'FBbt' "
-                                            "AND b.short_form = 'FBbt_00100200' "
-                                            "WITH c OPTIONAL MATCH (c)-[]->(p:pub) "
-                                            "RETURN COUNT(DISTINCT c) AS regions, "
-                                            "COUNT(DISTINCT p) AS pubs"),
-                                     report_name='cell_body_rinds')
-
-        all_regions = safe_gen_report(server=self.server,
-                                 query=("MATCH (c:Class) "
-                                        "WHERE c.short_form STARTS WITH 'FBbt' "
-                                        "AND (ANY(x IN ['Synaptic_neuropil', "
-                                        "'Neuron_projection_bundle', 'Ganglion', "
-                                        "'Neuromere'] WHERE x in labels(c)) "
-                                        "OR ((c)-[:SUBCLASSOF]->"
-                                        "(:Class {short_form:'FBbt_00100200'}))) "
-                                        "WITH c OPTIONAL MATCH (c)-[]->(p:pub) "
-                                        "RETURN COUNT(DISTINCT c) AS regions, "
-                                        "COUNT(DISTINCT p) AS pubs"),
-                                 report_name='other_regions')
-        if all_regions is not None:
-              self.all_region_number = all_regions['regions'][0]
-              self.all_region_pub_number = all_regions['pubs'][0]
-              self.synaptic_neuropil_number = synaptic_neuropils['regions'][0]
-              self.synaptic_neuropil_pub_number = synaptic_neuropils['pubs'][0]
-              self.neuron_projection_bundle_number = neuron_projection_bundles['regions'][0]
-              self.neuron_projection_bundle_pub_number = neuron_projection_bundles['pubs'][0]
-              self.cell_body_rind_number = cell_body_rinds['regions'][0]
-              self.cell_body_rind_pub_number = cell_body_rinds['pubs'][0]
-
-        # sense organs
-        sense_organs = safe_gen_report(server=self.server,
-                                  query=("MATCH (c:Class)-[:SUBCLASSOF*]"
-                                         "->(b:Class) "
-                                         "WHERE c.short_form STARTS WITH 'FBbt' "
-                                         "AND b.short_form = 'FBbt_00005155' "
-                                         "WITH c OPTIONAL MATCH (c)-[]->(p:pub) "
-                                         "RETURN COUNT(DISTINCT c) AS types, "
-                                         "COUNT(DISTINCT p) AS pubs"),
-                                  report_name='sense_organs')
-        if sense_organs is not None:
-              self.sense_organ_number = sense_organs['types'][0]
-              self.sense_organ_pubs = sense_organs['pubs'][0]
-
-        # relationships in ontology
-        all_relationships = safe_gen_report(server=self.server,
-                                       query=("MATCH (c:Class)-[r]->(d:Class) "
-                                              "WHERE c.short_form STARTS WITH 'FBbt' "
-                                              "AND ((r.type = 'Related') OR (type(r) = 'SUBCLASSOF')) "
-                                              "RETURN "
-                                              "COUNT(DISTINCT CASE WHEN type(r) = 'SUBCLASSOF' THEN r END) AS isa, "
-                                              "COUNT(DISTINCT CASE WHEN r.type = 'Related' THEN r END) AS non_isa, "
-                                              "COUNT(DISTINCT r) AS total"),
-                                       report_name='all_relationships')
-        if all_relationships is not None:
-              self.non_isa_relationship_number = all_relationships['non_isa'][0]
-              self.isa_relationship_number = all_relationships['isa'][0]
-              self.all_relationship_number = all_relationships['total'][0]
-
-        # nervous system relationships in ontology
-        ns_all_relationships = safe_gen_report(server=self.server,
-                                          query=("MATCH (c:Nervous_system)-[r]->(d:Class) "
-                                                 "WHERE c.short_form STARTS WITH 'FBbt' "
-                                                 "AND ((r.type = 'Related') OR (type(r) = 'SUBCLASSOF')) "
-                                                 "RETURN "
-                                                 "COUNT(DISTINCT CASE WHEN type(r) = 'SUBCLASSOF' THEN r END) AS isa, "
-                                                 "COUNT(DISTINCT CASE WHEN r.type = 'Related' THEN r END) AS non_isa, "
-                                                 "COUNT(DISTINCT r) AS total"),
-                                          report_name='ns_all_relationships')
-        if ns_all_relationships is not None:
-              self.ns_non_isa_relationship_number = ns_all_relationships['non_isa'][0]
-              self.ns_isa_relationship_number = ns_all_relationships['isa'][0]
-              self.ns_all_relationship_number = ns_all_relationships['total'][0]
-
-        # images (excluding hemibrain 1.0.1)
-        all_images = safe_gen_report(server=self.server,
-                                query=("MATCH (i:Individual:has_image)-[:has_source]->(n:DataSet) "
-                                       "WHERE n.production "
-                                       "AND n.short_form<>\"Xu2020Neurons\" "
-                                       "RETURN COUNT(DISTINCT i) AS images, "
-                                       "COUNT(DISTINCT n) AS ds"),
-                                report_name='all_images')
-
-        single_neuron_images = safe_gen_report(server=self.server,
-                                          query=("MATCH (n:DataSet)<-[:has_source]-"
-                                                 "(i:Individual:Neuron:has_image)-"
-                                                 "[:INSTANCEOF]->(c:Class:Neuron) "
-                                                 "WHERE n.production "
-                                                 "AND n.short_form<>\"Xu2020Neurons\" "
-                                                 "RETURN COUNT(DISTINCT i) AS images, "
-                                                 "COUNT(DISTINCT c) AS types"),
-                                          report_name='single_neuron_images')
-
-        exp_pattern_images = safe_gen_report(server=self.server,
-                                        query=("MATCH (n:DataSet)<-[:has_source]-"
-                                               "(i:Individual:Expression_pattern:has_image)-"
-                                               "[:INSTANCEOF]->(c:Class:Expression_pattern) "
-                                               "WHERE n.production "
-                                               "RETURN COUNT(DISTINCT i) AS images, "
-                                               "COUNT(DISTINCT c) AS drivers"),
-                                        report_name='exp_pattern_images')
-
-        split_images = safe_gen_report(server=self.server,
-                                  query=("MATCH (n:DataSet)<-[]-(i:Split:has_image)-"
-                                         "[:INSTANCEOF]->(c:Class:Split) "
-                                         "WHERE n.production "
-                                         "RETURN COUNT(DISTINCT i) AS images, "
-                                         "COUNT(DISTINCT c) AS split_classes"),
-                                  report_name='split_images')
-                                  
-        exp_pattern_fragment_images = safe_gen_report(server=self.server,
-                                        query=("MATCH (n:DataSet)<-[:has_source]-"
-                                               "(i:Individual:Expression_pattern_fragment:has_image)-"
-                                               "[:part_of]->(c:Class:Expression_pattern) "
-                                               "WHERE n.production "
-                                               "RETURN COUNT(DISTINCT i) AS images, "
-                                               "COUNT(DISTINCT c) AS drivers"),
-                                        report_name='exp_pattern_fragment_images')
-        if all_images is not None:
-              self.all_image_number = all_images['images'][0]
-              self.all_image_ds_number = all_images['ds'][0]
-              self.single_neuron_image_number = single_neuron_images['images'][0]
-              self.single_neuron_image_type_number = single_neuron_images['types'][0]
-              self.exp_pattern_number = exp_pattern_images['images'][0]
-              self.split_exp_pattern_driver_number = exp_pattern_images['drivers'][0]
-              self.split_image_number = split_images['images'][0]
-              self.split_image_driver_number = split_images['split_classes'][0]
-              self.exp_pattern_fragment_number = exp_pattern_fragment_images['images'][0]
-              self.split_exp_pattern_fragment_driver_number = exp_pattern_fragment_images['drivers'][0]
-
-        # annotations
-
-        driver_anatomy_annotations = safe_gen_report(server=self.server,
-                                                query=("MATCH (ep:Class:Expression_pattern)<-"
-                                                       "[r:part_of|overlaps]-(j:Individual)-[:INSTANCEOF]->(n:Class) "
-                                                       "WHERE r.pub IS NOT NULL AND n.short_form STARTS WITH 'FBbt' "
-                                                       "RETURN COUNT(DISTINCT ep) AS EPs, COUNT(r) AS annotations, "
-                                                       "COUNT(DISTINCT n) AS anatomy"),
-                                                report_name='driver_anatomy_annotations')
-
-        driver_ns_annotations = safe_gen_report(server=self.server,
-                                                query=("MATCH (ep:Class:Expression_pattern)<-[r:part_of|overlaps]-"
-                                                       "(j:Individual)-[:INSTANCEOF]->(n:Nervous_system:Class) "
-                                                       "WHERE r.pub IS NOT NULL AND n.short_form STARTS WITH 'FBbt' "
-                                                       "RETURN COUNT(DISTINCT ep) AS EPs, COUNT(r) AS annotations, "
-                                                       "COUNT(DISTINCT n) AS anatomy"),
-                                                report_name='driver_ns_annotations')
-
-        driver_neuron_annotations = safe_gen_report(server=self.server,
-                                               query=("MATCH (ep:Class:Expression_pattern)<-[r:part_of]-"
-                                                      "(j:Individual)-[:INSTANCEOF]->(n:Neuron:Class) "
-                                                      "WHERE r.pub IS NOT NULL AND n.short_form STARTS WITH 'FBbt' "
-                                                      "RETURN COUNT(DISTINCT ep) AS EPs, COUNT(r) AS annotations, "
-                                                      "COUNT(DISTINCT n) AS neurons"),
-                                               report_name='driver_neuron_annotations')
-
-        split_neuron_annotations = safe_gen_report(server=self.server,
-                                              query=("MATCH (split:Class:Split)<-[r:part_of]-(j:Individual)-"
-                                                     "[:INSTANCEOF]->(n:Neuron:Class) "
-                                                     "WHERE r.pub IS NOT NULL AND n.short_form STARTS WITH 'FBbt' "
-                                                     "RETURN COUNT(DISTINCT split) AS Splits, COUNT(r) AS "
-                                                     "annotations, COUNT(DISTINCT n) AS neurons"),
-                                              report_name='split_neuron_annotations')
-        if split_neuron_annotations is not None:
-              self.driver_anatomy_annotations_EP_number = driver_anatomy_annotations['EPs'][0]
-              self.driver_anatomy_annotations_annotation_number = driver_anatomy_annotations['annotations'][0]
-              self.driver_anatomy_annotations_anatomy_number = driver_anatomy_annotations['anatomy'][0]
-              self.driver_ns_annotations_EP_number = driver_ns_annotations['EPs'][0]
-              self.driver_ns_annotations_annotation_number = driver_ns_annotations['annotations'][0]
-              self.driver_ns_annotations_anatomy_number = driver_ns_annotations['anatomy'][0]
-              self.driver_neuron_annotations_EP_number = driver_neuron_annotations['EPs'][0]
-              self.driver_neuron_annotations_annotation_number = driver_neuron_annotations['annotations'][0]
-              self.driver_neuron_annotations_neuron_number = driver_neuron_annotations['neurons'][0]
-              self.split_neuron_annotations_split_number = split_neuron_annotations['Splits'][0]
-              self.split_neuron_annotations_annotation_number = split_neuron_annotations['annotations'][0]
-              self.split_neuron_annotations_neuron_number = split_neuron_annotations['neurons'][0]
-
-        # connectivity
-
-        neuron_connections = safe_gen_report(server=self.server,
-                                        query=("MATCH (i:Individual:Neuron)-[r:synapsed_to]->"
-                                               "(j:Individual:Neuron) "
-                                               "WITH COLLECT(r) AS rels, COLLECT(DISTINCT i) AS ci, "
-                                               "COLLECT(DISTINCT j) AS cj "
-                                               "RETURN SIZE(apoc.coll.union(ci,cj)) AS neurons, "
-                                               "SIZE(rels) AS connections"),
-                                        report_name='synaptic_connections')
-        if neuron_connections is not None:
-              self.neuron_connections_neuron_number = neuron_connections['neurons'][0]
-              self.neuron_connections_connection_number = neuron_connections['connections'][0]
-
-        region_connections = safe_gen_report(server=self.server,
-                                        query=("MATCH (n:Individual:Neuron)-"
-                                               "[r:has_presynaptic_terminals_in|has_postsynaptic_terminal_in]"
-                                               "->(m:Individual) "
-                                               "RETURN COUNT(DISTINCT n) AS neurons, COUNT(DISTINCT m) AS regions, "
-                                               "COUNT(DISTINCT r) AS connections"),
-                                        report_name='synaptic_connections')
-
-        self.region_connections_neuron_number = region_connections['neurons'][0]
-        self.region_connections_region_number = region_connections['regions'][0]
-        self.region_connections_connection_number = region_connections['connections'][0]
-
-        muscle_connections = safe_gen_report(server=self.server,
-                                        query=("MATCH (n:Neuron)-[r:synapsed_to|"
-                                               "synapsed_via_type_Is_bouton_to|"
-                                               "synapsed_via_type_Ib_bouton_to|"
-                                               "synapsed_via_type_II_bouton_to|"
-                                               "synapsed_via_type_III_bouton_to]->(m:Muscle) "
-                                               "WITH n, r, m OPTIONAL MATCH (n2:Neuron)-[:SUBCLASSOF*]->(n) "
-                                               "WITH COLLECT(DISTINCT r) AS rels, COLLECT(DISTINCT n) AS cn, "
-                                               "COLLECT(DISTINCT n2) AS cn2, COLLECT(DISTINCT m) AS cm "
-                                               "RETURN SIZE(apoc.coll.union(cn,cn2)) AS neurons, "
-                                               "SIZE(cm) AS muscles, SIZE(rels) AS connections"),
-                                        report_name='muscle_connections')
-        if muscle_connections is not None:
-              self.muscle_connections_neuron_number = muscle_connections['neurons'][0]
-              self.muscle_connections_muscle_number = muscle_connections['muscles'][0]
-              self.muscle_connections_connection_number = muscle_connections['connections'][0]
-
-        sensory_connections = safe_gen_report(server=self.server,
-                                         query=("MATCH (n:Neuron)-[r:has_sensory_dendrite_in]->(s:Sense_organ) "
-                                                "WITH n, r, s OPTIONAL MATCH (n2:Neuron)-[:SUBCLASSOF*]->(n) "
-                                                "WITH COLLECT(DISTINCT r) AS rels, COLLECT(DISTINCT n) AS cn, "
-                                                "COLLECT(DISTINCT n2) AS cn2, COLLECT(DISTINCT s) AS cs "
-                                                "RETURN SIZE(apoc.coll.union(cn,cn2)) AS neurons, "
-                                                "SIZE(cs) AS sense_organs, SIZE(rels) AS connections"),
-                                         report_name='sensory_connections')
-
-        if sensory_connections is not None:
-              self.sensory_connections_neuron_number = sensory_connections['neurons'][0]
-              self.sensory_connections_sense_organ_number = sensory_connections['sense_organs'][0]
-              self.sensory_connections_connection_number = sensory_connections['connections'][0]
-
-        # per-EM-project neuron and synapse counts
-        self.em_project_data = safe_gen_report(server=self.server,
-                                        query=("MATCH (n:Neuron:Individual)-[:database_cross_reference]->"
-                                               "(d:Site:Connectome:Individual) "
-                                               "OPTIONAL MATCH (n)-[r:synapsed_to]->(m:Neuron:Individual) "
-                                               "RETURN d.short_form AS `EM Project`, "
-                                               "count(distinct n) AS Neurons, "
-                                               "sum(r.weight[0]) AS Synapses, "
-                                               "count(r) AS Edges ORDER BY Neurons DESC"),
-                                        report_name='em_project_data')
-
-        # Template data (excluding hemibrain v1.0.1)
-
-        self.templates_data = safe_gen_report(server=self.server,
-                                         query=("MATCH (d:DataSet)<-[:has_source]-(i:Individual)<-[:depicts]-"
-                                                "(m:Individual)-[:in_register_with]->"
-                                                "(:Template)-[:depicts]->(t:Template) "
-                                                "WHERE d.short_form<>\"Xu2020Neurons\" "
-                                                "OPTIONAL MATCH (m)-[:depicts]->(n:Individual:Neuron) "
-                                                "OPTIONAL MATCH em = (m)-[:is_specified_output_of]->(e) "
-                                                "WHERE e.label CONTAINS \"electron microscopy\" "
-                                                "OPTIONAL MATCH (m)-[:depicts]->(ep:Individual:Expression_pattern) "
-                                                "OPTIONAL MATCH (m)-[:depicts]->"
-                                                "(epf:Individual:Expression_pattern_fragment) "
-                                                "OPTIONAL MATCH (m)-[:depicts]->"
-                                                "(s:Individual:Expression_pattern:Split) "
-                                                "OPTIONAL MATCH pd = (m)-[:is_specified_output_of]->"
-                                                "({label:\"computer graphic\"}) "
-                                                "RETURN DISTINCT t.label AS template, COUNT(DISTINCT m) AS images, "
-                                                "COUNT(DISTINCT d) AS datasets, "
-                                                "COUNT(DISTINCT n) AS single_neuron_images, "
-                                                "COUNT(DISTINCT em) AS em_images, "
-                                                "COUNT(DISTINCT ep) AS expression_patterns, "
-                                                "COUNT(DISTINCT s) AS split_images, "
-                                                "COUNT(DISTINCT epf) AS expression_pattern_fragments, "
-                                                "COUNT(DISTINCT pd) AS painted_domains"),
-                                         report_name='templates_data')
+                print(f"Error generating reports {', '.join(queries)}: {e}")
+                return dict.fromkeys(queries)
+
+        def value(report, column):
+            return None if report is None else report[column][0]
+
+        reports = {}
+        stored = {}
+        counts = {}
+        if state_file:
+            stored = load_state(state_file).get(self.server[0], {})
+            counts = self._dependency_counts()
+        for name, last in stored.items():
+            if not refresh and name in CONTENT_QUERIES and self._reusable(last, counts.get(name)):
+                reports[name] = pd.DataFrame(last['data'], columns=last['columns'])
+                reports[name].name = name
+                self.reused[name] = last['computed']
+        if self.reused:
+            print("Reusing %d content queries whose dependencies are unchanged: %s"
+                  % (len(self.reused), ', '.join(self.reused)))
+        blocks = [[name for name in names if name not in reports] for names in CONTENT_BLOCKS.values()]
+        with ThreadPoolExecutor(max_workers=max_per_server) as pool:
+            for block in pool.map(deadlines.bind(safe_gen_reports), [b for b in blocks if b]):
+                reports.update(block)
+        if state_file:
+            results = {name: stored[name] for name in self.reused}
+            for name, report in reports.items():
+                if name not in self.reused and report is not None:
+                    results[name] = dict(json.loads(report.to_json(orient='split', index=False)),
+                                         counts=counts.get(name), computed=self.timestamp.isoformat())
+            save_state(state_file, self.server[0], results)
+
+        self.all_terms_number = value(reports['classes'], 'all_terms')
+        self.all_terms_pubs = value(reports['classes'], 'all_terms_pubs')
+        self.all_nervous_system_number = value(reports['classes'], 'all_nervous_system')
+        self.all_nervous_system_pubs = value(reports['classes'], 'all_nervous_system_pubs')
+        self.total_neuron_number = value(reports['classes'], 'all_neurons')
+        self.total_neuron_pub_number = value(reports['classes'], 'all_neurons_pubs')
+        self.provisional_neuron_number = value(reports['classes'], 'provisional_neurons')
+        self.provisional_neuron_pub_number = value(reports['classes'], 'provisional_neurons_pubs')
+        self.characterised_neuron_number = value(reports['classes'], 'characterized_neurons')
+        self.characterised_neuron_pub_number = value(reports['classes'], 'characterized_neurons_pubs')
+        self.all_region_number = value(reports['classes'], 'other_regions')
+        self.all_region_pub_number = value(reports['classes'], 'other_regions_pubs')
+        self.synaptic_neuropil_number = value(reports['classes'], 'synaptic_neuropils')
+        self.synaptic_neuropil_pub_number = value(reports['classes'], 'synaptic_neuropils_pubs')
+        self.neuron_projection_bundle_number = value(reports['classes'], 'neuron_projection_bundles')
+        self.neuron_projection_bundle_pub_number = value(reports['classes'], 'neuron_projection_bundles_pubs')
+        self.cell_body_rind_number = value(reports['classes'], 'cell_body_rinds')
+        self.cell_body_rind_pub_number = value(reports['classes'], 'cell_body_rinds_pubs')
+        self.sense_organ_number = value(reports['classes'], 'sense_organs')
+        self.sense_organ_pubs = value(reports['classes'], 'sense_organs_pubs')
+        self.non_isa_relationship_number = value(reports['relationships'], 'non_isa')
+        self.isa_relationship_number = value(reports['relationships'], 'isa')
+        self.all_relationship_number = value(reports['relationships'], 'total')
+        self.ns_non_isa_relationship_number = value(reports['relationships'], 'ns_non_isa')
+        self.ns_isa_relationship_number = value(reports['relationships'], 'ns_isa')
+        self.ns_all_relationship_number = value(reports['relationships'], 'ns_total')
+
+        self.all_image_number = value(reports['all_images'], 'images')
+        self.all_image_ds_number = value(reports['all_images'], 'ds')
+        self.single_neuron_image_number = value(reports['single_neuron_images'], 'images')
+        self.single_neuron_image_type_number = value(reports['single_neuron_images'], 'types')
+        self.exp_pattern_number = value(reports['exp_pattern_images'], 'images')
+        self.split_exp_pattern_driver_number = value(reports['exp_pattern_images'], 'drivers')
+        self.split_image_number = value(reports['split_images'], 'images')
+        self.split_image_driver_number = value(reports['split_images'], 'split_classes')
+        self.exp_pattern_fragment_number = value(reports['exp_pattern_fragment_images'], 'images')
+        self.split_exp_pattern_fragment_driver_number = value(reports['exp_pattern_fragment_images'], 'drivers')
+
+        self.driver_anatomy_annotations_EP_number = value(reports['driver_anatomy_annotations'], 'EPs')
+        self.driver_anatomy_annotations_annotation_number = \
+            value(reports['driver_anatomy_annotations'], 'annotations')
+        self.driver_anatomy_annotations_anatomy_number = value(reports['driver_anatomy_annotations'], 'anatomy')
+        self.driver_ns_annotations_EP_number = value(reports['driver_ns_annotations'], 'EPs')
+        self.driver_ns_annotations_annotation_number = value(reports['driver_ns_annotations'], 'annotations')
+        self.driver_ns_annotations_anatomy_number = value(reports['driver_ns_annotations'], 'anatomy')
+        self.driver_neuron_annotations_EP_number = value(reports['driver_neuron_annotations'], 'EPs')
+        self.driver_neuron_annotations_annotation_number = \
+            value(reports['driver_neuron_annotations'], 'annotations')
+        self.driver_neuron_annotations_neuron_number = value(reports['driver_neuron_annotations'], 'neurons')
+        self.split_neuron_annotations_split_number = value(reports['split_neuron_annotations'], 'Splits')
+        self.split_neuron_annotations_annotation_number = \
+            value(reports['split_neuron_annotations'], 'annotations')
+        self.split_neuron_annotations_neuron_number = value(reports['split_neuron_annotations'], 'neurons')
+
+        self.neuron_connections_neuron_number = value(reports['synaptic_connections'], 'neurons')
+        self.neuron_connections_connection_number = value(reports['synaptic_connections'], 'connections')
+        self.region_connections_neuron_number = value(reports['region_connections'], 'neurons')
+        self.region_connections_region_number = value(reports['region_connections'], 'regions')
+        self.region_connections_connection_number = value(reports['region_connections'], 'connections')
+        self.muscle_connections_neuron_number = value(reports['muscle_connections'], 'neurons')
+        self.muscle_connections_muscle_number = value(reports['muscle_connections'], 'muscles')
+        self.muscle_connections_connection_number = value(reports['muscle_connections'], 'connections')
+        self.sensory_connections_neuron_number = value(reports['sensory_connections'], 'neurons')
+        self.sensory_connections_sense_organ_number = value(reports['sensory_connections'], 'sense_organs')
+        self.sensory_connections_connection_number = value(reports['sensory_connections'], 'connections')
+        self.em_project_data = reports['em_project_data']
+
+        self.templates_data = reports['templates_data']
         if self.templates_data is not None:
               self.templates_data.set_index('template', inplace=True, verify_integrity=True)
               self.templates_data.sort_values(by='datasets', ascending=False, inplace=True)
 
-        # scRNAseq totals
-        scrnaseq = safe_gen_report(server=self.server,
-                                   query=("MATCH (cl:Cluster:Individual)-[:has_source]->"
-                                          "(ds:scRNAseq_DataSet:Individual) "
-                                          "WITH COLLECT(DISTINCT cl) AS clusters, "
-                                          "COLLECT(DISTINCT ds) AS datasets "
-                                          "UNWIND clusters AS cl "
-                                          "OPTIONAL MATCH (cl)-[:composed_primarily_of]->(a:Class) "
-                                          "WHERE a.short_form STARTS WITH 'FBbt' "
-                                          "OPTIONAL MATCH (cl)-[:expresses]->(g:Gene) "
-                                          "RETURN SIZE(clusters) AS total_clusters, "
-                                          "COUNT(DISTINCT a) AS distinct_anatomy, "
-                                          "COUNT(DISTINCT g) AS distinct_genes, "
-                                          "SIZE(datasets) AS datasets"),
-                                   report_name='scrnaseq_totals')
-        if scrnaseq is not None:
-              self.scrnaseq_dataset_number = scrnaseq['datasets'][0]
-              self.scrnaseq_cluster_number = scrnaseq['total_clusters'][0]
-              self.scrnaseq_anatomy_number = scrnaseq['distinct_anatomy'][0]
-              self.scrnaseq_gene_number = scrnaseq['distinct_genes'][0]
-
+        scrnaseq = reports['scrnaseq_totals']
+        self.scrnaseq_dataset_number = value(scrnaseq, 'datasets')
+        self.scrnaseq_cluster_number = value(scrnaseq, 'total_clusters')
+        self.scrnaseq_anatomy_number = value(scrnaseq, 'distinct_anatomy')
+        self.scrnaseq_gene_number = value(scrnaseq, 'distinct_genes')
+
+
+    def _dependency_counts(self):
+        """The counts of each query's dependencies (see dependency_counts), or {} if they can't be counted."""
+        try:
+            census = label_census(self.server)
+        except Exception as e:
+            print("Failed to count labels on %s, so running every query: %s" % (self.server[0], e))
+            return {}
+        return {name: dependency_counts(census, name) for name in CONTENT_DEPENDENCIES}
+
+    def _reusable(self, last, counts):
+        """Whether a query's last result (from the state file) can be reused, given its dependency counts now."""
+        if not counts or None in counts.values() or last.get('counts') != counts:
+            return False
+        age = self.timestamp - datetime.datetime.fromisoformat(last['computed'])
+        return age < datetime.timedelta(days=REUSE_DAYS)
+
+    def to_dict(self):
+        """All of the report's data, as a dict that can be saved as JSON (see from_dict)."""
+        data = {'version': SNAPSHOT_VERSION, 'server': self.server[0],
+                'timestamp': self.timestamp.isoformat() if self.timestamp else None}
+        for name, v in vars(self).items():
+            if name in ('server', 'timestamp'):
+                continue
+            if isinstance(v, pd.DataFrame):
+                v = json.loads((v.reset_index() if name == 'templates_data' else v).to_json(orient='split',
+                                                                                            index=False))
+            elif hasattr(v, 'item'):  # numpy scalars
+                v = v.item()
+            data[name] = v
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """A report from its data (see to_dict), ready to render without querying a server."""
+        if data.get('version') != SNAPSHOT_VERSION:
+            raise ValueError("Unsupported content report snapshot version: %s" % data.get('version'))
+        report = cls(next((s for s in VFB_servers.values() if s[0] == data['server']), (data['server'],)))
+        report.timestamp = data['timestamp'] and datetime.datetime.fromisoformat(data['timestamp'])
+        for name, v in data.items():
+            if name in ('version', 'server', 'timestamp'):
+                continue
+            if name in ('em_project_data', 'templates_data') and v is not None:
+                v = pd.DataFrame(v['data'], columns=v['columns'])
+                if name == 'templates_data':
+                    v.set_index('template', inplace=True)
+            setattr(report, name, v)
+        return report
+
+    def save(self, filename):
+        """Saves the report's data as JSON (see to_dict)."""
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        with open(filename + '.part', 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+        os.replace(filename + '.part', filename)
+
+    @classmethod
+    def load(cls, filename):
+        """Loads a report saved with save."""
+        with open(filename) as f:
+            return cls.from_dict(json.load(f))
+
+    def metrics(self):
+        """The single-value content counts, as a dict of attribute name: value."""
+        return {k: v for k, v in vars(self).items() if k.endswith(('_number', '_pubs')) and v is not None}
+
+    def record_history(self, history, report_name='content'):
+        """Appends the content counts, per-EM-project counts and per-template counts to a
+        report_history.ReportHistory, as snapshots of report_name, report_name + '_em_projects'
+        and report_name + '_templates' taken at self.timestamp."""
+        history.record_metrics(report_name, self.server, self.metrics(), taken_at=self.timestamp)
+        if self.em_project_data is not None:
+            history.record_report(report_name + '_em_projects', self.server, self.em_project_data,
+                                  ['EM Project'], taken_at=self.timestamp)
+        if self.templates_data is not None:
+            history.record_report(report_name + '_templates', self.server, self.templates_data.reset_index(),
+                                  ['template'], taken_at=self.timestamp)
 
     def prepare_report(self, filename):
         """Put content data into an output file"""
         f = mdutils.MdUtils(file_name=filename, title='VFB Content Report ' +
-                                                      self.timestamp.date().isoformat())
-        f.new_paragraph("Report of content found at ``%s`` on ``%s``"
-                        % (self.server[0],
-                           self.timestamp.strftime("%a, %d %b %Y %H:%M:%S")))
+                                                      (self.timestamp.date().isoformat() if self.timestamp else ''))
+        f.new_paragraph("Report of content found at ``%s`` on ``%s``" % (self.server[0], _when(self.timestamp)))
         f.new_line()
         f.new_line("Ontology Content", bold_italics_code='bic')
         f.new_line()
@@ -605,20 +698,22 @@ class VFBContentReport:
         f.new_line("(excludes hemibrain v1.0.1)", bold_italics_code='ic')
 
         f.new_line()
-        template_table_content = ['Template Name', 'Datasets', 'Images', 'Single Neurons', 'EM Neurons',
-                                  'Full Expression Patterns', 'Split Expression Patterns',
-                                  'Partial Expression Patterns', 'Painted domains']
-        for t in self.templates_data.index:
-            template_table_content.extend([t, self.templates_data['datasets'][t], self.templates_data['images'][t],
-                                           self.templates_data['single_neuron_images'][t],
-                                           self.templates_data['em_images'][t],
-                                           self.templates_data['expression_patterns'][t],
-                                           self.templates_data['split_images'][t],
-                                           self.templates_data['expression_pattern_fragments'][t],
-                                           self.templates_data['painted_domains'][t]])
-
-        f.new_table(columns=9, rows=(len(self.templates_data.index) + 1), text=template_table_content, text_align='left')
-        f.new_line()
+        if self.templates_data is not None:
+            template_table_content = ['Template Name', 'Datasets', 'Images', 'Single Neurons', 'EM Neurons',
+                                      'Full Expression Patterns', 'Split Expression Patterns',
+                                      'Partial Expression Patterns', 'Painted domains']
+            for t in self.templates_data.index:
+                template_table_content.extend([t, self.templates_data['datasets'][t], self.templates_data['images'][t],
+                                               self.templates_data['single_neuron_images'][t],
+                                               self.templates_data['em_images'][t],
+                                               self.templates_data['expression_patterns'][t],
+                                               self.templates_data['split_images'][t],
+                                               self.templates_data['expression_pattern_fragments'][t],
+                                               self.templates_data['painted_domains'][t]])
+
+            f.new_table(columns=9, rows=(len(self.templates_data.index) + 1), text=template_table_content,
+                        text_align='left')
+            f.new_line()
 
         f.new_line()
         f.new_line("scRNAseq Data", bold_italics_code='bic')
@@ -634,13 +729,127 @@ class VFBContentReport:
         f.new_line('See the [scRNAseq dataset report](scRNAseq_DataSets.tsv) for per-dataset '
                    'cluster and gene counts.')
 
+        if self.reused:
+            f.new_line()
+            f.new_line("Reused Values", bold_italics_code='bic')
+            f.new_line()
+            f.new_line('The values from these queries were not computed again for this report, as the numbers of '
+                       'nodes and relationships they count have not changed since they were last computed:')
+            f.new_line()
+            reused_table_content = ['Query', 'Last computed']
+            for name, computed in sorted(self.reused.items(), key=lambda item: list(CONTENT_QUERIES).index(item[0])):
+                reused_table_content.extend([name, datetime.datetime.fromisoformat(computed).strftime(
+                    "%a, %d %b %Y %H:%M:%S")])
+            f.new_table(columns=2, rows=(len(self.reused) + 1), text=reused_table_content, text_align='left')
+
         f.create_md_file()
 
 
-if __name__ == "__main__":
-    # problems with connecting to 'pdb-alpha' and 'pdb-preview', consider adding later
-    for s in ['pdb']:
-        report = VFBContentReport(server=VFB_servers[s])
-        report.get_info()
-        report.prepare_report(filename=output_files[s])
+def run_content_report(name, state_file=CONTENT_STATE_FILE, history=None):
+    """Queries the server name (in VFB_servers) for a content report, saves it and renders it.
+    Returns the report."""
+    report = VFBContentReport(server=VFB_servers[name])
+    report.get_info(state_file=state_file)
+    report.save(snapshot_files[name])
+    report.prepare_report(filename=output_files[name])
+    if history:
+        report.record_history(history)
+    return report
+
+
+def run_content_reports(servers=tuple(VFB_servers), timeout=None, state_file=CONTENT_STATE_FILE, history=None):
+    """Runs the content reports for several servers (names in VFB_servers) concurrently, each within
+    timeout seconds (and any deadline of the caller) and failing on its own, then writes the delta
+    report comparing them (if there is more than one).
+    Returns a dict of server name: VFBContentReport and one of server name: exception for those that failed."""
+    outer = deadlines.current()
+    if outer:
+        timeout = outer.remaining() if timeout is None else min(timeout, outer.remaining())
+    reports, failures = reporting_tools.run_reports(
+        {s: (VFB_servers[s], lambda s=s: run_content_report(s, state_file=state_file, history=history), [])
+         for s in servers}, timeout=timeout)
+    reports = {s: reports[s] for s in servers if s in reports}
+    if len(servers) > 1:
+        prepare_delta_report(reports, delta_file, failures=failures)
+    return reports, failures
+
+
+def _difference(value, reference):
+    if isinstance(value, bool) or not isinstance(value, numbers.Number) \
+            or isinstance(reference, bool) or not isinstance(reference, numbers.Number):
+        return ''
+    difference = value - reference
+    return '%+d' % difference if float(difference).is_integer() else '%+g' % difference
+
+
+def _when(timestamp):
+    """A report's timestamp as shown in the markdown reports; reports that were never run have none."""
+    return timestamp.strftime("%a, %d %b %Y %H:%M:%S") if timestamp else 'unknown date'
+
+
+def prepare_delta_report(reports, filename, reference='pdb', failures=None):
+    """Writes every content count of several servers' reports (dict of server name: VFBContentReport)
+    to one markdown table, giving each server's value next to the reference server's and the difference.
+    failures: dict of server name: exception for servers whose report failed."""
+    others = [name for name in reports if name != reference]
+    f = mdutils.MdUtils(file_name=filename, title='VFB Content Report Changes ' +
+                                                  datetime.datetime.now(tz=datetime.timezone.utc).date().isoformat())
+    f.new_paragraph("Content counts of each server compared with ``%s``" % reference)
+    f.new_line()
+    for name, report in reports.items():
+        f.new_line("``%s``: %s on %s" % (name, report.server[0], _when(report.timestamp)))
+    for name, e in (failures or {}).items():
+        f.new_line("``%s``: failed (%s)" % (name, e))
+    f.new_line()
+    metrics = list(dict.fromkeys(m for report in reports.values() for m in report.metrics()))
+    table_content = ['Metric', reference]
+    for name in others:
+        table_content.extend([name, 'Difference (%s)' % name])
+    for metric in metrics:
+        reference_value = getattr(reports[reference], metric) if reference in reports else None
+        table_content.extend([metric, '' if reference_value is None else str(reference_value)])
+        for name in others:
+            value = getattr(reports[name], metric)
+            table_content.extend(['' if value is None else str(value), _difference(value, reference_value)])
+    f.new_table(columns=2 + 2 * len(others), rows=len(metrics) + 1, text=table_content, text_align='left')
+    f.create_md_file()
+
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reports on the content of VFB servers.")
+    parser.add_argument('--servers', nargs='+', choices=list(VFB_servers), default=list(VFB_servers),
+                        help="servers to report on (default all)")
+    parser.add_argument('--report-timeout', type=float, default=deadlines.REPORT_TIMEOUT,
+                        help="seconds each server's report may take before its remaining queries are abandoned "
+                             "(0 for no limit)")
+    parser.add_argument('--render-only', action='store_true',
+                        help="render the reports from their last saved snapshots, without querying the servers")
+    parser.add_argument('--render', nargs='+', metavar='SNAPSHOT',
+                        help="render saved snapshots (e.g. an old content_report.json), "
+                             "each to a .md file of the same name")
+    args = parser.parse_args()
+    if args.render:
+        for snapshot in args.render:
+            VFBContentReport.load(snapshot).prepare_report(filename=os.path.splitext(snapshot)[0] + '.md')
+        sys.exit()
+    if args.render_only:
+        reports = {}
+        failures = {}
+        for s in args.servers:
+            try:
+                reports[s] = VFBContentReport.load(snapshot_files[s])
+            except OSError as e:
+                failures[s] = e
+                print("No snapshot of %s: %s" % (s, e))
+                continue
+            reports[s].prepare_report(filename=output_files[s])
+        if len(args.servers) > 1:
+            prepare_delta_report(reports, delta_file, failures=failures)
+    else:
+        reports, failures = run_content_reports(args.servers, timeout=args.report_timeout or None,
+                                                history=ReportHistory.from_env())
+    if reporting_tools.query_cache:
+        reporting_tools.query_cache.print_stats()
+    # the pdb report is the one published
+    if 'pdb' in failures:
+        sys.exit(1)
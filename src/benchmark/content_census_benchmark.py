@@ -0,0 +1,118 @@
+"""Total db hits of the content report's ontology counts: one query per category (as the
+content report used to count them) against the shared census scans (ONTOLOGY_CENSUS in
+VFB_content_report_generator).  Every query is run under PROFILE on a real server; the
+counts from both are compared, so this also checks the census gives the same numbers.
+
+Run from src:
+    python ./benchmark/content_census_benchmark.py --server http://pdb.virtualflybrain.org
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from query_plans import summarize, totals
+from reporting_tools import _post_statements, _statement, decode_results, get_connection
+from VFB_content_report_generator import ONTOLOGY_CENSUS
+
+
+def _class_query(match, where, column):
+    return ("MATCH %s WHERE %s WITH c OPTIONAL MATCH (c)-[]->(p:pub) "
+            "RETURN COUNT(DISTINCT c) AS %s, COUNT(DISTINCT p) AS pubs" % (match, where, column))
+
+
+def _relationship_query(match):
+    return ("MATCH %s WHERE c.short_form STARTS WITH 'FBbt' "
+            "AND ((r.type = 'Related') OR (type(r) = 'SUBCLASSOF')) RETURN "
+            "COUNT(DISTINCT CASE WHEN type(r) = 'SUBCLASSOF' THEN r END) AS isa, "
+            "COUNT(DISTINCT CASE WHEN r.type = 'Related' THEN r END) AS non_isa, "
+            "COUNT(DISTINCT r) AS total" % match)
+
+
+FBBT = "c.short_form STARTS WITH 'FBbt'"
+
+# the separate queries: name: (query, {column: (census query, census column)})
+SEPARATE_QUERIES = {
+    'all_terms': (_class_query("(c:Class)", FBBT, 'parts'),
+                  {'parts': ('classes', 'all_terms'), 'pubs': ('classes', 'all_terms_pubs')}),
+    'all_nervous_system': (_class_query("(c:Nervous_system)", FBBT, 'parts'),
+                           {'parts': ('classes', 'all_nervous_system'),
+                            'pubs': ('classes', 'all_nervous_system_pubs')}),
+    'all_neurons': (_class_query("(c:Class:Neuron)", FBBT, 'neurons'),
+                    {'neurons': ('classes', 'all_neurons'), 'pubs': ('classes', 'all_neurons_pubs')}),
+    'provisional_neurons': (_class_query("(c:Class:Neuron)", "c.short_form STARTS WITH 'FBbt_2'", 'neurons'),
+                            {'neurons': ('classes', 'provisional_neurons'),
+                             'pubs': ('classes', 'provisional_neurons_pubs')}),
+    'characterized_neurons': (_class_query("(c:Class:Neuron)", "NOT c.short_form STARTS WITH 'FBbt_2'", 'neurons'),
+                              {'neurons': ('classes', 'characterized_neurons'),
+                               'pubs': ('classes', 'characterized_neurons_pubs')}),
+    'synaptic_neuropils': (_class_query("(c:Synaptic_neuropil)", FBBT, 'regions'),
+                           {'regions': ('classes', 'synaptic_neuropils'),
+                            'pubs': ('classes', 'synaptic_neuropils_pubs')}),
+    'neuron_projection_bundles': (_class_query("(c:Neuron_projection_bundle)", FBBT, 'regions'),
+                                  {'regions': ('classes', 'neuron_projection_bundles'),
+                                   'pubs': ('classes', 'neuron_projection_bundles_pubs')}),
+    'cell_body_rinds': (_class_query("(c:Class)-[:SUBCLASSOF*1..2]->(b:Class)",
+                                     FBBT + " AND b.short_form = 'FBbt_00100200'", 'regions'),
+                        {'regions': ('classes', 'cell_body_rinds'), 'pubs': ('classes', 'cell_body_rinds_pubs')}),
+    'other_regions': (_class_query("(c:Class)", FBBT + " AND (ANY(x IN ['Synaptic_neuropil', "
+                                   "'Neuron_projection_bundle', 'Ganglion', 'Neuromere'] WHERE x in labels(c)) "
+                                   "OR ((c)-[:SUBCLASSOF]->(:Class {short_form:'FBbt_00100200'})))", 'regions'),
+                      {'regions': ('classes', 'other_regions'), 'pubs': ('classes', 'other_regions_pubs')}),
+    'sense_organs': (_class_query("(c:Class)-[:SUBCLASSOF*]->(b:Class)",
+                                  FBBT + " AND b.short_form = 'FBbt_00005155'", 'types'),
+                     {'types': ('classes', 'sense_organs'), 'pubs': ('classes', 'sense_organs_pubs')}),
+    'all_relationships': (_relationship_query("(c:Class)-[r]->(d:Class)"),
+                          {'isa': ('relationships', 'isa'), 'non_isa': ('relationships', 'non_isa'),
+                           'total': ('relationships', 'total')}),
+    'ns_all_relationships': (_relationship_query("(c:Nervous_system)-[r]->(d:Class)"),
+                             {'isa': ('relationships', 'ns_isa'), 'non_isa': ('relationships', 'ns_non_isa'),
+                              'total': ('relationships', 'ns_total')}),
+}
+
+
+def profile(nc, query):
+    """Runs a query under PROFILE; returns its single row (as a dict), total db hits and seconds taken."""
+    start = time.time()
+    result = decode_results(_post_statements(nc, [_statement('PROFILE ' + query)]))[0]
+    seconds = time.time() - start
+    db_hits, _ = totals(summarize(result['profile']))
+    return dict(zip(result['columns'], result['data'][0]['row'])), db_hits, seconds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', default='http://pdb.virtualflybrain.org')
+    parser.add_argument('--user', default='neo4j')
+    parser.add_argument('--password', default='vfb')
+    parser.add_argument('--json', help="save the results to this file")
+    args = parser.parse_args()
+    nc = get_connection((args.server, args.user, args.password))
+
+    results = {'separate': {}, 'census': {}}
+    census_rows = {}
+    for name, query in ONTOLOGY_CENSUS.items():
+        census_rows[name], db_hits, seconds = profile(nc, query)
+        results['census'][name] = {'db_hits': db_hits, 'seconds': seconds}
+    mismatches = []
+    for name, (query, columns) in SEPARATE_QUERIES.items():
+        row, db_hits, seconds = profile(nc, query)
+        results['separate'][name] = {'db_hits': db_hits, 'seconds': seconds}
+        for column, (census, census_column) in columns.items():
+            if row[column] != census_rows[census][census_column]:
+                mismatches.append("%s.%s = %s, census %s.%s = %s" % (name, column, row[column], census,
+                                                                      census_column, census_rows[census][census_column]))
+
+    for method, queries in results.items():
+        for name, r in queries.items():
+            print("%-10s %-28s %14d db hits %8.1fs" % (method, name, r['db_hits'], r['seconds']))
+    separate_hits = sum(r['db_hits'] for r in results['separate'].values())
+    census_hits = sum(r['db_hits'] for r in results['census'].values())
+    print("Total db hits: %d in %d separate queries, %d in %d census queries (%.1fx fewer)"
+          % (separate_hits, len(SEPARATE_QUERIES), census_hits, len(ONTOLOGY_CENSUS), separate_hits / census_hits))
+    print("Counts differ: " + '; '.join(mismatches) if mismatches else "Counts are the same")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
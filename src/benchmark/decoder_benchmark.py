@@ -0,0 +1,85 @@
+"""Benchmarks decoding of a Neo4j transactional endpoint response into a dataframe:
+the current path (json -> results_2_dict_list -> DataFrame.from_records) against
+the columnar decoder in reporting_tools (decode_results -> results_2_frame).
+
+Run from src, either on a recorded response:
+    python ./benchmark/decoder_benchmark.py --payload response.json
+or on a synthetic one (default):
+    python ./benchmark/decoder_benchmark.py --rows 1000000
+A response can be recorded from a live server with:
+    python ./benchmark/decoder_benchmark.py --record response.json --server http://pdb.virtualflybrain.org --query "..."
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from uk.ac.ebi.vfb.neo4j.neo4j_tools import results_2_dict_list
+from reporting_tools import _post_statements, decode_results, get_connection, results_2_frame
+import pandas as pd
+
+
+def synthetic_payload(rows):
+    """Payload shaped like an Individual-level report: IDs, labels, a count and a list column."""
+    data = [{'row': ['VFB_%08d' % i, 'neuron %d of dataset %d' % (i, i % 50), 'Xu2020Neurons' if i % 2 else 'Dolan2019',
+                     i % 1000, ['FBbt_%08d' % (i % 7000), 'FBbt_00005106']],
+             'meta': [None, None, None, None, None]} for i in range(rows)]
+    return json.dumps({'results': [{'columns': ['VFB_ID', 'label', 'dataset', 'count', 'FBbt_IDs'],
+                                    'data': data}], 'errors': []}).encode('utf-8')
+
+
+def current_path(content):
+    results = json.loads(content)['results']
+    return pd.DataFrame.from_records(results_2_dict_list(results))
+
+
+def columnar_path(content):
+    return results_2_frame(decode_results(content))
+
+
+def measure(func, content, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(content)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func(content)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--payload', help='recorded transactional endpoint response (JSON)')
+    parser.add_argument('--rows', type=int, default=500000, help='rows in synthetic payload')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--record', help='record a response to this file instead of benchmarking')
+    parser.add_argument('--server', default='http://pdb.virtualflybrain.org')
+    parser.add_argument('--query', default="MATCH (i:Individual)-[:INSTANCEOF]->(c:Class) "
+                                           "RETURN i.short_form AS ind_ID, COLLECT(c.short_form) AS FBbt_IDs")
+    args = parser.parse_args()
+
+    if args.record:
+        response = _post_statements(get_connection((args.server, 'neo4j', 'vfb')), [{'statement': args.query}])
+        with open(args.record, 'wb') as f:
+            f.write(response.content)
+        print("Saved %d bytes to %s" % (len(response.content), args.record))
+        sys.exit()
+
+    if args.payload:
+        with open(args.payload, 'rb') as f:
+            content = f.read()
+    else:
+        content = synthetic_payload(args.rows)
+
+    assert current_path(content).equals(columnar_path(content)), "decoders disagree"
+    print("Payload: %.1f MB" % (len(content) / 1e6))
+    print("%-10s %10s %14s" % ('path', 'time (s)', 'peak mem (MB)'))
+    for name, func in [('current', current_path), ('columnar', columnar_path)]:
+        seconds, peak = measure(func, content, args.repeats)
+        print("%-10s %10.2f %14.1f" % (name, seconds, peak / 1e6))
@@ -0,0 +1,127 @@
+"""Memory used by report dataframes as gen_report returns them and as compact frames
+(see reporting_tools.compact_frame), and by joining them.
+
+Builds synthetic query results shaped like three of the larger reports (CATMAID SKIDs,
+instance classifications and dataset rows), decodes them as gen_report does, and for
+the plain and compact frames reports memory use (pandas' deep memory_usage), the peak
+Python memory of a typical join (tracemalloc) and whether the TSV output is identical.
+(It isn't for the dataset report, whose counts with missing values gen_report writes as
+floats, e.g. 70.0, where a compact frame writes 70.)
+
+Run from src:
+    python ./benchmark/memory_benchmark.py --rows 500000 --json memory.json
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import numpy as np
+import pandas as pd
+from reporting_tools import compact_frame, results_2_frame
+
+
+def _result(columns, rows):
+    return [{'columns': columns, 'data': [{'row': r, 'meta': []} for r in rows]}]
+
+
+def skid_results(rows, papers=40):
+    """Like a CATMAID SKID report: a SKID per row, repeated paper names and annotations."""
+    rng = np.random.default_rng(1)
+    paper = rng.integers(0, papers, rows)
+    return _result(['skid', 'name', 'paper_id', 'paper_name', 'annotations', 'synonyms'],
+                   [[str(1000000 + i), 'neuron type %d' % (i % 3000), str(9000 + p),
+                     'Author et al., %d' % (2000 + p), 'neuron name (%d)' % (i % 500),
+                     '' if i % 3 else 'synonym %d' % (i % 3000)] for i, p in enumerate(paper)])
+
+
+def classification_results(rows, classes=8000):
+    """Like Instance_FBbt_conflict_report's query: an instance and one of its FBbt classes per row."""
+    rng = np.random.default_rng(2)
+    fbbt = rng.integers(0, classes, rows)
+    return _result(['instance_id', 'instance_label', 'FBbt_id', 'FBbt_label'],
+                   [['VFB_%08d' % (i // 2), 'neuron %d (FAFB:%d)' % (f, i // 2), 'FBbt_%08d' % f,
+                     'adult neuron type %d' % f] for i, f in enumerate(fbbt)])
+
+
+def dataset_results(rows, datasets=300):
+    """Like the dataset report: counts (some missing) per dataset, license and publication."""
+    rng = np.random.default_rng(3)
+    ds = rng.integers(0, datasets, rows)
+    return _result(['ds.short_form', 'ds.label', 'license', 'pub', 'individuals'],
+                   [['DS_%d' % d, 'dataset %d' % d, 'CC-BY_4.0' if d % 4 else 'CC-BY-SA_4.0',
+                     'FBrf%07d' % (d % 150), None if i % 10 == 0 else int(d * 7 + i % 5)]
+                    for i, d in enumerate(ds)])
+
+
+def gen_report_frame(results):
+    """The dataframe gen_report returns for results."""
+    report = results_2_frame(results)
+    report.replace(np.nan, '', regex=True, inplace=True)
+    return report
+
+
+def compact_report_frame(results, int_columns=()):
+    """The dataframe gen_report(compact=True) returns for results (int_columns converted too)."""
+    return compact_frame(results_2_frame(results), int_columns=int_columns)
+
+
+def join_peak(left, right, on):
+    """Peak Python memory (MB) of joining two frames."""
+    tracemalloc.start()
+    joined = left.merge(right, on=on, how='left')
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del joined
+    return peak / 1e6
+
+
+def tsv(report):
+    out = io.StringIO()
+    report.to_csv(out, sep='\t', index=False)
+    return out.getvalue()
+
+
+def benchmarks(rows):
+    """Benchmark name: (results, int_columns, (right-hand frame of a join, join column))."""
+    skids = skid_results(rows)
+    classifications = classification_results(rows)
+    labels = pd.DataFrame({'FBbt_id': ['FBbt_%08d' % i for i in range(8000)],
+                           'parent': ['FBbt_%08d' % (i // 10) for i in range(8000)]})
+    papers = pd.DataFrame({'paper_name': ['Author et al., %d' % (2000 + p) for p in range(40)],
+                           'VFB_name': ['dataset_%d' % p for p in range(40)]})
+    datasets = dataset_results(rows)
+    licenses = pd.DataFrame({'license': ['CC-BY_4.0', 'CC-BY-SA_4.0'], 'url': ['https://cc/by', 'https://cc/by-sa']})
+    return {'CATMAID SKIDs': (skids, ['skid', 'paper_id'], (papers, 'paper_name')),
+            'instance classifications': (classifications, [], (labels, 'FBbt_id')),
+            'dataset report': (datasets, [], (licenses, 'license'))}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--json', help="save the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    print("%-26s%14s%14s%10s%16s%16s%10s" % ('report', 'plain_mb', 'compact_mb', 'ratio', 'plain_join_mb',
+                                             'compact_join_mb', 'same_tsv'))
+    for name, (query_results, int_columns, (right, on)) in benchmarks(args.rows).items():
+        plain = gen_report_frame(query_results)
+        compact = compact_report_frame(query_results, int_columns)
+        result = {'plain_mb': plain.memory_usage(deep=True).sum() / 1e6,
+                  'compact_mb': compact.memory_usage(deep=True).sum() / 1e6,
+                  'plain_join_mb': join_peak(plain, right, on),
+                  'compact_join_mb': join_peak(compact, right, on),
+                  'same_tsv': tsv(plain) == tsv(compact),
+                  'dtypes': {c: str(t) for c, t in compact.dtypes.items()}}
+        results[name] = result
+        print("%-26s%14.1f%14.1f%9.1fx%16.1f%16.1f%10s" % (
+            name, result['plain_mb'], result['compact_mb'], result['plain_mb'] / result['compact_mb'],
+            result['plain_join_mb'], result['compact_join_mb'], result['same_tsv']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'rows': args.rows, 'results': results}, f, indent=1)
@@ -0,0 +1,193 @@
+"""Local stand-in for the Neo4j transactional HTTP endpoint, for benchmarks.
+
+Serves recorded responses where it has them, and otherwise synthetic ones shaped
+like the query: the columns are taken from its RETURN clause, a query returning
+only aggregates gets one row and any other query gets a configurable number of
+rows.  Every response can be delayed by a fixed latency (plus random jitter).
+
+Recorded responses are JSON files named <query id>.json (see query_profiler.query_id)
+holding the result of a single statement ({'columns': [...], 'data': [...]}),
+e.g. as saved with --record-dir by run_benchmarks.py.
+
+Run on its own (from src) to point reports at it:
+    python ./benchmark/neo4j_standin.py --port 7474 --rows 100000 --latency 0.05
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from query_profiler import query_id
+
+AGGREGATES = ('count(', 'sum(', 'avg(', 'min(', 'max(', 'size(', 'collect(')
+NUMERIC = ('count(', 'sum(', 'size(', 'avg(', 'min(', 'max(')
+LABELS = ['Adult', 'Anatomy', 'Cell', 'Class', 'Cluster', 'DataSet', 'Expression_pattern', 'Gene', 'Individual',
+          'Larval', 'Muscle', 'Nervous_system', 'Neuron', 'Sense_organ', 'Site', 'Split', 'Synaptic_neuropil',
+          'Template', 'pub']
+RELATIONSHIP_TYPES = ['INSTANCEOF', 'SUBCLASSOF', 'database_cross_reference', 'depicts', 'has_reference',
+                      'has_source', 'in_register_with', 'overlaps', 'part_of', 'synapsed_to']
+
+
+def _split_top_level(text):
+    """Splits text on commas outside brackets and quotes."""
+    items, depth, quote, start = [], 0, None, 0
+    for i, c in enumerate(text):
+        if quote:
+            quote = None if c == quote else quote
+        elif c in '\'"`':
+            quote = c
+        elif c in '([{':
+            depth += 1
+        elif c in ')]}':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            items.append(text[start:i].strip())
+            start = i + 1
+    items.append(text[start:].strip())
+    return items
+
+
+def return_items(query):
+    """(column name, expression) for each item in the final RETURN clause of a query."""
+    match = None
+    for match in re.finditer(r'\bRETURN\s+(DISTINCT\s+)?', query, re.IGNORECASE):
+        pass
+    if not match:
+        return []
+    clause = re.split(r'\s(?:ORDER\s+BY|LIMIT|SKIP)\s', query[match.end():], flags=re.IGNORECASE)[0]
+    items = []
+    for item in _split_top_level(clause):
+        parts = re.split(r'\s+AS\s+', item, flags=re.IGNORECASE)
+        name = parts[-1].strip().strip('`') if len(parts) > 1 else item
+        items.append((name, parts[0].strip()))
+    return items
+
+
+class Neo4jStandIn:
+    """A local HTTP server answering transactional endpoint requests.  Use as a context manager,
+    or call start() and stop().  Its url can be used as a server endpoint in place of a real one."""
+
+    def __init__(self, rows=1000, latency=0.0, jitter=0.0, recordings=None, port=0):
+        """rows: rows returned by a non-aggregate query
+           latency: seconds before each response is sent
+           jitter: maximum extra random delay, in seconds
+           recordings: directory of recorded results (see module docstring)
+           port: port to listen on (0 for any free port)"""
+        self.rows = rows
+        self.latency = latency
+        self.jitter = jitter
+        self.recordings = recordings
+        self.requests = 0
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self._server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def result(self, statement):
+        """The result for one statement: recorded if there is a recording, otherwise synthetic."""
+        query = re.sub(r'^\s*(PROFILE|EXPLAIN)\s+', '', statement['statement'], flags=re.IGNORECASE)
+        if self.recordings:
+            path = os.path.join(self.recordings, query_id(query) + '.json')
+            if os.path.exists(path):
+                with open(path) as f:
+                    return json.load(f)
+        return synthetic_result(query, self.rows)
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                standin.requests += 1
+                time.sleep(standin.latency + random.uniform(0, standin.jitter))
+                results = [standin.result(s) for s in body['statements']]
+                content = json.dumps({'results': results, 'errors': []}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+        return Handler
+
+
+def synthetic_result(query, rows):
+    """A result shaped like the query's RETURN clause, with one row per label / relationship
+    type for label and relationship type listings, one row for aggregate-only queries
+    and rows rows otherwise."""
+    if 'apoc.meta.stats' in query:
+        return {'columns': ['labels', 'relTypesCount'],
+                'data': [{'row': [{label: 1000 * (i + 1) for i, label in enumerate(LABELS)},
+                                  {t: 5000 * (i + 1) for i, t in enumerate(RELATIONSHIP_TYPES)}], 'meta': [None, None]}]}
+    if 'db.labels()' in query:
+        names = LABELS
+    elif 'db.relationshipTypes()' in query:
+        names = RELATIONSHIP_TYPES
+    else:
+        names = None
+    items = return_items(query)
+    columns = [name for name, _ in items]
+    if names is not None and len(items) == 1:
+        return {'columns': columns, 'data': [{'row': [n], 'meta': [None]} for n in names]}
+    aggregate = items and all(expression.lower().startswith(AGGREGATES) for _, expression in items)
+    n = 1 if aggregate else rows
+    limit = re.search(r'\bLIMIT\s+(\d+)\s*$', query, re.IGNORECASE)
+    if limit:
+        n = min(n, int(limit.group(1)))
+    # counts made in an earlier WITH and returned by name
+    counted = set(re.findall(r'(?:count|sum|size)\s*\([^)]*\)\s+AS\s+`?(\w+)', query, re.IGNORECASE))
+    makers = []
+    for name, expression in items:
+        e = expression.lower()
+        if e.startswith(NUMERIC) or 'count(' in e or expression in counted:
+            makers.append(lambda i: ((i + 1) * 7919) % 100000)
+        elif e.startswith('collect(') or e.startswith('apoc.coll'):
+            makers.append(lambda i: ['FBbt_%08d' % (i % 7000), 'FBbt_00005106'])
+        else:
+            makers.append(lambda i, name=name: '%s_%d' % (name, i))
+    return {'columns': columns,
+            'data': [{'row': [make(i) for make in makers], 'meta': [None] * len(makers)} for i in range(n)]}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=7474)
+    parser.add_argument('--rows', type=int, default=1000, help="rows returned by non-aggregate queries")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds before each response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="maximum extra random delay (seconds)")
+    parser.add_argument('--recordings', help="directory of recorded results")
+    args = parser.parse_args()
+    standin = Neo4jStandIn(rows=args.rows, latency=args.latency, jitter=args.jitter, recordings=args.recordings,
+                           port=args.port)
+    print("Serving on %s" % standin.url)
+    standin._server.serve_forever()
@@ -0,0 +1,143 @@
+"""End-to-end benchmarks of the report generators against a local Neo4j stand-in
+(see neo4j_standin.py), so performance can be compared between commits.
+
+For each benchmark, reports the median and worst time of a run, throughput
+(rows per second), peak Python memory of a run (tracemalloc) and the 50th, 90th
+and 99th percentile latency of the queries it sent (from query_profiler).
+
+Run from src (VFB_neo4j must be on the PYTHONPATH, as for the reports):
+    python ./benchmark/run_benchmarks.py --rows 200000 --latency 0.02 --json bench.json
+and on another commit, to compare:
+    python ./benchmark/run_benchmarks.py --rows 200000 --latency 0.02 --compare bench.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import numpy as np
+import pandas as pd
+import reporting_tools
+from reporting_tools import diff_report, diff_report_by_key, gen_dataset_report_prod, gen_label_count_report, gen_report
+from query_profiler import PROFILER
+from VFB_content_report_generator import VFBContentReport
+from neo4j_standin import Neo4jStandIn
+
+REPORT_QUERY = ("MATCH (i:Individual)-[:INSTANCEOF]->(c:Class) "
+                "RETURN i.short_form AS ind_ID, i.label AS label, COUNT(c) AS types, COLLECT(c.short_form) AS FBbt_IDs")
+
+
+def changed_copy(report, fraction=0.01):
+    """A copy of a report with a fraction of its rows removed, changed and added."""
+    n = max(int(len(report) * fraction), 1)
+    changed = report.iloc[n:].copy()
+    changed.iloc[:n, -1] = changed.iloc[:n, -1].map(lambda v: v + 1 if isinstance(v, (int, np.integer)) else v)
+    added = report.iloc[:n].copy()
+    added.iloc[:, 0] = added.iloc[:, 0] + '_new'
+    changed = pd.concat([changed, added], ignore_index=True)
+    changed.name = report.name + '_changed'
+    return changed
+
+
+def diff_inputs(server):
+    """A dataset report and a changed copy of it."""
+    report = gen_dataset_report_prod(server, 'pdb')
+    return report, changed_copy(report)
+
+
+def run_content_report(server):
+    report = VFBContentReport(server=server)
+    report.get_info()
+    return report.templates_data
+
+
+def benchmarks(rows, dataset_rows, content_rows):
+    """Benchmark name: (rows served by the stand-in, setup(server) -> args, run(*args) -> result)."""
+    return {
+        'gen_report': (rows, lambda server: (server,), lambda server: gen_report(server, REPORT_QUERY, 'benchmark')),
+        'diff_report': (rows, diff_inputs, diff_report),
+        'diff_report_by_key': (rows, diff_inputs,
+                               lambda r1, r2: diff_report_by_key(r1, r2, ['ds.short_form', 'pub'])),
+        'gen_dataset_report_prod': (dataset_rows, lambda server: (server,),
+                                    lambda server: gen_dataset_report_prod(server, 'pdb')),
+        'gen_label_count_report': (0, lambda server: (server,),
+                                   lambda server: gen_label_count_report(server, 'pdb_labels')),
+        'VFBContentReport.get_info': (content_rows, lambda server: (server,), run_content_report),
+    }
+
+
+def measure(run, args, repeats):
+    """Times repeats runs (after a warm-up run) and measures peak memory of one more."""
+    run(*args)
+    first_record = len(PROFILER.records)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = run(*args)
+        times.append(time.perf_counter() - start)
+    # rows processed: the input report's for a diff, otherwise the result's
+    rows = len(args[0]) if isinstance(args[0], pd.DataFrame) else len(result) if result is not None else 0
+    latencies = [r['wall'] for r in PROFILER.records[first_record:] if r['service'] == 'neo4j']
+    tracemalloc.start()
+    run(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    median = float(np.median(times))
+    result = {'median_s': median, 'max_s': max(times), 'rows': rows,
+              'rows_per_s': rows / median if median else None, 'peak_mb': peak / 1e6, 'queries': len(latencies)}
+    for p in (50, 90, 99):
+        result['query_p%d_ms' % p] = float(np.percentile(latencies, p)) * 1000 if latencies else None
+    return result
+
+
+def print_results(results, baseline=None):
+    columns = ['median_s', 'max_s', 'rows', 'rows_per_s', 'peak_mb', 'queries', 'query_p50_ms', 'query_p90_ms',
+               'query_p99_ms']
+    print("%-26s" % 'benchmark' + ''.join('%14s' % c for c in columns))
+    for name, result in results.items():
+        print("%-26s" % name + ''.join('%14s' % ('-' if result[c] is None else '%.4g' % result[c]) for c in columns))
+        if baseline and name in baseline:
+            old = baseline[name]
+            print("%-26s" % '  vs baseline' + ''.join(
+                '%14s' % ('%.2fx' % (result[c] / old[c]) if result[c] and old.get(c) else '-') for c in columns))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help="rows returned for gen_report and diff_report")
+    parser.add_argument('--dataset-rows', type=int, default=2000, help="rows (datasets) in the dataset report")
+    parser.add_argument('--content-rows', type=int, default=50,
+                        help="rows for the content report's per-template and per-EM-project queries")
+    parser.add_argument('--latency', type=float, default=0.02, help="seconds the stand-in waits before each response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="maximum extra random delay per response")
+    parser.add_argument('--recordings', help="directory of recorded results for the stand-in to serve")
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--only', nargs='*', help="benchmarks to run (default all)")
+    parser.add_argument('--json', help="save the results to this file")
+    parser.add_argument('--compare', help="results saved with --json to compare against")
+    args = parser.parse_args()
+
+    reporting_tools.query_cache = None  # always query the stand-in
+    results = {}
+    with Neo4jStandIn(latency=args.latency, jitter=args.jitter, recordings=args.recordings) as standin:
+        server = (standin.url, 'neo4j', 'vfb')
+        for name, (rows, setup, run) in benchmarks(args.rows, args.dataset_rows, args.content_rows).items():
+            if args.only and name not in args.only:
+                continue
+            standin.rows = rows
+            print("Running %s..." % name)
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):  # reports print their queries
+                results[name] = measure(run, setup(server), args.repeats)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=1)
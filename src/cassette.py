@@ -0,0 +1,249 @@
+"""Records every HTTP response from a run (Neo4j, CATMAID, Owlery, Solr) to a compressed
+cassette, and replays them later with no network, so reports can be rebuilt offline
+after a change to how they are rendered or post-processed.
+
+Set VFB_CASSETTE to the cassette file (e.g. ../VFB_reporting_results/run.cassette.gz) and
+VFB_CASSETTE_MODE to 'record' or 'replay' (the default).  Every request made through
+requests (all sessions, including those of neo4j_connect and pysolr) is intercepted at
+the transport adapter.  A request is identified by its method, URL and body; a request
+made more than once gets its recorded responses back in order (the last one is repeated).
+Replaying a request that is not in the cassette raises requests.ConnectionError, as an
+unreachable server would.
+
+The cassette is gzipped JSON lines (a header, then one line per response), written to
+a .part file while recording and moved into place when the process exits.  A streamed
+response (stream=True) still streams while recording: its body is copied as it is read,
+and recorded when it is closed (or the cassette is), as far as it had been read.
+While recording, the query result cache is not used (so every query reaches the cassette);
+while replaying, snapshots are not recorded to the report history.
+"""
+import atexit
+import base64
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import defaultdict
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+VERSION = 1
+
+
+def request_key(method, url, body):
+    """Identifier of a request: its method, URL and a hash of its body."""
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    return '%s %s %s' % (method, url, hashlib.sha1(body or b'').hexdigest())
+
+
+def _encode_body(content):
+    try:
+        return {'text': content.decode('utf-8')}
+    except UnicodeDecodeError:
+        return {'base64': base64.b64encode(content).decode('ascii')}
+
+
+def _decode_body(entry):
+    if 'base64' in entry:
+        return base64.b64decode(entry['base64'])
+    return entry['text'].encode('utf-8')
+
+
+class _Tee:
+    """Wraps a streamed response's raw body, keeping a copy of what is read from it
+    for the cassette.  finish(content) is called once, when the body has been read to
+    the end or is closed."""
+
+    def __init__(self, raw, finish):
+        self._raw = raw
+        self._finish = finish
+        self._chunks = []
+        self._lock = threading.Lock()
+
+    def stream(self, amt=2 ** 16, decode_content=None):
+        for chunk in self._raw.stream(amt, decode_content=decode_content):
+            self._chunks.append(chunk)
+            yield chunk
+        self.finish()
+
+    def read(self, *args, **kwargs):
+        data = self._raw.read(*args, **kwargs)
+        if data:
+            self._chunks.append(data)
+        if not data or not (args or kwargs.get('amt')):
+            self.finish()
+        return data
+
+    def close(self):
+        self.finish()
+        self._raw.close()
+
+    def finish(self):
+        with self._lock:
+            finish, self._finish = self._finish, None
+        if finish:
+            finish(b''.join(self._chunks))
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+class Cassette:
+    """Recorded HTTP responses, in 'record' or 'replay' mode.  Call install() to
+    intercept requests and close() to finish (done at exit by install_from_env)."""
+
+    def __init__(self, path, mode='replay'):
+        if mode not in ('record', 'replay'):
+            raise ValueError("Unknown cassette mode: %s" % mode)
+        self.path = path
+        self.mode = mode
+        self.recorded = 0
+        self.replayed = 0
+        self.missing = 0
+        self._lock = threading.Lock()
+        self._responses = defaultdict(list)
+        self._served = defaultdict(int)
+        self._file = None
+        self._streaming = set()
+        self._original_send = None
+        if mode == 'replay':
+            self._load()
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._file = gzip.open(path + '.part', 'wt', encoding='utf-8', compresslevel=6)
+            self._file.write(json.dumps({'version': VERSION, 'recorded': datetime.datetime.now(
+                tz=datetime.timezone.utc).isoformat()}) + '\n')
+
+    def _load(self):
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            if header.get('version') != VERSION:
+                raise ValueError("Unsupported cassette version in %s: %s" % (self.path, header.get('version')))
+            for line in f:
+                entry = json.loads(line)
+                self._responses[entry['key']].append(entry)
+        print("Replaying %d recorded responses from %s (recorded %s)"
+              % (sum(len(r) for r in self._responses.values()), self.path, header.get('recorded')))
+
+    def record(self, request, response, content=None):
+        """Adds a response to the cassette, with content as its body (by default,
+        reading it)."""
+        if content is None:
+            content = response.content
+        entry = {'key': request_key(request.method, request.url, request.body),
+                 'method': request.method, 'url': request.url, 'status': response.status_code,
+                 'reason': response.reason, 'headers': dict(response.headers),
+                 'elapsed': response.elapsed.total_seconds()}
+        entry.update(_encode_body(content))
+        line = json.dumps(entry) + '\n'
+        with self._lock:
+            if not self._file:  # a stream closed after the cassette
+                return
+            self._file.write(line)
+            self.recorded += 1
+
+    def record_stream(self, request, response):
+        """Records a streamed response once its body has been read and closed, leaving it streaming."""
+        def finish(content):
+            with self._lock:
+                self._streaming.discard(tee)
+            self.record(request, response, content)
+        tee = response.raw = _Tee(response.raw, finish)
+        with self._lock:
+            self._streaming.add(tee)
+
+    def replay(self, request):
+        """The recorded response to a request, as a requests.Response.
+        Raises requests.ConnectionError if the request was not recorded."""
+        key = request_key(request.method, request.url, request.body)
+        with self._lock:
+            entries = self._responses.get(key)
+            if not entries:
+                self.missing += 1
+                raise requests.ConnectionError("Not in cassette %s: %s %s" % (self.path, request.method, request.url),
+                                               request=request)
+            entry = entries[min(self._served[key], len(entries) - 1)]
+            self._served[key] += 1
+            self.replayed += 1
+        content = _decode_body(entry)
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.reason = entry['reason']
+        # the body is already decoded, so it must not be decompressed again
+        response.headers = CaseInsensitiveDict({k: v for k, v in entry['headers'].items()
+                                                if k.lower() not in ('content-encoding', 'transfer-encoding')})
+        response.headers['Content-Length'] = str(len(content))
+        response.url = request.url
+        response.request = request
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response._content = content
+        response._content_consumed = True
+        response.raw = io.BytesIO(content)
+        response.raw.seek(0, io.SEEK_END)  # as if read to the end
+        return response
+
+    def install(self):
+        """Intercepts every request sent through a requests transport adapter."""
+        cassette = self
+        original_send = self._original_send = HTTPAdapter.send
+
+        def send(adapter, request, **kwargs):
+            if cassette.mode == 'replay':
+                return cassette.replay(request)
+            response = original_send(adapter, request, **kwargs)
+            if kwargs.get('stream'):
+                cassette.record_stream(request, response)
+            else:
+                cassette.record(request, response)
+            return response
+
+        HTTPAdapter.send = send
+        return self
+
+    def uninstall(self):
+        if self._original_send:
+            HTTPAdapter.send = self._original_send
+            self._original_send = None
+
+    def close(self):
+        """Stops intercepting requests and, when recording, moves the cassette into place."""
+        self.uninstall()
+        if self._file:
+            with self._lock:
+                streaming = list(self._streaming)
+            for tee in streaming:  # responses never closed
+                tee.finish()
+            with self._lock:
+                self._file.close()
+                self._file = None
+            os.replace(self.path + '.part', self.path)
+            print("Recorded %d responses to %s" % (self.recorded, self.path))
+        elif self.missing:
+            print("%d requests were not in cassette %s" % (self.missing, self.path))
+
+
+def install_from_env():
+    """Installs a Cassette configured from VFB_CASSETTE and VFB_CASSETTE_MODE, closed at exit.
+    Returns it, or None if VFB_CASSETTE is not set."""
+    path = os.environ.get('VFB_CASSETTE')
+    if not path:
+        return None
+    cassette = Cassette(path, os.environ.get('VFB_CASSETTE_MODE', 'replay').lower()).install()
+    atexit.register(cassette.close)
+    return cassette
+
+
+active = install_from_env()
+
+
+def recording():
+    return bool(active and active.mode == 'record')
+
+
+def replaying():
+    return bool(active and active.mode == 'replay')
@@ -1,50 +1,42 @@
 import pandas as pd
-from uk.ac.ebi.vfb.neo4j.neo4j_tools import neo4j_connect, results_2_dict_list
+import reporting_tools
+from reporting_tools import gen_report
 import get_catmaid_papers
+from report_dag import ReportDAG
 
-nc = neo4j_connect('http://kb.virtualflybrain.org', 'neo4j', 'vfb')
+KB_server = ('http://kb.virtualflybrain.org', 'neo4j', 'vfb')
 
 # variables for generating reports
 
 # dict of sources and project IDs for larval datasets
 larval_sources = {'l1em': 1, 'abd1.5': 1, 'iav-robo': 2, 'iav-tnt': 4, 'l3vnc': 2}
-larval_reports = [[get_catmaid_papers.gen_cat_paper_report(
-    "https://" + s + ".catmaid.virtualflybrain.org", larval_sources[s], "papers"),
-    get_catmaid_papers.gen_cat_skid_report_officialnames(
-    "https://" + s + ".catmaid.virtualflybrain.org", larval_sources[s], "papers",
-    ["neuron name", "MB nomenclature"], report=True), s.upper()] for s in larval_sources.keys()]
-
-FAFB = [get_catmaid_papers.gen_cat_paper_report(
-    "https://fafb.catmaid.virtualflybrain.org", 1, "Published"),
-    get_catmaid_papers.gen_cat_skid_report_officialnames(
-    "https://fafb.catmaid.virtualflybrain.org", 1, "Published", ["neuron name"], report=True),
-    "FAFB"]
-
-FANC1 = [get_catmaid_papers.gen_cat_paper_report(
-   "https://fanc.catmaid.virtualflybrain.org", 1, "publication"),
-   get_catmaid_papers.gen_cat_skid_report_officialnames(
-   "https://fanc.catmaid.virtualflybrain.org", 1, "publication", ["neuron name"], report=True),
-   "FANC1"]
-
-FANC2 = [get_catmaid_papers.gen_cat_paper_report(
-   "https://fanc.catmaid.virtualflybrain.org", 2, "publication"),
-   get_catmaid_papers.gen_cat_skid_report_officialnames(
-   "https://fanc.catmaid.virtualflybrain.org", 2, "publication", ["neuron name"], report=True),
-   "FANC2"]
-
-LEG40 = [get_catmaid_papers.gen_cat_paper_report(
-   "https://radagast.hms.harvard.edu/catmaidvnc", 61, "publication"),
-   get_catmaid_papers.gen_cat_skid_report_officialnames(
-   "https://radagast.hms.harvard.edu/catmaidvnc", 61, "publication", ["neuron name"], report=True),
-   "LEG40"]
-
-"""
-LOAD1 = [get_catmaid_papers.gen_cat_paper_report(
-    "http://catmaid-loader1.virtualflybrain.org", 1, "papers"),
-    get_catmaid_papers.gen_cat_skid_report_officialnames(
-    "http://catmaid-loader1.virtualflybrain.org", 1, "papers", ["neuron name", "MB nomenclature"], report=True),
-    "LOAD1"]
-"""
+
+# CATMAID data to compare with VFB: [URL, project ID, paper annotation, name annotations, dataset name]
+catmaid_sources = [["https://" + s + ".catmaid.virtualflybrain.org", larval_sources[s], "papers",
+                    ["neuron name", "MB nomenclature"], s.upper()] for s in larval_sources.keys()]
+catmaid_sources.extend([
+    ["https://fafb.catmaid.virtualflybrain.org", 1, "Published", ["neuron name"], "FAFB"],
+    ["https://fanc.catmaid.virtualflybrain.org", 1, "publication", ["neuron name"], "FANC1"],
+    ["https://fanc.catmaid.virtualflybrain.org", 2, "publication", ["neuron name"], "FANC2"],
+    ["https://radagast.hms.harvard.edu/catmaidvnc", 61, "publication", ["neuron name"], "LEG40"],
+    # ["http://catmaid-loader1.virtualflybrain.org", 1, "papers", ["neuron name", "MB nomenclature"], "LOAD1"]
+])
+
+
+def add_reports(dag):
+    """Adds a comparison task for each of catmaid_sources to a report_dag.ReportDAG,
+    sharing CATMAID crawls with other reports (see get_catmaid_papers.add_catmaid_crawls)."""
+    for URL, PROJECT_ID, paper_annotation, name_annotations, dataset_name in catmaid_sources:
+        papers, skids = get_catmaid_papers.add_catmaid_crawls(dag, URL, PROJECT_ID, paper_annotation,
+                                                             name_annotations)
+        save_directory = "../VFB_reporting_results/CATMAID_SKID_reports/"
+        dag.add(dataset_name + " comparison",
+                lambda cat_papers, cat_skids, dataset_name=dataset_name:
+                    make_catmaid_vfb_reports(cat_papers, cat_skids, dataset_name),
+                inputs=[papers, skids], server=KB_server,
+                outputs=[save_directory + dataset_name + suffix
+                         for suffix in ["_comparison.tsv", "_new_skids.tsv", "_neuron_only_skids.tsv"]])
+
 
 # Function to handle a single report generation with error handling
 def make_catmaid_vfb_reports(cat_papers, cat_skids, dataset_name):
@@ -61,10 +53,7 @@ def make_catmaid_vfb_reports(cat_papers, cat_skids, dataset_name):
                     WHERE api.short_form ends with '_catmaid_api' 
                     RETURN toInteger(dsxref.accession[0]) as id, ds.short_form as VFB_name""")
     try:
-        q = nc.commit_list([pub_query])
-        papers = results_2_dict_list(q)
-    
-        vfb_papers = pd.DataFrame.from_dict(papers)
+        vfb_papers = gen_report(KB_server, pub_query, 'vfb_papers')
         vfb_papers = vfb_papers.set_index("id")
     except Exception as e:
         print(f"Error querying Neo4j database for {dataset_name}: {e}")
@@ -85,17 +74,12 @@ def make_catmaid_vfb_reports(cat_papers, cat_skids, dataset_name):
                         AND ((not exists(i.block)) OR (i.block <> ['skid no longer exists']) 
                         OR (i.block <> ['New Image']) OR (i.block <> ['Missing Image']))
                         AND s.short_form starts with 'catmaid_' 
-                        AND dsxref.accession = ['%s'] WITH i, skid 
+                        AND dsxref.accession = [$paper_id] WITH i, skid 
                         MATCH (i)-[:INSTANCEOF]->(c:Class) 
-                        RETURN distinct skid.accession[0] AS catmaid_skeleton_id, c.iri"""
-                        % paper_id)
+                        RETURN distinct skid.accession[0] AS catmaid_skeleton_id, c.iri""")
 
-            q = nc.commit_list([query])
-            skids_in_paper_vfb = results_2_dict_list(q)
-            if skids_in_paper_vfb:
-                vfb_skid_classes_df = pd.DataFrame.from_dict(skids_in_paper_vfb)
-            else:
-                vfb_skid_classes_df = pd.DataFrame(columns=['catmaid_skeleton_id', 'c.iri'])
+            vfb_skid_classes_df = gen_report(KB_server, query, 'vfb_skid_classes',
+                                             parameters={'paper_id': str(paper_id)})  # has the query columns even if empty
 
             # list of unique skids
             skids_in_paper_vfb = vfb_skid_classes_df['catmaid_skeleton_id'].drop_duplicates().to_list()
@@ -133,19 +117,19 @@ def make_catmaid_vfb_reports(cat_papers, cat_skids, dataset_name):
         all_papers.to_csv(comparison_outfile, sep="\t")
 
         vfb_skid_list = [skid for skidlist in skids_df['skids_in_paper_vfb'] for skid in skidlist
-                         if skid is not None]
+                         if skid]  # drops missing (None or blank) skids
         vfb_skid_list = list(set(vfb_skid_list))
         vfb_skid_list = [int(x) for x in vfb_skid_list]
 
         # Ensure SKIDs are same type (integers) before comparison
-        cat_skids['skid'] = cat_skids['skid'].astype(int)
+        cat_skids = cat_skids.astype({'skid': int})  # (a copy, as cat_skids may be shared with other reports)
 
         new_skids_output = cat_skids[~cat_skids['skid'].isin(vfb_skid_list)].sort_values('skid') \
             .reindex(columns=(cat_skids.columns.tolist() + ['FBbt_ID']))
         new_skids_output.to_csv(skids_outfile, sep="\t", index=False)
 
         vfb_neuron_skid_list = [skid for skidlist in skids_df['neuron_only'] for skid in skidlist
-                         if skid is not None]
+                         if skid]  # drops missing (None or blank) skids
         vfb_neuron_skid_list = list(set(vfb_neuron_skid_list))
         vfb_neuron_skid_list = [int(x) for x in vfb_neuron_skid_list]
 
@@ -168,8 +152,8 @@ def make_catmaid_vfb_reports(cat_papers, cat_skids, dataset_name):
         return  # Exit the current report, proceed to the next
 
 if __name__ == '__main__':
-    # Example loop to iterate through all reports
-    reports = larval_reports
-    reports.extend([FAFB, FANC1, FANC2, LEG40]) # LOAD1
-    for report in reports:
-        make_catmaid_vfb_reports(*report)
+    dag = ReportDAG(state_file=None)
+    add_reports(dag)
+    dag.run()
+    if reporting_tools.query_cache:
+        reporting_tools.query_cache.print_stats()
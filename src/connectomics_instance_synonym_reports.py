@@ -2,11 +2,11 @@ import pandas as pd
 import json
 import ast
 from collections import defaultdict
-from uk.ac.ebi.vfb.neo4j.neo4j_tools import neo4j_connect, results_2_dict_list
+from reporting_tools import get_connection, results_2_frame, save_report
 
 pd.set_option('display.max_columns', None)
 
-nc = neo4j_connect('http://pdb.virtualflybrain.org', 'neo4j', 'vfb')
+nc = get_connection(('http://pdb.virtualflybrain.org', 'neo4j', 'vfb'))
 
 query = ("MATCH (i:Individual)-[r:database_cross_reference]->(s:Site:Connectome:Individual) "
          "MATCH (i)-[:INSTANCEOF]->(c:Class)-[x:has_reference]->(p:pub) "
@@ -20,8 +20,7 @@ query = ("MATCH (i:Individual)-[r:database_cross_reference]->(s:Site:Connectome:
          "value: x.value, publication: p.short_form}) AS parent_synonyms")
 
 q = nc.commit_list([query])
-results = results_2_dict_list(q)
-results_df = pd.DataFrame(results)
+results_df = results_2_frame(q)
 
 
 # --- JSON-like synonym string parsing ---
@@ -199,9 +198,9 @@ for dataset in results_df['dataset'].unique():
     output_cols = ['source_id', 'VFB_id', 'label', 'parent_classes'] + sorted(list(all_synonym_types))
     dataset_df = dataset_df[output_cols]
 
-    # Save to TSV file without index
+    # Save to TSV file without index (and any other formats in VFB_REPORT_FORMATS)
     output_file = f"../VFB_reporting_results/instance_synonym_report_{dataset}.tsv"
-    dataset_df.to_csv(output_file, sep='\t', index=False)
+    save_report(dataset_df, output_file)
     print(f"Saved {output_file}")
 
 
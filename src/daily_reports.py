@@ -0,0 +1,121 @@
+"""Runs all of the daily reports in one process, as a graph of tasks (see report_dag).
+
+Reports whose inputs (server data, CATMAID crawls or other reports) are unchanged
+since the last run are skipped, unless --force is given.  Run from the src directory.
+"""
+import argparse
+import glob
+import os
+import subprocess
+import sys
+import deadlines
+import reporting_tools
+import comparison
+import get_catmaid_cellTypes
+import get_catmaid_papers
+import report_runner
+from deadlines import REPORT_TIMEOUT, ReportTimeout
+from query_profiler import PROFILER
+from report_dag import DEFAULT_STATE_FILE, ReportDAG
+from VFB_content_report_generator import VFB_servers, delta_file, output_files, run_content_reports, snapshot_files
+
+results_dir = "../VFB_reporting_results/"
+PDB_server = ('http://pdb.virtualflybrain.org', 'neo4j', 'vfb')
+
+
+def remove_files(pattern):
+    for f in glob.glob(pattern):
+        os.remove(f)
+
+
+def run_script(path, clear=()):
+    """Task function running a script in its own Python process (scripts keep state in
+    module globals and sys.argv, so can't safely run in threads of this one), first removing
+    any old outputs matching the glob patterns in clear.  The script is killed if the task's
+    deadline passes."""
+    def run(*inputs):
+        for pattern in clear:
+            remove_files(pattern)
+        budget = deadlines.current()
+        try:
+            subprocess.run([sys.executable, path], check=True, timeout=budget.remaining() if budget else None)
+        except subprocess.TimeoutExpired:
+            raise ReportTimeout("%s ran out of its %gs budget" % (path, budget.seconds))
+    return run
+
+
+def content_report():
+    failures = run_content_reports(history=report_runner.history)[1]
+    # the pdb report is the one published
+    if 'pdb' in failures:
+        raise failures['pdb']
+
+
+def content_fingerprint(dag):
+    """Fingerprint of every server the content reports query; one that can't be reached gives None."""
+    fingerprints = [dag.server_fingerprint(server) for server in VFB_servers.values()]
+
+    def fingerprint():
+        values = []
+        for f in fingerprints:
+            try:
+                values.append(f())
+            except Exception as e:
+                print("Failed to fingerprint a content report server: %s" % e)
+                values.append(None)
+        return values
+    return fingerprint
+
+
+def build_dag(state_file=DEFAULT_STATE_FILE):
+    """Returns the graph of daily report tasks and the names of those that may fail
+    without failing the run (see report_runner.add_reports)."""
+    dag = ReportDAG(state_file=state_file)
+    optional = report_runner.add_reports(dag)
+    comparison.add_reports(dag)
+    get_catmaid_papers.add_reports(dag)
+    dag.add('CATMAID cell types', lambda: get_catmaid_cellTypes.gen_cat_report(
+        "https://fafb.catmaid.virtualflybrain.org", 1, "11078097", "FAFB_CAT"))
+    dag.add('content reports', content_report, server=VFB_servers['pdb'], fingerprint=content_fingerprint(dag),
+            outputs=list(output_files.values()) + list(snapshot_files.values()) + [delta_file])
+    # the lineage annotations it uses are downloaded each time, so this always runs
+    dag.add('instance FBbt conflict report', run_script('Instance_FBbt_conflict_report.py'))
+    dag.add('anat curation files', run_script('make_curation_records/anat_curation_file_maker.py',
+                                              clear=[results_dir + 'anat_*.tsv', results_dir + 'anat_*.yaml']),
+            inputs=[s + ' comparison' for s in ['FAFB', 'L1EM', 'FANC1', 'FANC2', 'LEG40']])
+    dag.add('ID mapping tables', run_script('ID_mapping_tables.py', clear=[results_dir + 'ID_tables/*_ID_table.*']),
+            server=PDB_server, outputs=[results_dir + 'ID_tables/*_ID_table.*'])
+    dag.add('connectomics instance synonym reports',
+            run_script('connectomics_instance_synonym_reports.py', clear=[results_dir + 'instance_synonym_report_*']),
+            server=PDB_server, outputs=[results_dir + 'instance_synonym_report_*'])
+    return dag, optional
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--force', action='store_true', help="run every report, even if its inputs are unchanged")
+    parser.add_argument('--workers', type=int, default=None, help="maximum number of reports running at once")
+    parser.add_argument('--max-per-server', type=int, default=report_runner.max_per_server,
+                        help="maximum number of reports querying any one server at once")
+    parser.add_argument('--report-timeout', type=float, default=REPORT_TIMEOUT,
+                        help="seconds each report may take before it is abandoned as timed out (0 for no limit)")
+    parser.add_argument('--state', default=DEFAULT_STATE_FILE, help="file recording the state of the last run")
+    args = parser.parse_args()
+
+    os.makedirs(results_dir + 'CATMAID_SKID_reports', exist_ok=True)
+    os.makedirs(results_dir + 'ID_tables', exist_ok=True)
+    dag, optional = build_dag(state_file=args.state)
+    failures = dag.run(max_per_server=args.max_per_server, max_workers=args.workers, force=args.force,
+                       timeout=args.report_timeout or None)
+
+    reporting_tools.print_connection_stats()
+    if reporting_tools.query_cache:
+        reporting_tools.query_cache.print_stats()
+    print("Slowest queries:")
+    PROFILER.print_summary()
+
+    # every report is required, except those on servers other than pdb (see report_runner.add_reports)
+    required = [name for name in failures if name not in optional]
+    if required:
+        print("Required reports failed: %s" % ', '.join(required))
+        sys.exit(1)
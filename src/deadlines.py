@@ -0,0 +1,218 @@
+"""Deadline budgets, timeouts, retries and hedging for report queries.
+
+A report runs within a deadline (see deadline(); report_dag gives each task
+VFB_REPORT_TIMEOUT seconds, if set).  Every HTTP request sent through a
+DeadlineAdapter (the shared Neo4j sessions and profiled_session, used for CATMAID,
+Owlery and Solr) is given the per-query timeout VFB_QUERY_TIMEOUT (if set), cut
+short to what is left of the current deadline.  Both are off by default, so a slow
+but healthy report is never abandoned unless a limit has been chosen for it.  A
+request that would outlast the deadline, or is sent after it has passed, raises
+ReportTimeout, so a hung query fails its own report rather than holding up those
+after it.
+
+Idempotent reads (GETs and, where the adapter allows, POSTs of read-only queries)
+that fail to connect or get a 502, 503 or 504 are retried up to VFB_QUERY_RETRIES
+times, with exponential backoff from VFB_QUERY_BACKOFF seconds (with jitter, and
+within the deadline).  A read that merely times out is not retried: the query is
+slow, and running it again would only add load.  For that tail, set
+VFB_QUERY_HEDGE_AFTER: a read still unanswered after that many seconds is sent
+again, and whichever copy answers first is used.
+
+Deadlines are per thread; use bind() to carry one into a thread pool.
+"""
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+# seconds; 0 or empty for none
+QUERY_TIMEOUT = _env_float('VFB_QUERY_TIMEOUT', 0) or None
+REPORT_TIMEOUT = _env_float('VFB_REPORT_TIMEOUT', 0) or None
+RETRIES = int(_env_float('VFB_QUERY_RETRIES', 2))
+BACKOFF = _env_float('VFB_QUERY_BACKOFF', 2)
+HEDGE_AFTER = _env_float('VFB_QUERY_HEDGE_AFTER', 0) or None
+
+RETRY_STATUS = (502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class ReportTimeout(TimeoutError):
+    """Raised when a report's deadline has passed (or would pass before a query could finish)."""
+
+
+class Deadline:
+    """A point in time by which something (named, for messages) must be done."""
+
+    def __init__(self, seconds, name='report'):
+        self.name = name
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        return self.expires - time.monotonic()
+
+    def check(self, doing=None):
+        """Raises ReportTimeout if the deadline has passed."""
+        if self.remaining() <= 0:
+            raise ReportTimeout("%s ran out of its %gs budget%s" % (
+                self.name, self.seconds, " while %s" % doing if doing else ''))
+
+
+_local = threading.local()
+
+
+def current():
+    """The deadline this thread is running under, or None."""
+    return getattr(_local, 'deadline', None)
+
+
+@contextmanager
+def deadline(seconds, name='report'):
+    """Runs the enclosed code within a deadline of seconds (no deadline if seconds is None).
+    An enclosing deadline that is sooner still applies."""
+    outer = current()
+    if seconds is None or (outer and outer.remaining() <= seconds):
+        yield outer
+        return
+    _local.deadline = Deadline(seconds, name)
+    try:
+        yield _local.deadline
+    finally:
+        _local.deadline = outer
+
+
+def bind(function):
+    """Wraps function to run under this thread's deadline, e.g. when submitted to a thread pool."""
+    bound = current()
+
+    def run(*args, **kwargs):
+        outer = current()
+        _local.deadline = bound
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _local.deadline = outer
+    return run
+
+
+def check(doing=None):
+    """Raises ReportTimeout if the current deadline (if any) has passed."""
+    if current():
+        current().check(doing)
+
+
+def request_timeout(timeout=QUERY_TIMEOUT):
+    """The timeout for a request: timeout (seconds or None), limited to the time left before the
+    current deadline.  Raises ReportTimeout if the deadline has passed."""
+    d = current()
+    if d is None:
+        return timeout
+    d.check()
+    return d.remaining() if timeout is None else min(timeout, d.remaining())
+
+
+class DeadlineAdapter(HTTPAdapter):
+    """Transport adapter applying timeouts, deadlines, retries and hedging (see module docstring)."""
+
+    _hedge_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix='hedge')
+
+    def __init__(self, timeout=QUERY_TIMEOUT, retries=RETRIES, backoff=BACKOFF, hedge_after=HEDGE_AFTER,
+                 retry_post=False, **kwargs):
+        """timeout: per-request timeout in seconds (used when the caller gives none)
+           retries: times to retry an idempotent request that fails to connect or gets a 502/503/504
+           backoff: seconds before the first retry, doubling for each one after
+           hedge_after: seconds after which an idempotent request is sent again (None not to)
+           retry_post: whether POSTs are idempotent reads, as True/False or a function of the request
+           kwargs are passed to HTTPAdapter (pool_connections, pool_maxsize...)"""
+        super().__init__(**kwargs)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_after = hedge_after
+        self.retry_post = retry_post
+        self.retried = 0
+        self.hedged = 0
+
+    def idempotent(self, request):
+        if request.method in IDEMPOTENT_METHODS:
+            return True
+        if request.method == 'POST':
+            return self.retry_post(request) if callable(self.retry_post) else self.retry_post
+        return False
+
+    def send(self, request, timeout=None, **kwargs):
+        idempotent = self.idempotent(request)
+        attempt = 0
+        while True:
+            try:
+                response = self._send(request, request_timeout(timeout or self.timeout), idempotent, kwargs)
+            except requests.ConnectionError as e:  # including timing out while connecting
+                if not idempotent or attempt >= self.retries:
+                    raise
+                print("Retrying %s %s (%s)" % (request.method, request.url, e))
+            except requests.Timeout:
+                check("waiting for %s" % request.url)
+                raise
+            else:
+                if not (idempotent and response.status_code in RETRY_STATUS and attempt < self.retries):
+                    return response
+                print("Retrying %s %s (%s %s)" % (request.method, request.url, response.status_code, response.reason))
+                response.close()
+            # exponential backoff with jitter, within the deadline
+            delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+            d = current()
+            if d and d.remaining() <= delay:
+                raise ReportTimeout("%s ran out of its %gs budget retrying %s" % (d.name, d.seconds, request.url))
+            time.sleep(delay)
+            attempt += 1
+            self.retried += 1
+
+    def _send(self, request, timeout, idempotent, kwargs):
+        """Sends a request, waiting no longer than the current deadline for the response
+        (the request itself then finishes in the background) and hedging it if allowed."""
+        d = current()
+        hedge = self.hedge_after if idempotent else None
+        if d is None and hedge is None:
+            return super().send(request, timeout=timeout, **kwargs)
+        send = super().send
+        futures = [self._hedge_pool.submit(send, request, timeout=timeout, **kwargs)]
+        if hedge is not None:
+            done, _ = wait(futures, timeout=hedge if d is None else min(hedge, max(d.remaining(), 0)))
+            if not done and (d is None or d.remaining() > 0):
+                print("Hedging %s %s after %.1fs" % (request.method, request.url, hedge))
+                self.hedged += 1
+                futures.append(self._hedge_pool.submit(send, request, timeout=timeout, **kwargs))
+        error = None
+        pending = futures
+        while pending:
+            done, pending = wait(pending, timeout=None if d is None else max(d.remaining(), 0),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:  # close whichever copy loses
+                        other.add_done_callback(_close_response)
+                    return future.result()
+                error = future.exception()
+        if error is not None and not pending:
+            raise error
+        for future in pending:
+            future.add_done_callback(_close_response)
+        d.check("waiting for %s" % request.url)
+        raise ReportTimeout("%s ran out of its %gs budget waiting for %s" % (d.name, d.seconds, request.url))
+
+
+def _close_response(future):
+    if future.exception() is None:
+        future.result().close()
@@ -1,6 +1,6 @@
-import requests
 import pandas as pd
 from collections import OrderedDict
+from query_profiler import profiled_session
 
 def gen_cat_report(URL, PROJECT_ID, celltype_annotaion, report_name):
 
@@ -9,7 +9,7 @@ def gen_cat_report(URL, PROJECT_ID, celltype_annotaion, report_name):
     
     # get token
 
-    client = requests.session()
+    client = profiled_session('catmaid', retry_post=True)
     client.get("%s" % URL)
     for key in client.cookies.keys():
         if key[:4] == 'csrf':
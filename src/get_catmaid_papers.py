@@ -1,17 +1,23 @@
-import requests
 import json
 import pandas as pd
 import datetime
 from collections import OrderedDict
 import sys
 import os
+from query_profiler import profiled_session
 
 # Try importing Neo4j tools with proper error handling
 try:
-    from uk.ac.ebi.vfb.neo4j.neo4j_tools import neo4j_connect, results_2_dict_list
+    from reporting_tools import compact_frame, get_connection, results_2_frame, save_report
     NEO4J_AVAILABLE = True
 except ImportError:
     NEO4J_AVAILABLE = False
+
+    def save_report(report, filename):
+        report.to_csv(filename, sep="\t", index=False)
+
+    def compact_frame(report, int_columns=()):
+        return report
     log_error("Neo4j tools not available. Missing links report functionality will be limited.")
 
 # functions for getting paper and skid details from CATMAID
@@ -53,7 +59,7 @@ def gen_cat_paper_report(URL, PROJECT_ID, paper_annotation, report=False):
     
     try:
         # get token
-        client = requests.session()
+        client = profiled_session('catmaid', retry_post=True)
         client.get(f"{URL}")
         csrf_key = next((key for key in client.cookies.keys() if key.startswith('csrf')), None)
         if not csrf_key:
@@ -85,7 +91,7 @@ def gen_cat_paper_report(URL, PROJECT_ID, paper_annotation, report=False):
         if report:
             try:
                 dataset_outfile = f"../VFB_reporting_results/CATMAID_SKID_reports/{report}_datasets.tsv"
-                df_papers.to_csv(dataset_outfile, sep="\t")
+                save_report(df_papers.reset_index(), dataset_outfile)
             except Exception as e:
                 log_error(f"Failed to save report for {URL}", str(e))
 
@@ -101,7 +107,7 @@ def gen_cat_skid_report(URL, PROJECT_ID, paper_annotation, report=False):
     NB. each skid may feature in multiple papers."""
 
     # get token
-    client = requests.session()
+    client = profiled_session('catmaid', retry_post=True)
     client.get("%s" % URL)
     for key in client.cookies.keys():
         if key[:4] == 'csrf':
@@ -156,7 +162,7 @@ def gen_cat_skid_report(URL, PROJECT_ID, paper_annotation, report=False):
 
     if report:
         skid_outfile = ("../VFB_reporting_results/CATMAID_SKID_reports/" + report + "_all_skids.tsv")
-        df_skids.to_csv(skid_outfile, sep="\t", index=False)
+        save_report(df_skids, skid_outfile)
     return df_skids
 
 
@@ -173,7 +179,7 @@ def gen_cat_skid_report_officialnames(URL, PROJECT_ID, paper_annotation, name_an
             log_info(f"Using server-specific annotation tags: {name_annotations}")
         
         # get token
-        client = requests.session()
+        client = profiled_session('catmaid', retry_post=True)
         client.get(f"{URL}")
         csrf_key = next((key for key in client.cookies.keys() if key.startswith('csrf')), None)
         if not csrf_key:
@@ -213,8 +219,8 @@ def gen_cat_skid_report_officialnames(URL, PROJECT_ID, paper_annotation, name_an
                 continue
 
         # Process neurons for each paper
-        df_skids = pd.DataFrame(columns=['skid', 'name', 'paper_id', 'paper_name', 'annotations', 'synonyms'])
-        
+        skid_rows = []
+
         for paper in papers:
             try:
                 call_papers.update({
@@ -272,18 +278,21 @@ def gen_cat_skid_report_officialnames(URL, PROJECT_ID, paper_annotation, name_an
                                 row['annotations'] += ", "
                             row['annotations'] += f"{annotation['name']} ({annotation['id']})"
                         
-                        df_skids = pd.concat([df_skids, pd.DataFrame([row])], ignore_index=True)
+                        skid_rows.append(row)
                         
             except Exception as e:
                 log_error(f"Failed to process paper {paper.get('name', 'unknown')} at {URL}", str(e))
                 continue
 
-        df_skids = df_skids.sort_values(["paper_name", "skid"])
-        
+        # SKIDs and paper IDs as integers, and repeated names as categoricals, as these
+        # are kept in memory for all the reports on the project (see compact_frame)
+        df_skids = pd.DataFrame(skid_rows, columns=['skid', 'name', 'paper_id', 'paper_name', 'annotations', 'synonyms'])
+        df_skids = compact_frame(df_skids.sort_values(["paper_name", "skid"]), int_columns=['skid', 'paper_id'])
+
         if report:
             try:
                 outfile = f"../VFB_reporting_results/CATMAID_SKID_reports/{report}_all_skids_officialnames.tsv"
-                df_skids.to_csv(outfile, sep="\t", index=False)
+                save_report(df_skids, outfile)
                 log_info(f"Saved report to {outfile}")
             except Exception as e:
                 log_error(f"Failed to save report for {URL}", str(e))
@@ -295,9 +304,10 @@ def gen_cat_skid_report_officialnames(URL, PROJECT_ID, paper_annotation, name_an
         return pd.DataFrame()
 
 
-def gen_missing_links_report(URL, PROJECT_ID, paper_annotation, report=False):
+def gen_missing_links_report(URL, PROJECT_ID, paper_annotation, report=False, cat_skids=None):
     """Generate a report of neurons that exist in VFB but aren't linked properly to CATMAID datasets.
-    Outputs Cypher queries needed to add the missing links."""
+    Outputs Cypher queries needed to add the missing links.
+    cat_skids: SKID report from gen_cat_skid_report_officialnames, if already fetched."""
     
     if not NEO4J_AVAILABLE:
         log_error("Neo4j tools not available. Cannot generate missing links report.")
@@ -315,8 +325,9 @@ def gen_missing_links_report(URL, PROJECT_ID, paper_annotation, report=False):
         except Exception as e:
             log_error(f"Failed to remove old file {outfile}: {str(e)}")
     
-    # First get all skids from CATMAID for this dataset
-    cat_skids = gen_cat_skid_report_officialnames(URL, PROJECT_ID, paper_annotation, report=report)
+    # First get all skids from CATMAID for this dataset (unless already given)
+    if cat_skids is None:
+        cat_skids = gen_cat_skid_report_officialnames(URL, PROJECT_ID, paper_annotation, report=report)
     
     if cat_skids.empty:
         log_error(f"No SKIDs found for {URL}. Cannot generate missing links report.")
@@ -330,7 +341,7 @@ def gen_missing_links_report(URL, PROJECT_ID, paper_annotation, report=False):
     
     # Connect to Neo4j
     try:
-        nc = neo4j_connect('http://kb.virtualflybrain.org', 'neo4j', 'vfb')
+        nc = get_connection(('http://kb.virtualflybrain.org', 'neo4j', 'vfb'))
         log_info("Successfully connected to Neo4j database")
     except Exception as e:
         log_error(f"Failed to connect to Neo4j database: {str(e)}")
@@ -344,26 +355,27 @@ def gen_missing_links_report(URL, PROJECT_ID, paper_annotation, report=False):
     log_info(f"Analyzing {len(paper_ids)} papers")
     
     # First, get a mapping of all SKIDs to VFB neurons for this CATMAID instance
-    site_query = f"""
+    site_query = """
     MATCH (i:Individual)-[skid:database_cross_reference]->(s:API)
-    WHERE s.short_form = '{site_short.lower()}_catmaid_api' AND exists(skid.accession)
+    WHERE s.short_form = $api AND exists(skid.accession)
     OPTIONAL MATCH (i)-[:has_source]->(ds:DataSet)
     RETURN i.short_form as vfb_id, i.label as vfb_label, skid.accession[0] as skid, collect(ds.short_form) as ds_ids
     """
     
     try:
-        results = nc.commit_list([site_query])
+        results = nc.commit_list([site_query], parameters=[{'api': f'{site_short.lower()}_catmaid_api'}])
+        site_neurons = results_2_frame(results)
         skid_to_neuron_map = {}
-        for record in results_2_dict_list(results):
+        for vfb_id, vfb_label, skid, ds_ids in zip(site_neurons['vfb_id'], site_neurons['vfb_label'],
+                                                   site_neurons['skid'], site_neurons['ds_ids']):
             try:
-                skid = int(record['skid'])  # Convert to int for consistent comparison
-                skid_to_neuron_map[skid] = {
-                    'vfb_id': record['vfb_id'],
-                    'vfb_label': record['vfb_label'],
-                    'ds_ids': record['ds_ids']
+                skid_to_neuron_map[int(skid)] = {  # Convert to int for consistent comparison
+                    'vfb_id': vfb_id,
+                    'vfb_label': vfb_label,
+                    'ds_ids': ds_ids
                 }
             except ValueError:
-                log_error(f"Invalid SKID format: [{record['skid']}] for {record['vfb_id']}. Skipping.")
+                log_error(f"Invalid SKID format: [{skid}] for {vfb_id}. Skipping.")
         log_info(f"Found {len(skid_to_neuron_map)} neurons with SKIDs in VFB for site {site_short}")
     except Exception as e:
         log_error(f"Failed to query all neurons with SKIDs: {str(e)}")
@@ -381,20 +393,20 @@ def gen_missing_links_report(URL, PROJECT_ID, paper_annotation, report=False):
             continue
         
         # First get the dataset ID for this specific paper
-        ds_query = f"""
+        ds_query = """
         MATCH (ds:DataSet)-[r:database_cross_reference]->(api:API) 
-        WHERE api.short_form ends with '_catmaid_api' AND r.accession[0] = '{paper_id}' 
+        WHERE api.short_form ends with '_catmaid_api' AND r.accession[0] = $paper_id 
         RETURN ds.short_form as ds_id
         """
         
-        ds_results = nc.commit_list([ds_query])
-        ds_info = results_2_dict_list(ds_results)
+        ds_results = nc.commit_list([ds_query], parameters=[{'paper_id': str(paper_id)}])
+        ds_info = results_2_frame(ds_results)
         
-        if not ds_info:
+        if ds_info.empty:
             log_error(f"Could not find dataset in VFB for paper ID {paper_id}")
             continue
             
-        ds_id = ds_info[0]['ds_id']
+        ds_id = ds_info['ds_id'][0]
         log_info(f"Dataset ID for paper {paper_id} is {ds_id}")
         
         # Group all neurons that need to be linked to this dataset
@@ -455,10 +467,11 @@ def gen_missing_links_report(URL, PROJECT_ID, paper_annotation, report=False):
     return cypher_queries
 
 
-def gen_deprecated_neurons_report(URL, PROJECT_ID, paper_annotation, report=False):
+def gen_deprecated_neurons_report(URL, PROJECT_ID, paper_annotation, report=False, cat_skids=None):
     """Generate a report of neurons that exist in VFB but no longer exist in the CATMAID instance.
     These neurons should be marked as deprecated in VFB.
-    Outputs Cypher queries needed to mark neurons as deprecated."""
+    Outputs Cypher queries needed to mark neurons as deprecated.
+    cat_skids: SKID report from gen_cat_skid_report_officialnames, if already fetched."""
     
     if not NEO4J_AVAILABLE:
         log_error("Neo4j tools not available. Cannot generate deprecated neurons report.")
@@ -476,8 +489,9 @@ def gen_deprecated_neurons_report(URL, PROJECT_ID, paper_annotation, report=Fals
         except Exception as e:
             log_error(f"Failed to remove old file {outfile}: {str(e)}")
     
-    # First get all skids from CATMAID for this dataset
-    cat_skids = gen_cat_skid_report_officialnames(URL, PROJECT_ID, paper_annotation, report=report)
+    # First get all skids from CATMAID for this dataset (unless already given)
+    if cat_skids is None:
+        cat_skids = gen_cat_skid_report_officialnames(URL, PROJECT_ID, paper_annotation, report=report)
     
     if cat_skids.empty:
         log_error(f"No SKIDs found for {URL}. Cannot generate deprecated neurons report.")
@@ -492,23 +506,23 @@ def gen_deprecated_neurons_report(URL, PROJECT_ID, paper_annotation, report=Fals
     
     # Connect to Neo4j
     try:
-        nc = neo4j_connect('http://kb.virtualflybrain.org', 'neo4j', 'vfb')
+        nc = get_connection(('http://kb.virtualflybrain.org', 'neo4j', 'vfb'))
         log_info("Successfully connected to Neo4j database")
     except Exception as e:
         log_error(f"Failed to connect to Neo4j database: {str(e)}")
         return []
     
     # Get all neurons in VFB for this CATMAID instance
-    site_query = f"""
+    site_query = """
     MATCH (i:Individual)-[skid:database_cross_reference]->(s:API)
-    WHERE s.short_form = '{site_short.lower()}_catmaid_api' AND exists(skid.accession) AND i.short_form STARTS WITH 'VFB_'
+    WHERE s.short_form = $api AND exists(skid.accession) AND i.short_form STARTS WITH 'VFB_'
     RETURN i.short_form as vfb_id, i.label as vfb_label, skid.accession[0] as skid, 
            CASE WHEN exists(i.deprecated) AND i.deprecated[0] = true THEN true ELSE false END as is_deprecated
     """
     
     try:
-        results = nc.commit_list([site_query])
-        vfb_neurons = results_2_dict_list(results)
+        results = nc.commit_list([site_query], parameters=[{'api': f'{site_short.lower()}_catmaid_api'}])
+        vfb_neurons = results_2_frame(results)
         log_info(f"Found {len(vfb_neurons)} neurons with SKIDs in VFB for site {site_short}")
     except Exception as e:
         log_error(f"Failed to query neurons with SKIDs: {str(e)}")
@@ -518,16 +532,17 @@ def gen_deprecated_neurons_report(URL, PROJECT_ID, paper_annotation, report=Fals
     deprecated_neurons = []
     already_deprecated = []
     
-    for neuron in vfb_neurons:
+    for row in vfb_neurons.itertuples(index=False):
         try:
-            skid = int(neuron['skid'])
+            skid = int(row.skid)
             if skid not in catmaid_skids:
-                if neuron['is_deprecated']:
+                neuron = row._asdict()
+                if row.is_deprecated:
                     already_deprecated.append(neuron)
                 else:
                     deprecated_neurons.append(neuron)
         except ValueError:
-            log_error(f"Invalid SKID format: [{neuron['skid']}] for {neuron['vfb_id']}. Skipping.")
+            log_error(f"Invalid SKID format: [{row.skid}] for {row.vfb_id}. Skipping.")
     
     log_info(f"Found {len(deprecated_neurons)} neurons that need to be marked as deprecated")
     log_info(f"Found {len(already_deprecated)} neurons that are already marked as deprecated")
@@ -568,21 +583,21 @@ def gen_deprecated_neurons_report(URL, PROJECT_ID, paper_annotation, report=Fals
                 'already_deprecated_neurons': len(already_deprecated),
                 'total_nonexistent_skids': len(deprecated_neurons) + len(already_deprecated)
             }
-            pd.DataFrame([summary_data]).to_csv(all_stats_outfile, sep="\t", index=False)
+            save_report(pd.DataFrame([summary_data]), all_stats_outfile)
             log_info(f"Saved summary information to {all_stats_outfile}")
             
             # Save detailed information about neurons to be deprecated
             if deprecated_neurons:
                 stats_outfile = f"../VFB_reporting_results/CATMAID_SKID_reports/{report}_deprecated_neurons.tsv"
                 df = pd.DataFrame(deprecated_neurons)
-                df.to_csv(stats_outfile, sep="\t", index=False)
+                save_report(df, stats_outfile)
                 log_info(f"Saved detailed information about {len(deprecated_neurons)} neurons to be deprecated to {stats_outfile}")
             
             # Save detailed information about already deprecated neurons
             if already_deprecated:
                 existing_stats_outfile = f"../VFB_reporting_results/CATMAID_SKID_reports/{report}_already_deprecated_neurons.tsv"
                 df = pd.DataFrame(already_deprecated)
-                df.to_csv(existing_stats_outfile, sep="\t", index=False)
+                save_report(df, existing_stats_outfile)
                 log_info(f"Saved detailed information about {len(already_deprecated)} already deprecated neurons to {existing_stats_outfile}")
             
             # Save Cypher file only if there are neurons to deprecate
@@ -605,87 +620,75 @@ def gen_deprecated_neurons_report(URL, PROJECT_ID, paper_annotation, report=Fals
     return cypher_queries
 
 
-if __name__ == '__main__':
-    # generate skid reports when this is run as a script
+def add_catmaid_crawls(dag, URL, PROJECT_ID, paper_annotation, name_annotations=None):
+    """Adds tasks fetching the papers and SKIDs for a CATMAID project to a report_dag.ReportDAG,
+    unless already added by another report.  Returns the names of the (papers, SKIDs) tasks."""
+    if not name_annotations:
+        name_annotations = get_annotation_tags(URL)
+    source = f"{URL} {PROJECT_ID} '{paper_annotation}'"
+    papers = dag.add(f"CATMAID papers {source}",
+                     lambda: gen_cat_paper_report(URL, PROJECT_ID, paper_annotation))
+    skids = dag.add(f"CATMAID SKIDs {source} {name_annotations}",
+                    lambda: gen_cat_skid_report_officialnames(URL, PROJECT_ID, paper_annotation, name_annotations))
+    return papers, skids
+
+
+def add_reports(dag):
+    """Adds the SKID, missing links and deprecated neurons reports for each of catmaid_sources
+    to a report_dag.ReportDAG, fetching each CATMAID project once."""
+    save_directory = "../VFB_reporting_results/CATMAID_SKID_reports/"
+    kb_server = ('http://kb.virtualflybrain.org', 'neo4j', 'vfb')
+    for URL, PROJECT_ID, paper_annotation, name_annotations, report in catmaid_sources:
+        _, skids = add_catmaid_crawls(dag, URL, PROJECT_ID, paper_annotation, name_annotations)
+
+        def save_skid_report(cat_skids, report=report):
+            os.makedirs(save_directory, exist_ok=True)
+            save_report(cat_skids, f"{save_directory}{report}_all_skids_officialnames.tsv")
+        dag.add(f"{report} SKID report", save_skid_report, inputs=[skids],
+                outputs=[f"{save_directory}{report}_all_skids_officialnames.tsv"])
+        dag.add(f"{report} missing links report",
+                lambda cat_skids, source=(URL, PROJECT_ID, paper_annotation, report):
+                    gen_missing_links_report(*source, cat_skids=cat_skids),
+                inputs=[skids], server=kb_server)
+        dag.add(f"{report} deprecated neurons report",
+                lambda cat_skids, source=(URL, PROJECT_ID, paper_annotation, report):
+                    gen_deprecated_neurons_report(*source, cat_skids=cat_skids),
+                inputs=[skids], server=kb_server,
+                outputs=[f"{save_directory}{report}_all_deprecated_neurons_summary.tsv"])
+
+
+# variables for generating reports
+# dict of sources and project IDs for larval datasets
+larval_sources = {'l1em': 1, 'abd1.5': 1, 'iav-robo': 1, 'iav-tnt': 4, 'l3vnc': 2}
+# [URL, project ID, paper annotation, name annotations, report name]
+catmaid_sources = [["https://" + s + ".catmaid.virtualflybrain.org", larval_sources[s], "papers",
+                    None, s.upper()] # Using None to trigger automatic annotation selection
+                   for s in larval_sources.keys()]
+catmaid_sources.extend([
+    ["https://fafb.catmaid.virtualflybrain.org", 1, "Published", None, "FAFB"],
+    ["https://fanc.catmaid.virtualflybrain.org", 1, "publication", None, "FANC1"],
+    ["https://fanc.catmaid.virtualflybrain.org", 2, "publication", None, "FANC2"],
+    ["https://radagast.hms.harvard.edu/catmaidvnc", 61, "publication", None, "LEG40"]])
 
-    # variables for generating reports
-    # dict of sources and project IDs for larval datasets
-    larval_sources = {'l1em': 1, 'abd1.5': 1, 'iav-robo': 1, 'iav-tnt': 4, 'l3vnc': 2}
-    larval_reports = [["https://" + s + ".catmaid.virtualflybrain.org", larval_sources[s], "papers",
-                       None, s.upper()] # Using None to trigger automatic annotation selection
-                      for s in larval_sources.keys()]
 
-    FAFB = ["https://fafb.catmaid.virtualflybrain.org", 1, "Published", None, "FAFB"]
-    FANC1 = ["https://fanc.catmaid.virtualflybrain.org", 1, "publication", None, "FANC1"]
-    FANC2 = ["https://fanc.catmaid.virtualflybrain.org", 2, "publication", None, "FANC2"]
-    LEG40 = ["https://radagast.hms.harvard.edu/catmaidvnc", 61, "publication", None, "LEG40"]
+if __name__ == '__main__':
+    # generate skid reports when this is run as a script
 
     # Create output directory if it doesn't exist
     os.makedirs("../VFB_reporting_results/CATMAID_SKID_reports", exist_ok=True)
 
     # make reports with try/except blocks to prevent failures from stopping the process
-    try:
-        for r in larval_reports:
-            gen_cat_skid_report_officialnames(*r)
+    # (each CATMAID project is fetched once and used for all of its reports)
+    for r in catmaid_sources:
+        try:
+            cat_skids = gen_cat_skid_report_officialnames(*r)
             try:
-                gen_missing_links_report(r[0], r[1], r[2], r[4])
+                gen_missing_links_report(r[0], r[1], r[2], r[4], cat_skids=cat_skids)
             except Exception as e:
                 log_error(f"Error generating missing links report for {r[4]}: {str(e)}")
             try:
-                gen_deprecated_neurons_report(r[0], r[1], r[2], r[4])
+                gen_deprecated_neurons_report(r[0], r[1], r[2], r[4], cat_skids=cat_skids)
             except Exception as e:
                 log_error(f"Error generating deprecated neurons report for {r[4]}: {str(e)}")
-    except Exception as e:
-        log_error(f"Error processing larval reports: {str(e)}")
-        
-    try:
-        gen_cat_skid_report_officialnames(*FAFB)
-        try:
-            gen_missing_links_report(*FAFB[0:3], FAFB[4])
-        except Exception as e:
-            log_error(f"Error generating missing links report for FAFB: {str(e)}")
-        try:
-            gen_deprecated_neurons_report(*FAFB[0:3], FAFB[4])
-        except Exception as e:
-            log_error(f"Error generating deprecated neurons report for FAFB: {str(e)}")
-    except Exception as e:
-        log_error(f"Error processing FAFB report: {str(e)}")
-    
-    try:
-        gen_cat_skid_report_officialnames(*FANC1)
-        try:
-            gen_missing_links_report(*FANC1[0:3], FANC1[4])
-        except Exception as e:
-            log_error(f"Error generating missing links report for FANC1: {str(e)}")
-        try:
-            gen_deprecated_neurons_report(*FANC1[0:3], FANC1[4])
-        except Exception as e:
-            log_error(f"Error generating deprecated neurons report for FANC1: {str(e)}")
-    except Exception as e:
-        log_error(f"Error processing FANC1 report: {str(e)}")
-    
-    try:
-        gen_cat_skid_report_officialnames(*FANC2)
-        try:
-            gen_missing_links_report(*FANC2[0:3], FANC2[4])
         except Exception as e:
-            log_error(f"Error generating missing links report for FANC2: {str(e)}")
-        try:
-            gen_deprecated_neurons_report(*FANC2[0:3], FANC2[4])
-        except Exception as e:
-            log_error(f"Error generating deprecated neurons report for FANC2: {str(e)}")
-    except Exception as e:
-        log_error(f"Error processing FANC2 report: {str(e)}")
-    
-    try:
-        gen_cat_skid_report_officialnames(*LEG40)
-        try:
-            gen_missing_links_report(*LEG40[0:3], LEG40[4])
-        except Exception as e:
-            log_error(f"Error generating missing links report for LEG40: {str(e)}")
-        try:
-            gen_deprecated_neurons_report(*LEG40[0:3], LEG40[4])
-        except Exception as e:
-            log_error(f"Error generating deprecated neurons report for LEG40: {str(e)}")
-    except Exception as e:
-        log_error(f"Error processing LEG40 report: {str(e)}")
+            log_error(f"Error processing {r[4]} report: {str(e)}")
@@ -1,4 +1,5 @@
-from reporting_tools import gen_report
+import reporting_tools
+from reporting_tools import gen_report, gen_report_paginated
 import pandas as pd
 from collections import Counter
 import time
@@ -33,8 +34,9 @@ log_info("Starting individual classification report generation")
 start_time = time.time()
 
 # Function to handle batch processing of FBbt IDs
-def get_fbbt_labels_in_batches(server, fbbt_ids, batch_size=50):
-    """Gets FBbt labels in batches to avoid HTTP 415 errors"""
+def get_fbbt_labels_in_batches(server, fbbt_ids, batch_size=1000):
+    """Gets FBbt labels in batches. IDs are passed as a query parameter,
+    so batches are not limited by the size of the query text (HTTP 415 errors)."""
     log_info(f"Processing {len(fbbt_ids)} FBbt IDs in batches of {batch_size}")
     all_labels = pd.DataFrame(columns=["FBbt_ID", "FBbt_label"])
     
@@ -44,14 +46,14 @@ def get_fbbt_labels_in_batches(server, fbbt_ids, batch_size=50):
         log_debug(f"Processing batch {i//batch_size + 1}/{(len(fbbt_ids) + batch_size - 1)//batch_size}")
         
         try:
-            query = ("MATCH (c:Class) WHERE c.short_form IN %s "
-                    "RETURN c.short_form AS FBbt_ID, c.label AS FBbt_label" 
-                    % str(batch))
+            query = ("MATCH (c:Class) WHERE c.short_form IN $ids "
+                    "RETURN c.short_form AS FBbt_ID, c.label AS FBbt_label")
             
             batch_labels = gen_report(
                 server=server,
                 query=query,
-                report_name=f'FBbt_labels_batch_{i//batch_size + 1}'
+                report_name=f'FBbt_labels_batch_{i//batch_size + 1}',
+                parameters={'ids': batch}
             )
             
             if not batch_labels.empty:
@@ -64,22 +66,25 @@ def get_fbbt_labels_in_batches(server, fbbt_ids, batch_size=50):
 
 # Try to get classifications of individuals from both servers
 try:
+    # fetched in pages of individuals (by short_form), several at a time, so no single
+    # query has to return every individual
+    classification_query = ("MATCH (i:Individual)-[:INSTANCEOF]->(c:Class) "
+                            "WHERE c.short_form =~ 'FBbt_[0-9]+' "
+                            "AND i.short_form >= $page_from AND ($page_to IS NULL OR i.short_form < $page_to) "
+                            "RETURN i.short_form AS ind_ID, "
+                            "COLLECT(c.short_form) AS %s_FBbt_IDs")
+    classified = "MATCH (i:Individual)-[:INSTANCEOF]->(c:Class) WHERE c.short_form =~ 'FBbt_[0-9]+'"
+
     log_info("Fetching KB classification data...")
-    KB_classification = gen_report(server=KB_server,
-                                query=("MATCH (i:Individual)-[:INSTANCEOF]->(c:Class) "
-                                        "WHERE c.short_form =~ 'FBbt_[0-9]+' "
-                                        "RETURN i.short_form AS ind_ID, "
-                                        "COLLECT(c.short_form) AS KB_FBbt_IDs"),
-                                report_name='KB_classification')
+    KB_classification = pd.concat(gen_report_paginated(server=KB_server, query=classification_query % 'KB',
+                                                       report_name='KB_classification', key='i.short_form',
+                                                       key_match=classified), ignore_index=True)
     log_info(f"Retrieved {len(KB_classification)} KB classifications")
 
     log_info("Fetching PDB classification data...")
-    PDB_classification = gen_report(server=PDB_server,
-                                    query=("MATCH (i:Individual)-[:INSTANCEOF]->(c:Class) "
-                                        "WHERE c.short_form =~ 'FBbt_[0-9]+' "
-                                        "RETURN i.short_form AS ind_ID, "
-                                        "COLLECT(c.short_form) AS PDB_FBbt_IDs"),
-                                    report_name='PDB_classification')
+    PDB_classification = pd.concat(gen_report_paginated(server=PDB_server, query=classification_query % 'PDB',
+                                                        report_name='PDB_classification', key='i.short_form',
+                                                        key_match=classified), ignore_index=True)
     log_info(f"Retrieved {len(PDB_classification)} PDB classifications")
 except Exception as e:
     log_error(f"Error retrieving classification data: {str(e)}")
@@ -128,7 +133,7 @@ try:
     log_info("Retrieving FBbt labels...")
     fbbt_ids = list(fbbt_classification_diff.index)
     
-    # Use batch processing instead of a single large query
+    # Use batch processing instead of a single very large request
     FBbt_labels = get_fbbt_labels_in_batches(KB_server, fbbt_ids)
     
     if not FBbt_labels.empty:
@@ -166,5 +171,7 @@ except Exception as e:
 
 # Report completion
 elapsed_time = time.time() - start_time
+if reporting_tools.query_cache:
+    reporting_tools.query_cache.print_stats()
 log_info(f"Process completed in {elapsed_time:.2f} seconds")
 
@@ -1,3 +1,5 @@
+import os
+import sys
 import pandas as pd
 import datetime
 import numpy
@@ -6,6 +8,10 @@ from vfb_connect.cross_server_tools import VfbConnect
 import pysolr
 import json
 import itertools 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from query_profiler import profiled_session
+
+solr_session = profiled_session('solr')
 passed = {'hair plate': 'mechanosensory neuron of hair plate', 'campaniform sensillum': 'sensory neuron of campaniform sensillum', 'T3 leg club chordotonal neuron': 'metathoracic femoral chordotonal club neuron', 'T2 leg claw chordotonal neuron': 'mesothoracic femoral chordotonal claw neuron', 'right T1 ventral nerve': 'adult ventral prothoracic nerve',
           'left T1 ventral nerve': 'adult ventral prothoracic nerve', 'T1 leg claw chordotonal neuron': 'prothoracic femoral chordotonal claw neuron', 'T1 leg club chordotonal neuron': 'prothoracic femoral chordotonal club neuron', 'T1 leg hook chordotonal neuron': 'prothoracic femoral chordotonal hook neuron',
           'haltere motor neuron HN bundle':'adult dorsal metathoracic nerve','left T1 dorsal nerve':'adult dorsal prothoracic nerve','right T1 dorsal nerve':'adult dorsal prothoracic nerve','bCS':'bilateral campaniform sensillum neuron of leg','CoHP8':'mechanosensory neuron of prothoracic coxal hair plate CoHP8',
@@ -17,7 +23,7 @@ ref_terms = ['UPDATED', 'LINKED', 'Paper', 'et al.', ' from ',
 
 
 def find_offical_label(term):
-    solr = pysolr.Solr('https://solr.virtualflybrain.org/solr/ontology/')
+    solr = pysolr.Solr('https://solr.virtualflybrain.org/solr/ontology/', session=solr_session)
     for ref in ref_terms:
         if ref in term:
             return ''
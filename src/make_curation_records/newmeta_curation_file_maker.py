@@ -1,8 +1,11 @@
+import os
+import sys
 import pandas as pd
 import datetime
-from vfb_connect import vfb
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from reporting_tools import gen_report
 
-vfb.setNeoEndpoint('http://kb.virtualflybrain.org', usr='neo4j', pwd='vfb')
+KB_server = ('http://kb.virtualflybrain.org', 'neo4j', 'vfb')
 curator = 'cp390'  # change if needed
 
 """
@@ -38,9 +41,9 @@ typed_skids = typed_skids.drop(['paper_name', 'synonyms'], axis=1)
 
 # get FBbt labels from VFB
 FBbt_list = typed_skids['FBbt_id'].drop_duplicates().apply(lambda x: x.replace(':', '_')).to_list()
-query1 = ("MATCH (c:Class) WHERE c.short_form IN %s "
-          "RETURN c.short_form AS FBbt_id, c.label AS FBbt_name" % FBbt_list)
-labels_df = vfb.cypher_query(query1)
+query1 = ("MATCH (c:Class) WHERE c.short_form IN $ids "
+          "RETURN c.short_form AS FBbt_id, c.label AS FBbt_name")
+labels_df = gen_report(KB_server, query1, 'FBbt_labels', parameters={'ids': FBbt_list})
 labels_df['FBbt_id'] = labels_df['FBbt_id'].apply(lambda x: x.replace('_', ':'))
 
 # merge FBbt labels into typed skids dataframe on FBbt ID
@@ -56,11 +59,10 @@ query2 = ("MATCH (api:API)<-[dsxref:database_cross_reference]-(ds:DataSet)"
           "-[skid:database_cross_reference]->(s:Site) "
           "WHERE api.short_form ends with '_catmaid_api' "
           "AND s.short_form starts with 'catmaid_' "
-          "AND dsxref.accession[0] in %s WITH i, skid "
+          "AND dsxref.accession[0] in $paper_ids WITH i, skid "
           "MATCH (i)-[:INSTANCEOF]-(c:Class) "
-          "RETURN distinct skid.accession[0] AS `skid`, c.short_form AS `FBbt_id`"
-          % paper_ids)
-vfb_skid_classes_df = vfb.cypher_query(query2)
+          "RETURN distinct skid.accession[0] AS `skid`, c.short_form AS `FBbt_id`")
+vfb_skid_classes_df = gen_report(KB_server, query2, 'vfb_skid_classes', parameters={'paper_ids': paper_ids})
 vfb_skid_classes_df['FBbt_id'] = vfb_skid_classes_df['FBbt_id'].apply(lambda x: x.replace('_', ':'))
 vfb_skid_classes_df['VFB'] = 'VFB'  # for identifying matches
 
@@ -71,11 +73,10 @@ new_skid_mappings = all_skid_mappings[all_skid_mappings['VFB'].isnull()]  # keep
 new_skid_mappings = new_skid_mappings[new_skid_mappings['paper_id'].notna()]  # drop skids not linked to a paper
 
 # get reference (FBrf or doi) for dataset publications (as dataframe)
-dataset_names = list(set(list(comparison_table['VFB_name'])))  # all ds names
-query3 = ("MATCH (ds:DataSet)-[has_reference]->(p:pub) WHERE ds.short_form IN %s "
-          "RETURN ds.short_form, p.DOI[0], p.FlyBase[0]"
-          % dataset_names)
-dataset_ref_df = vfb.cypher_query(query3)
+dataset_names = comparison_table['VFB_name'].dropna().drop_duplicates().to_list()  # all ds names
+query3 = ("MATCH (ds:DataSet)-[has_reference]->(p:pub) WHERE ds.short_form IN $ds_names "
+          "RETURN ds.short_form, p.DOI[0], p.FlyBase[0]")
+dataset_ref_df = gen_report(KB_server, query3, 'dataset_refs', parameters={'ds_names': dataset_names})
 
 # make a curation record for each dataset
 paper_ids = set(list(new_skid_mappings['paper_id']))
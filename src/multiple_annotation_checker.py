@@ -11,24 +11,25 @@ def multi_annotation_report_gen(source):
     multi_annotated_inds_pdb = gen_report(server=PDB_server,
                                           query=("MATCH p=(n:Individual)-[r:INSTANCEOF]->(c:Class) "
                                                  "WHERE c.short_form CONTAINS 'FBbt' and "
-                                                 "n.label CONTAINS '%s' WITH DISTINCT n, "
+                                                 "n.label CONTAINS $source WITH DISTINCT n, "
                                                  "COUNT(p) AS cp, COLLECT(c.short_form) as PDB_FBbt_ids, "
                                                  "COLLECT(c.label) AS PDB_FBbt_labels WHERE cp >1 "
                                                  "RETURN n.short_form AS Individual_id, n.label "
-                                                 "AS Individual_label, PDB_FBbt_ids, PDB_FBbt_labels" % source),
-                                          report_name='multi_annotated_inds_pdb')
+                                                 "AS Individual_label, PDB_FBbt_ids, PDB_FBbt_labels"),
+                                          report_name='multi_annotated_inds_pdb',
+                                          parameters={'source': source})
 
     ind_ids = list(multi_annotated_inds_pdb['Individual_id'])
 
     annotations_in_kb = gen_report(server=KB_server,
                                    query=("MATCH (n:Individual)-[r:INSTANCEOF]->(c:Class) "
                                           "WHERE c.short_form CONTAINS 'FBbt' and "
-                                          "n.short_form IN %s "
+                                          "n.short_form IN $ids "
                                           "RETURN DISTINCT n.short_form AS Individual_id, "
                                           "COLLECT(c.short_form) AS KB_FBbt_ids, "
-                                          "COLLECT(c.label) AS KB_FBbt_labels"
-                                          % ('[\'' + '\', \''.join(ind_ids) + '\']')),
-                                   report_name='annotations_in_kb')
+                                          "COLLECT(c.label) AS KB_FBbt_labels"),
+                                   report_name='annotations_in_kb',
+                                   parameters={'ids': ind_ids})
 
     multi_annotated_inds = \
         multi_annotated_inds_pdb.set_index('Individual_id').join(annotations_in_kb.set_index('Individual_id'))
@@ -1,8 +1,8 @@
 from uk.ac.ebi.vfb.neo4j.neo4j_tools import neo4j_connect, results_2_dict_list
-import requests
 import warnings
 import re
 import json
+from query_profiler import profiled_session
 
 ## MVP: queries when passed a curie map
 ## desireable: obo curies automatically generated from query string.
@@ -20,6 +20,7 @@ class OWLeryConnect:
                 Default: ('FBbt', 'RO')
            curies: Dict of curie: base"""
         self.owlery_endpoint = endpoint
+        self.session = profiled_session('owlery')
         if not (lookup):
             self.lookup = {}
         else:
@@ -45,7 +46,7 @@ class OWLeryConnect:
         payload = {'object': query, 'prefixes': json.dumps(self.curies),
                    'direct': direct}
         # print(payload)
-        r = requests.get(url=owl_endpoint, params=payload)
+        r = self.session.get(url=owl_endpoint, params=payload)
         print("Query URL: " + r.url)
         if r.status_code == 200:
             return r.json()[return_type]
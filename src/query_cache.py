@@ -0,0 +1,207 @@
+"""Persistent on-disk cache of query results, used by reporting_tools.gen_report.
+
+Entries are keyed by endpoint, normalized query text, parameters and a cheap
+fingerprint of the database (its total node and relationship counts).  Entries
+expire after max_age seconds and the least recently used are evicted once the
+cache exceeds max_bytes.
+
+The fingerprint only changes when nodes or relationships are added or removed.
+A reload that edits properties or labels, or adds and removes the same number
+of nodes and relationships, leaves it unchanged, so until they expire cached
+results can be stale by up to max_age (a day by default).  Keep max_age below
+the interval between database loads, or clear the cache after a load.
+
+Enable by setting VFB_QUERY_CACHE to a directory (optionally with
+VFB_QUERY_CACHE_MAX_MB and VFB_QUERY_CACHE_MAX_AGE_HOURS) or by calling
+reporting_tools.enable_query_cache().
+"""
+import hashlib
+import json
+import os
+import pickle
+import re
+import threading
+import time
+import pandas as pd
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'vfb_reporting', 'queries')
+
+# quoted strings are kept as they are, other runs of whitespace collapse to a single space
+_QUERY_TOKENS = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")|\s+")
+
+
+def normalize_query(query):
+    """Collapses insignificant whitespace so reformatted queries share cache entries."""
+    return _QUERY_TOKENS.sub(lambda m: m.group(1) or ' ', query).strip()
+
+
+class QueryCache:
+    """On-disk cache of report dataframes with size- and age-based eviction."""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=2 * 1024 ** 3, max_age=24 * 60 * 60,
+                 fingerprint_ttl=10 * 60):
+        """directory: where entries are stored (created if needed)
+           max_bytes: total size above which least recently used entries are evicted
+           max_age: seconds after which an entry is no longer used
+           fingerprint_ttl: seconds for which a database fingerprint is reused in this process"""
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.fingerprint_ttl = fingerprint_ttl
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        """Returns a QueryCache configured from environment variables, or None if VFB_QUERY_CACHE is not set."""
+        directory = os.environ.get('VFB_QUERY_CACHE')
+        if not directory:
+            return None
+        kwargs = {}
+        if os.environ.get('VFB_QUERY_CACHE_MAX_MB'):
+            kwargs['max_bytes'] = int(float(os.environ['VFB_QUERY_CACHE_MAX_MB']) * 1024 ** 2)
+        if os.environ.get('VFB_QUERY_CACHE_MAX_AGE_HOURS'):
+            kwargs['max_age'] = float(os.environ['VFB_QUERY_CACHE_MAX_AGE_HOURS']) * 60 * 60
+        return cls(directory, **kwargs)
+
+    def fingerprint(self, endpoint, fetch):
+        """Returns the database fingerprint for endpoint, calling fetch() to get a new
+        one at most once every fingerprint_ttl seconds."""
+        with self._lock:
+            cached = self._fingerprints.get(endpoint)
+        if cached and time.time() - cached[1] < self.fingerprint_ttl:
+            return cached[0]
+        fingerprint = fetch()
+        with self._lock:
+            self._fingerprints[endpoint] = (fingerprint, time.time())
+        return fingerprint
+
+    def key(self, endpoint, query, parameters=None, fingerprint='', variant=None):
+        """Cache key for a query against a database in a given state (fingerprint; see above
+        for what it misses).  variant distinguishes different stored forms of the same result
+        (e.g. chunked)."""
+        material = json.dumps([endpoint.rstrip('/'), normalize_query(query), parameters, fingerprint, variant],
+                              sort_keys=True, default=str)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def get(self, key):
+        """Returns the cached dataframe for key, or None if absent or expired."""
+        path = self._path(key)
+        try:
+            age = time.time() - os.path.getmtime(path)
+            if age > self.max_age:
+                os.remove(path)
+                raise FileNotFoundError(path)
+            report = pd.read_pickle(path)
+            os.utime(path, (time.time(), os.path.getmtime(path)))  # atime marks recent use
+        except (OSError, EOFError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return report
+
+    def get_stream(self, key):
+        """Returns an iterator over the cached chunks of a streamed result
+        (see put_stream), or None if absent or expired."""
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                os.remove(path)
+                raise FileNotFoundError(path)
+            f = open(path, 'rb')
+            os.utime(path, (time.time(), os.path.getmtime(path)))
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+
+        def chunks():
+            with f:
+                while True:
+                    try:
+                        yield pickle.load(f)
+                    except EOFError:
+                        return
+        return chunks()
+
+    def put_stream(self, key, chunks):
+        """Passes through an iterator of dataframe chunks, storing them one at a time
+        under key.  Nothing is stored unless the iterator is consumed to the end."""
+        path = self._path(key)
+        part_file = '%s.%d.%d.part' % (path, os.getpid(), threading.get_ident())
+        try:
+            with open(part_file, 'wb') as f:
+                for chunk in chunks:
+                    pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    yield chunk
+            os.replace(part_file, path)
+            with self._lock:
+                self.stores += 1
+            self.evict()
+        finally:
+            if os.path.exists(part_file):
+                os.remove(part_file)
+
+    def put(self, key, report):
+        """Stores a dataframe under key, then evicts entries if needed."""
+        path = self._path(key)
+        part_file = '%s.%d.%d.part' % (path, os.getpid(), threading.get_ident())
+        report.to_pickle(part_file)
+        os.replace(part_file, path)
+        with self._lock:
+            self.stores += 1
+        self.evict()
+
+    def evict(self):
+        """Removes expired entries, then least recently used ones until the cache fits in max_bytes."""
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.pkl'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if now - st.st_mtime > self.max_age:
+                self._remove(path)
+            else:
+                entries.append((st.st_atime, st.st_size, path))
+        total = sum(e[1] for e in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self.evictions += 1
+
+    def stats(self):
+        """Cache-hit statistics for this process."""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'stores': self.stores,
+                'evictions': self.evictions, 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def print_stats(self):
+        s = self.stats()
+        print("Query cache (%s): %d hits, %d misses (%.0f%% hit rate), %d stored, %d evicted"
+              % (self.directory, s['hits'], s['misses'], 100 * s['hit_rate'], s['stores'], s['evictions']))
@@ -0,0 +1,145 @@
+"""Captures Neo4j query plans and flags queries whose plans got worse.
+
+With VFB_QUERY_PLANS=profile, reporting_tools runs report queries under PROFILE
+(the results are used as normal, and the plan comes back with them); with
+VFB_QUERY_PLANS=explain, each query is also sent under EXPLAIN, which plans it
+without running it.  The operator tree, db hits and estimated rows are stored as
+JSON in VFB_QUERY_PLAN_DIR (default ../VFB_reporting_results/query_plans/), one
+file per server and query (see query_profiler.query_id), and compared with the
+plan stored on the previous run.
+
+A plan is flagged as a regression if it has a new full scan (all nodes or all
+relationships), a new label scan or cartesian product, or many times more db hits
+or estimated rows than before.  Regressions are printed as they are found and
+written to plan_regressions.tsv in the plan directory when the process exits.
+"""
+import atexit
+import datetime
+import json
+import os
+import threading
+from collections import Counter
+from urllib.parse import urlsplit
+import pandas as pd
+from query_profiler import query_id
+
+DEFAULT_PLAN_DIR = '../VFB_reporting_results/query_plans'
+
+# operators flagged when they first appear in a plan: scans of every node or
+# relationship (of a label or type) and cartesian products
+SCAN_OPERATORS = ('AllNodesScan', 'NodeByLabelScan', 'DirectedAllRelationshipsScan',
+                  'UndirectedAllRelationshipsScan', 'DirectedRelationshipTypeScan',
+                  'UndirectedRelationshipTypeScan', 'CartesianProduct')
+
+
+def summarize(plan):
+    """The parts of a plan from the transactional endpoint ('plan' or 'profile') worth keeping:
+    a tree of {'operator', 'details', 'estimated_rows', 'db_hits', 'rows', 'children'}."""
+    plan = plan.get('root', plan)
+    args = plan.get('args', {})
+    return {'operator': plan['operatorType'].split('@')[0],
+            'details': args.get('Details') or ', '.join(plan.get('identifiers', [])),
+            'estimated_rows': args.get('EstimatedRows', plan.get('estimatedRows')),
+            'db_hits': args.get('DbHits', plan.get('dbHits')),
+            'rows': args.get('Rows', plan.get('rows')),
+            'children': [summarize(c) for c in plan.get('children', [])]}
+
+
+def operators(tree):
+    """All operators in a plan tree, depth first."""
+    yield tree
+    for child in tree['children']:
+        yield from operators(child)
+
+
+def totals(tree):
+    """Total db hits (None for an EXPLAIN plan) and the estimated rows of the plan's result."""
+    db_hits = [o['db_hits'] for o in operators(tree) if o['db_hits'] is not None]
+    return (sum(db_hits) if db_hits else None), tree['estimated_rows']
+
+
+def compare(previous, current, factor=2.0, min_db_hits=10000, min_rows=10000):
+    """Reasons a plan (see summarize) is worse than the previous one, as a list of strings.
+    Counts must grow by more than factor (and exceed min_db_hits or min_rows) to count."""
+    reasons = []
+    before = Counter((o['operator'], o['details']) for o in operators(previous) if o['operator'] in SCAN_OPERATORS)
+    after = Counter((o['operator'], o['details']) for o in operators(current) if o['operator'] in SCAN_OPERATORS)
+    for operator, details in (after - before):
+        reasons.append("new %s%s" % (operator, " (%s)" % details if details else ''))
+    (old_hits, old_rows), (new_hits, new_rows) = totals(previous), totals(current)
+    if old_hits is not None and new_hits is not None and new_hits > max(old_hits * factor, min_db_hits):
+        reasons.append("db hits up from %d to %d" % (old_hits, new_hits))
+    if old_rows is not None and new_rows is not None and new_rows > max(old_rows * factor, min_rows):
+        reasons.append("estimated rows up from %d to %d" % (old_rows, new_rows))
+    return reasons
+
+
+class PlanStore:
+    """Stored query plans, one JSON file per server and query."""
+
+    def __init__(self, mode, directory=DEFAULT_PLAN_DIR):
+        """mode: 'profile' or 'explain'"""
+        if mode not in ('profile', 'explain'):
+            raise ValueError("Unknown query plan mode: %s" % mode)
+        self.mode = mode
+        self.directory = directory
+        self.regressions = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Returns a PlanStore configured from VFB_QUERY_PLANS and VFB_QUERY_PLAN_DIR,
+        or None if VFB_QUERY_PLANS is not set."""
+        mode = os.environ.get('VFB_QUERY_PLANS', '').lower()
+        if not mode:
+            return None
+        return cls(mode, os.environ.get('VFB_QUERY_PLAN_DIR', DEFAULT_PLAN_DIR))
+
+    def statement(self, query):
+        """The query as it should be sent to capture its plan."""
+        if query.lstrip()[:8].upper().startswith(('PROFILE', 'EXPLAIN')):
+            return query
+        return '%s %s' % (self.mode.upper(), query)
+
+    def path(self, endpoint, query):
+        return os.path.join(self.directory, urlsplit(endpoint).netloc or endpoint, query_id(query) + '.json')
+
+    def record(self, endpoint, query, plan):
+        """Stores the plan (as returned by the server) for a query, comparing it with the
+        previous one.  Returns the reasons it is a regression (empty if it isn't)."""
+        if not plan:
+            return []
+        tree = summarize(plan)
+        db_hits, estimated_rows = totals(tree)
+        path = self.path(endpoint, query)
+        previous = None
+        if os.path.exists(path):
+            with open(path) as f:
+                previous = json.load(f)
+        reasons = compare(previous['plan'], tree) if previous else []
+        if reasons:
+            print("Query plan regression on %s (%s): %s\n%s" % (endpoint, query_id(query), '; '.join(reasons), query))
+            with self._lock:
+                self.regressions.append({'endpoint': endpoint, 'id': query_id(query), 'reasons': '; '.join(reasons),
+                                         'previous_captured': previous['captured'], 'query': query})
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        part_file = '%s.%d.part' % (path, threading.get_ident())
+        with open(part_file, 'w') as f:
+            json.dump({'query': query, 'endpoint': endpoint, 'mode': self.mode,
+                       'captured': datetime.datetime.now(tz=datetime.timezone.utc).isoformat(),
+                       'db_hits': db_hits, 'estimated_rows': estimated_rows,
+                       'regressions': reasons, 'plan': tree}, f, indent=1)
+        os.replace(part_file, path)
+        return reasons
+
+    def write_regressions(self):
+        """Writes plan_regressions.tsv (empty if there were none) to the plan directory."""
+        os.makedirs(self.directory, exist_ok=True)
+        pd.DataFrame(self.regressions, columns=['endpoint', 'id', 'reasons', 'previous_captured', 'query']).to_csv(
+            os.path.join(self.directory, 'plan_regressions.tsv'), sep='\t', index=False)
+        print("%d query plan regressions" % len(self.regressions))
+
+
+plan_store = PlanStore.from_env()
+if plan_store:
+    atexit.register(plan_store.write_regressions)
@@ -0,0 +1,138 @@
+"""Timing and size of every query sent to Neo4j, CATMAID, Owlery and Solr.
+
+reporting_tools records each request to a Neo4j server: wall-clock time, time to
+headers (until the response headers arrived: the server's time plus the network
+round trip, and for streamed results only until the first rows were ready), rows,
+response bytes and time spent decoding.  HTTP calls to other services are recorded through a requests response
+hook (see profiled_session), without rows or decode time.
+
+Each record has a stable query id: a hash of the normalized query text (without
+parameter values) for Cypher, or of the service, method and URL path for HTTP
+calls, so the same query can be followed across runs.
+
+If VFB_QUERY_PROFILE_DIR is set, the records are written there when the process
+exits: query_profile.json (every call, plus totals per query id) and
+slow_queries.tsv (per query id, most expensive first).
+"""
+import atexit
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+import pandas as pd
+import requests
+import cassette  # records or replays every HTTP response if VFB_CASSETTE is set
+from deadlines import DeadlineAdapter
+from query_cache import normalize_query
+
+PROFILE_COLUMNS = ['id', 'service', 'endpoint', 'calls', 'total_wall', 'mean_wall', 'max_wall',
+                   'total_time_to_headers', 'total_decode', 'rows', 'bytes', 'errors', 'query']
+
+
+def query_id(text):
+    """Stable identifier for a query (Cypher text or 'service METHOD path')."""
+    return hashlib.sha1(normalize_query(text).encode('utf-8')).hexdigest()[:12]
+
+
+class QueryProfiler:
+    """Collects one record per query sent."""
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def start(self, service, endpoint, query):
+        """Starts timing a query and returns its record, to be passed to finish."""
+        return {'id': query_id(query), 'service': service, 'endpoint': endpoint,
+                'query': normalize_query(query)[:500], 'started': time.time(),
+                'wall': None, 'time_to_headers': None, 'decode': None, 'rows': None, 'bytes': None, 'error': None}
+
+    def finish(self, record, **values):
+        """Stops timing a query, updating its record with any of time_to_headers, decode, rows,
+        bytes, error (as given) and wall (default the time since start), and keeps the record."""
+        values.setdefault('wall', time.time() - record['started'])
+        record.update(values)
+        with self._lock:
+            self.records.append(record)
+        return record
+
+    def session_hook(self, service):
+        """A requests response hook recording each response as a query to service."""
+        def hook(response, *args, **kwargs):
+            request = response.request
+            url = urlsplit(request.url)
+            record = self.start(service, '%s://%s' % (url.scheme, url.netloc),
+                                '%s %s %s' % (service, request.method, url.path))
+            record['started'] -= response.elapsed.total_seconds()
+            size = None
+            if not kwargs.get('stream'):
+                size = len(response.content)  # read now rather than by the caller, to time it
+            self.finish(record, time_to_headers=response.elapsed.total_seconds(), bytes=size,
+                        error=None if response.ok else '%s %s' % (response.status_code, response.reason))
+            return response
+        return hook
+
+    def frame(self):
+        """All records as a dataframe."""
+        with self._lock:
+            records = list(self.records)
+        return pd.DataFrame(records, columns=['id', 'service', 'endpoint', 'query', 'started', 'wall',
+                                              'time_to_headers', 'decode', 'rows', 'bytes', 'error'])
+
+    def summary(self):
+        """Totals per query id, most expensive (total wall-clock time) first."""
+        records = self.frame()
+        if records.empty:
+            return pd.DataFrame(columns=PROFILE_COLUMNS)
+        summary = records.groupby('id').agg(
+            service=('service', 'first'), endpoint=('endpoint', 'first'), calls=('id', 'size'),
+            total_wall=('wall', 'sum'), mean_wall=('wall', 'mean'), max_wall=('wall', 'max'),
+            total_time_to_headers=('time_to_headers', 'sum'), total_decode=('decode', 'sum'), rows=('rows', 'sum'),
+            bytes=('bytes', 'sum'), errors=('error', 'count'), query=('query', 'first')).reset_index()
+        return summary.sort_values('total_wall', ascending=False, ignore_index=True)[PROFILE_COLUMNS]
+
+    def write(self, directory):
+        """Writes query_profile.json and slow_queries.tsv to directory."""
+        os.makedirs(directory, exist_ok=True)
+        records = self.frame()
+        summary = self.summary()
+        profile = {'written': datetime.datetime.now(tz=datetime.timezone.utc).isoformat(),
+                   'queries': json.loads(summary.to_json(orient='records')),
+                   'calls': json.loads(records.to_json(orient='records'))}
+        with open(os.path.join(directory, 'query_profile.json'), 'w') as f:
+            json.dump(profile, f, indent=1)
+        summary.to_csv(os.path.join(directory, 'slow_queries.tsv'), sep='\t', index=False, float_format='%.3f')
+        print("Wrote profile of %d queries (%d distinct) to %s" % (len(records), len(summary), directory))
+
+    def print_summary(self, top=10):
+        """Prints the most expensive queries."""
+        summary = self.summary().head(top)
+        for _, q in summary.iterrows():
+            print("%8.1fs %5d calls  %-8s %s" % (q['total_wall'], q['calls'], q['service'], q['query'][:100]))
+
+
+PROFILER = QueryProfiler()
+
+
+def profiled_session(service, retry_post=False):
+    """A requests.Session whose responses are recorded by PROFILER as queries to service.
+    Requests have timeouts, are retried and respect report deadlines (see deadlines.py);
+    pass retry_post=True if the service's POSTs are reads, so they can be retried too."""
+    session = requests.session()
+    adapter = DeadlineAdapter(retry_post=retry_post)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.hooks['response'].append(PROFILER.session_hook(service))
+    return session
+
+
+def _write_on_exit():
+    directory = os.environ.get('VFB_QUERY_PROFILE_DIR')
+    if directory and PROFILER.records:
+        PROFILER.write(directory)
+
+
+atexit.register(_write_on_exit)
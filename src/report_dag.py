@@ -0,0 +1,194 @@
+"""Runs reports as a graph of tasks in one process.
+
+Each task declares the tasks whose results it takes as inputs, the files it writes
+and (for tasks that query a server) a cheap fingerprint of that server's data.
+Tasks run on a thread pool as soon as their inputs are ready (see
+reporting_tools.run_reports), with results passed between them in memory.
+
+A task is skipped if its fingerprint and the digests of its inputs are the same
+as on the last run, it last ran less than VFB_REPORT_MAX_AGE_DAYS (default 7) days
+ago and its output files still exist.  Server fingerprints are only node and
+relationship counts, so edits to properties are missed until the task's last run
+is older than that.  The state of the last run is kept in a JSON file
+(VFB_REPORT_STATE, default ../VFB_reporting_results/report_state.json).  If a
+skipped task's result is needed by a task that does run, it is recomputed then.
+"""
+import datetime
+import glob
+import hashlib
+import json
+import os
+import pickle
+import threading
+import pandas as pd
+from deadlines import REPORT_TIMEOUT
+from reporting_tools import db_fingerprint, get_connection, run_reports
+
+DEFAULT_STATE_FILE = os.environ.get('VFB_REPORT_STATE', '../VFB_reporting_results/report_state.json')
+MAX_AGE_DAYS = float(os.environ.get('VFB_REPORT_MAX_AGE_DAYS', 7))
+
+
+def digest(value):
+    """Content hash of a task result (dataframes, tuples/lists of them or anything picklable)."""
+    h = hashlib.sha256()
+    if isinstance(value, pd.DataFrame):
+        h.update(json.dumps([str(c) for c in value.columns]).encode('utf-8'))
+        try:
+            h.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+        except TypeError:  # unhashable cells, e.g. lists
+            h.update(value.to_csv().encode('utf-8'))
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            h.update(digest(v).encode('utf-8'))
+    elif value is not None:
+        try:
+            h.update(pickle.dumps(value))
+        except Exception:
+            h.update(repr(value).encode('utf-8'))
+    return h.hexdigest()
+
+
+def files_digest(patterns):
+    """Content hash of the files matching a list of glob patterns."""
+    h = hashlib.sha256()
+    for path in sorted(set(f for pattern in patterns for f in glob.glob(pattern))):
+        h.update(path.encode('utf-8'))
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+    return h.hexdigest()
+
+
+def outputs_exist(outputs):
+    """True if every output file (or glob pattern) matches at least one file."""
+    return all(glob.glob(pattern) for pattern in outputs)
+
+
+class _Result:
+    """A task's result as passed to the tasks that depend on it.  For a skipped task
+    the value is only computed if a dependant asks for it."""
+
+    def __init__(self, digest, value=None, compute=None):
+        self.digest = digest
+        self._value = value
+        self._compute = compute
+        self._lock = threading.Lock()
+
+    def value(self):
+        with self._lock:
+            if self._compute:
+                self._value = self._compute()
+                self._compute = None
+            return self._value
+
+
+class ReportDAG:
+    """A set of report tasks and their dependencies."""
+
+    def __init__(self, state_file=DEFAULT_STATE_FILE, max_age_days=MAX_AGE_DAYS):
+        """state_file: where the state of the last run is kept, or None to run every task every time.
+        max_age_days: a task whose last run is older than this runs again, even if its inputs are unchanged."""
+        self.state_file = state_file
+        self.max_age_days = max_age_days
+        self.tasks = {}
+        self._fingerprints = {}
+        self._fingerprint_lock = threading.Lock()
+
+    def add(self, name, function, inputs=(), outputs=(), server=None, fingerprint=None):
+        """Adds a task, unless one with the same name has already been added (so shared
+        inputs such as a CATMAID crawl can be declared by every report that uses them).
+        Args:
+            name: task name
+            function: called with the results of inputs, in order.  Its return value is the task's result
+                (if it returns None, dependants see changes through the task's output files instead).
+            inputs: names of the tasks this one depends on
+            outputs: files (or glob patterns) the task writes.  A task is not skipped if any are missing.
+            server: the server the task queries, if any, as [endpoint, usr, pwd].  Used to limit
+                the number of tasks querying a server at once.
+            fingerprint: callable returning a value that changes when the task's external inputs change.
+                Defaults to the server's fingerprint (see server_fingerprint) for tasks with a server.
+                A task with neither a fingerprint nor inputs runs every time.
+        Returns the task name."""
+        if name not in self.tasks:
+            if fingerprint is None and server is not None:
+                fingerprint = self.server_fingerprint(server)
+            self.tasks[name] = {'function': function, 'inputs': list(inputs), 'outputs': list(outputs),
+                                'server': tuple(server) if server else None, 'fingerprint': fingerprint}
+        return name
+
+    def server_fingerprint(self, server):
+        """A fingerprint function for a Neo4j server's data (node and relationship counts,
+        see reporting_tools.db_fingerprint), fetched at most once per run."""
+        server = tuple(server)
+
+        def fingerprint():
+            with self._fingerprint_lock:
+                if server not in self._fingerprints:
+                    self._fingerprints[server] = db_fingerprint(get_connection(server))
+                return self._fingerprints[server]
+        return fingerprint
+
+    def load_state(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return {}
+        with open(self.state_file) as f:
+            return json.load(f)
+
+    def save_state(self, state):
+        if not self.state_file:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_file)), exist_ok=True)
+        part_file = self.state_file + '.part'
+        with open(part_file, 'w') as f:
+            json.dump(state, f, indent=1, sort_keys=True)
+        os.replace(part_file, self.state_file)
+
+    def _recent(self, last):
+        """Whether a task's last run (from the state file) was less than max_age_days ago."""
+        if not last.get('finished'):
+            return False
+        age = datetime.datetime.now(tz=datetime.timezone.utc) - datetime.datetime.fromisoformat(last['finished'])
+        return age < datetime.timedelta(days=self.max_age_days)
+
+    def run(self, max_per_server=2, max_workers=None, force=False, timeout=REPORT_TIMEOUT):
+        """Runs the tasks, skipping those whose inputs are unchanged (unless force).
+        Each task has timeout seconds (None for no limit) before it fails with a deadlines.ReportTimeout.
+        Returns a dict of task name: exception for tasks that failed, timed out or were skipped
+        because an input failed."""
+        previous = self.load_state()
+        state = {name: last for name, last in previous.items() if name not in self.tasks}
+        skipped = []
+        lock = threading.Lock()
+        self._fingerprints = {}
+
+        def wrap(name, task):
+            def run(*inputs):
+                key = None
+                if task['fingerprint'] or inputs:
+                    fingerprint = task['fingerprint']() if task['fingerprint'] else None
+                    key = hashlib.sha256(json.dumps([fingerprint, [i.digest for i in inputs]],
+                                                    default=str).encode('utf-8')).hexdigest()
+                last = previous.get(name, {})
+                if not force and key and last.get('key') == key and self._recent(last) \
+                        and outputs_exist(task['outputs']):
+                    print("Skipping %s: inputs unchanged since %s" % (name, last.get('finished')))
+                    with lock:
+                        state[name] = last
+                        skipped.append(name)
+                    return _Result(last.get('digest'),
+                                   compute=lambda: task['function'](*[i.value() for i in inputs]))
+                value = task['function'](*[i.value() for i in inputs])
+                # a task that returns nothing is identified by the files it writes
+                result = _Result(digest(value) if value is not None else files_digest(task['outputs']),
+                                 value=value)
+                with lock:
+                    state[name] = {'key': key, 'digest': result.digest,
+                                   'finished': datetime.datetime.now(tz=datetime.timezone.utc).isoformat()}
+                return result
+            return task['server'], run, task['inputs']
+
+        _, failures = run_reports({name: wrap(name, task) for name, task in self.tasks.items()},
+                                  max_per_server=max_per_server, max_workers=max_workers, timeout=timeout)
+        print("%d tasks skipped as unchanged: %s" % (len(skipped), ', '.join(skipped)))
+        self.save_state(state)
+        return failures
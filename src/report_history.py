@@ -0,0 +1,204 @@
+"""Local history of daily report snapshots, for trend questions such as how the
+number of individuals per dataset on pdb has changed over the last 90 days.
+
+Every snapshot of a report (dataset, label count or content report) is appended
+to a SQLite database, tagged with the report name, server and time it was taken.
+Values are stored one per row as (key, metric, value), where key identifies a row
+of the report (e.g. a dataset's short_form) and metric is a numeric column, so
+reports with different columns share one table and new columns need no migration.
+Reports that daily_reports skips as unchanged are not recorded again, so a day
+with no snapshot means no change.
+
+The database is ../VFB_reporting_results/report_history.sqlite unless
+VFB_REPORT_HISTORY is set (set it to an empty string to stop recording).
+"""
+import datetime
+import os
+import sqlite3
+import threading
+import pandas as pd
+import cassette
+
+DEFAULT_HISTORY_FILE = '../VFB_reporting_results/report_history.sqlite'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    report TEXT NOT NULL,
+    server TEXT NOT NULL,
+    taken_at TEXT NOT NULL,
+    day TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snapshots_by_day ON snapshots (report, server, day, taken_at);
+CREATE TABLE IF NOT EXISTS snapshot_values (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots (id),
+    key TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS snapshot_values_by_metric ON snapshot_values (snapshot_id, metric, key);
+"""
+
+# the last snapshot of each day for a report and server
+_DAILY = """
+SELECT s.id, s.day, s.taken_at FROM snapshots s
+WHERE s.report = :report AND s.server = :server
+AND s.taken_at = (SELECT MAX(taken_at) FROM snapshots
+                  WHERE report = s.report AND server = s.server AND day = s.day)
+"""
+
+
+def server_name(server):
+    """Name a server is recorded under: the host of its endpoint (e.g. pdb.virtualflybrain.org),
+    given [endpoint, usr, pwd], an endpoint or a name."""
+    if isinstance(server, (list, tuple)):
+        server = server[0]
+    return server.split('://')[-1].rstrip('/')
+
+
+def _timestamp(when):
+    """ISO 8601 UTC string for a datetime, date or ISO string (None for None)."""
+    if when is None or isinstance(when, str):
+        return when
+    if not isinstance(when, datetime.datetime):
+        return when.isoformat()
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return when.astimezone(datetime.timezone.utc).isoformat()
+
+
+class ReportHistory:
+    """SQLite store of report snapshots."""
+
+    def __init__(self, path=DEFAULT_HISTORY_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as db:
+            db.executescript(_SCHEMA)
+
+    @classmethod
+    def from_env(cls):
+        """Returns a ReportHistory at VFB_REPORT_HISTORY (default DEFAULT_HISTORY_FILE),
+        or None if VFB_REPORT_HISTORY is set to an empty string or a cassette is being
+        replayed (the reports are not new)."""
+        path = os.environ.get('VFB_REPORT_HISTORY', DEFAULT_HISTORY_FILE)
+        return cls(path) if path and not cassette.replaying() else None
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def record(self, report, server, values, taken_at=None):
+        """Appends a snapshot.
+        Args:
+            report: report name, e.g. 'pdb' or 'content'
+            server: the server the report is from (see server_name)
+            values: iterable of (key, metric, value)
+            taken_at: when the report was generated (default now)
+        Returns the snapshot id."""
+        taken_at = _timestamp(taken_at or datetime.datetime.now(tz=datetime.timezone.utc))
+        with self._lock, self._connect() as db:
+            snapshot = db.execute("INSERT INTO snapshots (report, server, taken_at, day) VALUES (?, ?, ?, ?)",
+                                  (report, server_name(server), taken_at, taken_at[:10])).lastrowid
+            db.executemany("INSERT INTO snapshot_values (snapshot_id, key, metric, value) VALUES (?, ?, ?, ?)",
+                           ((snapshot, str(k), str(m), None if pd.isna(v) else float(v)) for k, m, v in values))
+        return snapshot
+
+    def record_report(self, report_name, server, report, key_columns, taken_at=None):
+        """Appends a snapshot of a report dataframe.  Each numeric column (other than key_columns)
+        is a metric, and each row is keyed by its key_columns values joined with tabs.
+        Only the first row with each key is recorded (e.g. the dataset report has a row
+        per license of a dataset, with the same counts)."""
+        key_columns = [c for c in key_columns if c in report.columns]
+        metrics = [c for c in report.select_dtypes(include='number').columns if c not in key_columns]
+        if key_columns:
+            keys = report[key_columns].astype(str).agg('\t'.join, axis=1)
+        else:
+            keys = pd.Series([''] * len(report), index=report.index)
+        first = ~keys.duplicated().to_numpy()
+        report, keys = report[first], keys[first]
+        values = ((k, m, v) for m in metrics for k, v in zip(keys, report[m]))
+        return self.record(report_name, server, values, taken_at=taken_at)
+
+    def record_metrics(self, report_name, server, metrics, taken_at=None):
+        """Appends a snapshot of single values, given as a dict of metric: value (keyed '')."""
+        return self.record(report_name, server, (('', m, v) for m, v in metrics.items()), taken_at=taken_at)
+
+    def snapshots(self, report=None, server=None):
+        """Dataframe of recorded snapshots (id, report, server, taken_at, day)."""
+        query = "SELECT * FROM snapshots WHERE (:report IS NULL OR report = :report) " \
+                "AND (:server IS NULL OR server = :server) ORDER BY taken_at"
+        with self._connect() as db:
+            return pd.read_sql_query(query, db, params={'report': report,
+                                                        'server': server and server_name(server)})
+
+    def query(self, report, server, metric=None, key=None, start=None, end=None):
+        """Dataframe (taken_at, key, metric, value) of every recorded value of a report
+        from a server taken between start and end (datetimes, dates or ISO strings, inclusive),
+        optionally only for one metric and/or key."""
+        query = ("SELECT s.taken_at, v.key, v.metric, v.value FROM snapshots s "
+                 "JOIN snapshot_values v ON v.snapshot_id = s.id "
+                 "WHERE s.report = :report AND s.server = :server "
+                 "AND (:metric IS NULL OR v.metric = :metric) AND (:key IS NULL OR v.key = :key) "
+                 "AND (:start IS NULL OR s.taken_at >= :start) AND (:end IS NULL OR s.taken_at <= :end) "
+                 "ORDER BY s.taken_at, v.key, v.metric")
+        with self._connect() as db:
+            return pd.read_sql_query(query, db, params={
+                'report': report, 'server': server_name(server), 'metric': metric, 'key': key,
+                'start': _timestamp(start), 'end': _end(end)})
+
+    def daily_deltas(self, report, server, metric=None, start=None, end=None, changed_only=True):
+        """Day-over-day changes in a report from a server, comparing the last snapshot of
+        each day with the last snapshot of the previous day recorded.
+        Returns a dataframe (day, key, metric, value, previous, change, status), where status is
+        'added' (previous is NaN), 'removed' (value is NaN), 'changed' or 'unchanged'.
+        Unchanged rows are only returned if changed_only is False."""
+        query = ("WITH daily AS (" + _DAILY + "), "
+                 "pairs AS (SELECT id, day, LAG(id) OVER (ORDER BY day) AS previous_id FROM daily), "
+                 "current AS (SELECT * FROM snapshot_values WHERE (:metric IS NULL OR metric = :metric)), "
+                 "deltas AS ("
+                 "SELECT p.day, v.key, v.metric, v.value, w.value AS previous, "
+                 "CASE WHEN w.key IS NULL THEN 'added' WHEN v.value IS w.value THEN 'unchanged' "
+                 "ELSE 'changed' END AS status "
+                 "FROM pairs p JOIN current v ON v.snapshot_id = p.id "
+                 "LEFT JOIN current w ON w.snapshot_id = p.previous_id AND w.key = v.key AND w.metric = v.metric "
+                 "WHERE p.previous_id IS NOT NULL "
+                 "UNION ALL "
+                 "SELECT p.day, w.key, w.metric, NULL, w.value, 'removed' "
+                 "FROM pairs p JOIN current w ON w.snapshot_id = p.previous_id "
+                 "LEFT JOIN current v ON v.snapshot_id = p.id AND v.key = w.key AND v.metric = w.metric "
+                 "WHERE v.key IS NULL) "
+                 "SELECT day, key, metric, value, previous, value - previous AS change, status FROM deltas "
+                 "WHERE (:start IS NULL OR day >= :start) AND (:end IS NULL OR day <= :end) "
+                 "ORDER BY day, key, metric")
+        with self._connect() as db:
+            deltas = pd.read_sql_query(query, db, params={
+                'report': report, 'server': server_name(server), 'metric': metric,
+                'start': _day(start), 'end': _day(end)})
+        if changed_only:
+            deltas = deltas[deltas['status'] != 'unchanged']
+        return deltas.reset_index(drop=True)
+
+    def trend(self, report, server, metric, start=None, end=None):
+        """The last value each day of a metric, as a dataframe indexed by day with a column per key
+        (NaN on days a key wasn't in the report)."""
+        query = ("WITH daily AS (" + _DAILY + ") "
+                 "SELECT d.day, v.key, v.value FROM daily d JOIN snapshot_values v ON v.snapshot_id = d.id "
+                 "WHERE v.metric = :metric AND (:start IS NULL OR d.day >= :start) "
+                 "AND (:end IS NULL OR d.day <= :end) ORDER BY d.day, v.rowid")
+        with self._connect() as db:
+            values = pd.read_sql_query(query, db, params={
+                'report': report, 'server': server_name(server), 'metric': metric,
+                'start': _day(start), 'end': _day(end)})
+        # histories recorded before record_report dropped duplicate keys may have several values per day and key
+        return values.pivot_table(index='day', columns='key', values='value', aggfunc='first', dropna=False)
+
+
+def _end(when):
+    """Like _timestamp, but a date (or YYYY-MM-DD) means the end of that day."""
+    when = _timestamp(when)
+    return when + 'T23:59:59.999999+00:00' if when and len(when) == 10 else when
+
+
+def _day(when):
+    return _timestamp(when) and _timestamp(when)[:10]
@@ -1,62 +1,107 @@
-from reporting_tools import diff_report, gen_dataset_report, gen_dataset_report_prod, gen_label_count_report, save_report, template_painted_domain_report
-
-
-try:
-  kb_report = gen_dataset_report(["http://kb.virtualflybrain.org", "neo4j", "vfb"], 'kb')
-  save_report(kb_report, "../VFB_reporting_results/kb_report.tsv")
-except Exception as e:
-  print(f"An exception occurred running kb report: {e}")
-
-pdb_report = gen_dataset_report_prod(["http://pdb.virtualflybrain.org", "neo4j", "vfb"], 'pdb')
-save_report(pdb_report, "../VFB_reporting_results/pdb_report.tsv")
-
-# Generate label count report for PDB
-try:
-  pdb_label_report = gen_label_count_report(["http://pdb.virtualflybrain.org", "neo4j", "vfb"], 'pdb_labels')
-  save_report(pdb_label_report, "../VFB_reporting_results/pdb_label_count_report.tsv")
-except Exception as e:
-  print(f"An exception occurred running PDB label count report: {e}")
-
-
-try:
-  pipeline_output_report = gen_dataset_report_prod(["http://pdb.ug.virtualflybrain.org", "neo4j", "vfb"], 'pipeline_output')
-  save_report(pipeline_output_report, "../VFB_reporting_results/pipeline_output_report.tsv")
-  pipeline_output_diff = diff_report(pdb_report, pipeline_output_report)
-  save_report(pipeline_output_diff, '../VFB_reporting_results/pdb_pipeline_output_diff.tsv')
-  
-  # Generate label count report for pipeline output
-  pipeline_output_label_report = gen_label_count_report(["http://pdb.ug.virtualflybrain.org", "neo4j", "vfb"], 'pipeline_output_labels')
-  save_report(pipeline_output_label_report, "../VFB_reporting_results/pipeline_output_label_count_report.tsv")
-except Exception as e:
-  print(f"An exception occurred running pipeline output report: {e}")
-
-try:
-  staging_report = gen_dataset_report_prod(["http://pdb-alpha.virtualflybrain.org", "neo4j", "vfb"], 'staging')
-  save_report(staging_report, "../VFB_reporting_results/staging_report.tsv")
-  staging_diff = diff_report(pdb_report, staging_report)
-  save_report(staging_diff, '../VFB_reporting_results/pdb_staging_diff.tsv')
-  
-  # Generate label count report for staging
-  staging_label_report = gen_label_count_report(["http://pdb-alpha.virtualflybrain.org", "neo4j", "vfb"], 'staging_labels')
-  save_report(staging_label_report, "../VFB_reporting_results/staging_label_count_report.tsv")
-except Exception as e:
-  print(f"An exception occurred running staging report: {e}")
-
-try:
-  dev_report = gen_dataset_report_prod(["http://pdb-dev.virtualflybrain.org", "neo4j", "vfb"], 'dev')
-  save_report(dev_report, "../VFB_reporting_results/dev_report.tsv")
-  dev_diff = diff_report(pdb_report, dev_report)
-  save_report(dev_diff, '../VFB_reporting_results/pdb_dev_diff.tsv')
-  
-  # Generate label count report for dev
-  dev_label_report = gen_label_count_report(["http://pdb-dev.virtualflybrain.org", "neo4j", "vfb"], 'dev_labels')
-  save_report(dev_label_report, "../VFB_reporting_results/dev_label_count_report.tsv")
-except Exception as e:
-  print(f"An exception occurred running dev report: {e}")
-  
-try:
-  template_painted_domain_report = template_painted_domain_report(["http://pdb.virtualflybrain.org", "neo4j", "vfb"], 'pdb_template_painted_domains')
-  save_report(template_painted_domain_report, "../VFB_reporting_results/template_painted_domain_report.tsv")
-except Exception as e:
-  print(f"An exception occurred running template_painted_domain_report: {e}")
+import os
+import sys
+import reporting_tools
+from reporting_tools import diff_report, diff_report_by_key, gen_dataset_report, gen_dataset_report_prod, gen_label_count_report, label_count_matrix, save_report, template_painted_domain_report
+from report_dag import ReportDAG
+from report_history import ReportHistory
 
+servers = {'kb': ["http://kb.virtualflybrain.org", "neo4j", "vfb"],
+           'pdb': ["http://pdb.virtualflybrain.org", "neo4j", "vfb"],
+           'pdb.ug': ["http://pdb.ug.virtualflybrain.org", "neo4j", "vfb"],
+           'pdb-alpha': ["http://pdb-alpha.virtualflybrain.org", "neo4j", "vfb"],
+           'pdb-dev': ["http://pdb-dev.virtualflybrain.org", "neo4j", "vfb"]}
+results_dir = "../VFB_reporting_results/"
+
+# every dataset and label count report is also appended to the report history (see report_history.py)
+history = ReportHistory.from_env()
+
+# maximum number of reports querying any one server at the same time
+max_per_server = int(os.environ.get('VFB_MAX_REPORTS_PER_SERVER', '2'))
+
+
+def add_report(dag, name, report_function, server, report_name, filename, key_columns=None):
+  """Adds a task generating a report from one server and saving it.
+  If key_columns are given, the report is also recorded in the report history
+  (its numeric columns, for each row keyed by key_columns)."""
+  def run():
+    report = report_function(servers[server], report_name)
+    save_report(report, results_dir + filename)
+    if history and key_columns:
+      try:
+        history.record_report(report_name, servers[server], report, key_columns)
+      except Exception as e:
+        print("Failed to record %s in the report history: %s" % (name, e))
+    return report
+  return dag.add(name, run, outputs=[results_dir + filename], server=servers[server])
+
+
+def add_diff(dag, name, report1, report2, filename, key_columns=('ds.short_form', 'pub')):
+  """Adds a task diffing two reports once both are available and saving the diff,
+  plus a *_changes.tsv listing added, removed and changed rows by key_columns."""
+  changes_filename = filename.replace('_diff.tsv', '_changes.tsv')
+  def run(r1, r2):
+    diff = diff_report(r1, r2)
+    save_report(diff, results_dir + filename)
+    save_report(diff_report_by_key(r1, r2, key_columns), results_dir + changes_filename)
+    return diff
+  return dag.add(name, run, inputs=[report1, report2], outputs=[results_dir + filename, results_dir + changes_filename])
+
+
+def add_label_count_matrix(dag, name, reports, filename):
+  """Adds a task combining label count reports (a dict of server name: task name)
+  into one table with a count column per server, once they are all available."""
+  def run(*label_counts):
+    matrix = label_count_matrix(dict(zip(reports, label_counts)))
+    save_report(matrix, results_dir + filename)
+    return matrix
+  return dag.add(name, run, inputs=list(reports.values()), outputs=[results_dir + filename])
+
+
+def add_reports(dag):
+  """Adds the dataset, label count and painted domain reports for each server,
+  and diffs against pdb, to a report_dag.ReportDAG.  Returns the names of the tasks
+  whose failure doesn't fail the run (all but the pdb report, which everything is compared against)."""
+  existing = set(dag.tasks)
+  add_report(dag, 'kb report', gen_dataset_report, 'kb', 'kb', "kb_report.tsv",
+             key_columns=('ds.short_form', 'pub'))
+  add_report(dag, 'pdb report', gen_dataset_report_prod, 'pdb', 'pdb', "pdb_report.tsv",
+             key_columns=('ds.short_form', 'pub'))
+  add_report(dag, 'PDB label count report', gen_label_count_report, 'pdb', 'pdb_labels', "pdb_label_count_report.tsv",
+             key_columns=('type', 'label'))
+  add_report(dag, 'pipeline output report', gen_dataset_report_prod, 'pdb.ug', 'pipeline_output', "pipeline_output_report.tsv",
+             key_columns=('ds.short_form', 'pub'))
+  add_diff(dag, 'pipeline output diff', 'pdb report', 'pipeline output report', 'pdb_pipeline_output_diff.tsv')
+  add_report(dag, 'pipeline output label count report', gen_label_count_report, 'pdb.ug', 'pipeline_output_labels', "pipeline_output_label_count_report.tsv",
+             key_columns=('type', 'label'))
+  add_report(dag, 'staging report', gen_dataset_report_prod, 'pdb-alpha', 'staging', "staging_report.tsv",
+             key_columns=('ds.short_form', 'pub'))
+  add_diff(dag, 'staging diff', 'pdb report', 'staging report', 'pdb_staging_diff.tsv')
+  add_report(dag, 'staging label count report', gen_label_count_report, 'pdb-alpha', 'staging_labels', "staging_label_count_report.tsv",
+             key_columns=('type', 'label'))
+  add_report(dag, 'dev report', gen_dataset_report_prod, 'pdb-dev', 'dev', "dev_report.tsv",
+             key_columns=('ds.short_form', 'pub'))
+  add_diff(dag, 'dev diff', 'pdb report', 'dev report', 'pdb_dev_diff.tsv')
+  add_report(dag, 'dev label count report', gen_label_count_report, 'pdb-dev', 'dev_labels', "dev_label_count_report.tsv",
+             key_columns=('type', 'label'))
+  add_label_count_matrix(dag, 'label count matrix', {'pdb': 'PDB label count report',
+                                                     'pdb.ug': 'pipeline output label count report',
+                                                     'pdb-alpha': 'staging label count report',
+                                                     'pdb-dev': 'dev label count report'},
+                         'label_count_matrix.tsv')
+  add_report(dag, 'template_painted_domain_report', template_painted_domain_report, 'pdb', 'pdb_template_painted_domains', "template_painted_domain_report.tsv")
+  return [name for name in dag.tasks if name not in existing and name != 'pdb report']
+
+
+if __name__ == '__main__':
+  # run everything (see daily_reports.py for skipping reports whose inputs are unchanged)
+  dag = ReportDAG(state_file=None)
+  add_reports(dag)
+  failures = dag.run(max_per_server=max_per_server)
+
+  reporting_tools.print_connection_stats()
+  if reporting_tools.query_cache:
+    reporting_tools.query_cache.print_stats()
+
+  # the pdb report is required (everything is compared against it)
+  if 'pdb report' in failures:
+    sys.exit(1)
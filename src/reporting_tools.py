@@ -1,10 +1,166 @@
 #!/usr/bin/env python
 from uk.ac.ebi.vfb.neo4j.neo4j_tools import neo4j_connect, results_2_dict_list
+from query_cache import QueryCache
+from query_plans import plan_store
+from query_profiler import PROFILER
+import cassette
+import deadlines
+from deadlines import DeadlineAdapter, ReportTimeout
+from contextlib import contextmanager
+from itertools import islice
+import codecs
+import datetime
+import gc
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import requests
 import pandas as pd
 import numpy as np
 
+# orjson is much faster than the standard library for large responses, but is optional
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
 
-def gen_report(server, query, report_name, column_order=None):
+# pyarrow (Parquet/Arrow report formats) and zstandard (compressed TSV) are optional
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    ARROW_AVAILABLE = True
+except ImportError:
+    ARROW_AVAILABLE = False
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+# fcntl (not on Windows) locks report manifests against other processes, e.g. scripts run by daily_reports
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# on-disk cache of query results, off unless VFB_QUERY_CACHE is set (see query_cache.py),
+# and while recording a cassette, so that every query is recorded (see cassette.py)
+query_cache = None if cassette.recording() else QueryCache.from_env()
+
+
+class PooledConnection(neo4j_connect):
+    """neo4j_connect that sends all requests over a shared keep-alive
+    requests.Session, so TCP connections and TLS sessions are reused."""
+
+    def __init__(self, endpoint, usr, pwd, session):
+        self.session = session
+        self.request_count = 0
+        self.use_count = 0
+        super().__init__(endpoint, usr, pwd)
+
+    def commit_list(self, statements, return_graphs=False, parameters=None):
+        """As neo4j_connect.commit_list: returns a list of results, or False
+        (after printing the problem) if there are any errors.  A deadlines.ReportTimeout
+        is raised, not returned as False, so the report fails as timed out.
+        parameters: optional list of parameter dicts, one per statement."""
+        parameters = parameters or [None] * len(statements)
+        cstatements = [_statement(s, p) for s, p in zip(statements, parameters)]
+        if return_graphs:
+            for s in cstatements:
+                s['resultDataContents'] = ['row', 'graph']
+        try:
+            return decode_results(_post_statements(self, cstatements))
+        except ReportTimeout:
+            raise
+        except Exception as e:
+            print(e)
+            return False
+
+
+# Cypher clauses that write to the database; requests without them are safe to retry
+_WRITE_CLAUSES = re.compile(r'\b(CREATE|MERGE|SET|DELETE|REMOVE|DROP|LOAD\s+CSV)\b|apoc\.(create|merge|refactor|periodic)',
+                            re.IGNORECASE)
+
+
+def _read_only_request(request):
+    """True if a request to the transactional endpoint only reads (so may be retried or hedged)."""
+    body = request.body.decode('utf-8') if isinstance(request.body, bytes) else request.body or ''
+    try:
+        statements = json.loads(body)['statements']
+    except (ValueError, KeyError, TypeError):
+        return False
+    return not any(_WRITE_CLAUSES.search(s['statement']) for s in statements)
+
+
+_connections = {}
+_connection_locks = {}
+_registry_lock = threading.Lock()
+
+
+def get_connection(server):
+    """Returns the process-wide shared connection for a server, creating it on first use.
+    Args:
+        server: server connection as [endpoint, usr, pwd]"""
+    key = tuple(server)
+    with _registry_lock:
+        lock = _connection_locks.setdefault(key, threading.Lock())
+    with lock:  # one connection per server, without blocking other servers while it's made
+        nc = _connections.get(key)
+        if nc is None:
+            session = requests.Session()
+            adapter = DeadlineAdapter(pool_connections=1, pool_maxsize=32, retry_post=_read_only_request)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            nc = PooledConnection(*server, session=session)
+            _connections[key] = nc
+        nc.use_count += 1
+    return nc
+
+
+def connection_stats():
+    """Returns a dataframe of usage counts for each shared connection:
+    times the connection was requested, HTTP requests sent and
+    TCP connections actually opened (the rest reused a kept-alive one)."""
+    rows = []
+    with _registry_lock:
+        connections = list(_connections.values())
+    for nc in connections:
+        pools = [a.poolmanager.pools[k] for a in set(nc.session.adapters.values())
+                 for k in a.poolmanager.pools.keys()]
+        rows.append({'server': nc.base_uri, 'uses': nc.use_count, 'requests': nc.request_count,
+                     'tcp_connections': sum(p.num_connections for p in pools)})
+    return pd.DataFrame(rows, columns=['server', 'uses', 'requests', 'tcp_connections'])
+
+
+def print_connection_stats():
+    for r in connection_stats().itertuples(index=False):
+        print("Connection to %s: used %d times, %d requests over %d TCP connections"
+              % (r.server, r.uses, r.requests, r.tcp_connections))
+
+
+def enable_query_cache(directory=None, **kwargs):
+    """Turns on the on-disk query result cache used by gen_report.
+    kwargs are passed to QueryCache (max_bytes, max_age...)."""
+    global query_cache
+    query_cache = QueryCache(directory, **kwargs) if directory else QueryCache(**kwargs)
+    return query_cache
+
+
+def db_fingerprint(nc):
+    """Cheap fingerprint of the state of a database: total node and relationship
+    counts, both answered from the count store."""
+    results = decode_results(_post_statements(nc, [{'statement': 'MATCH (n) RETURN count(n)'},
+                                                   {'statement': 'MATCH ()-[r]->() RETURN count(r)'}]))
+    return '%s:%s' % (results[0]['data'][0]['row'][0], results[1]['data'][0]['row'][0])
+
+
+def gen_report(server, query, report_name, column_order=None, parameters=None, cache=None, compact=False):
     """Generates a pandas dataframe with
     the results of a cypher query against the
     specified server.
@@ -12,14 +168,37 @@ def gen_report(server, query, report_name, column_order=None):
         server: server connection as [endpoint, usr, pwd]
         query: cypher query
         report_name: df.name
-        column_order: optionally specify column order in df."""
-    nc = neo4j_connect(*server)
+        column_order: optionally specify column order in df.
+        parameters: optional dict of query parameters, referred to as $name in the query.
+            Use these rather than pasting values (especially long lists) into the query text.
+        cache: QueryCache to use; defaults to the module query_cache (if enabled).
+            Pass False to always query the server.
+        compact: if True, return a compact dataframe (see compact_frame), with missing
+            values left missing rather than replaced with ''."""
+    nc = get_connection(server)
     print(query)
-    r = nc.commit_list([query])
-    #print(r)
-    dc = results_2_dict_list(r)
-    report = pd.DataFrame.from_records(dc)
-    report.replace(np.nan, '', regex=True, inplace=True)
+    cache = query_cache if cache is None else cache
+    report = None
+    if cache:
+        key = cache.key(nc.base_uri, query, parameters,
+                        fingerprint=cache.fingerprint(nc.base_uri, lambda: db_fingerprint(nc)),
+                        variant='compact' if compact else None)
+        report = cache.get(key)
+    if report is None:
+        if plan_store and plan_store.mode == 'explain':
+            _explain(nc, [query], [parameters])
+        profile = plan_store and plan_store.mode == 'profile'
+        response = _post_statements(nc, [_statement(plan_store.statement(query) if profile else query, parameters)])
+        results = decode_results(response)
+        if profile:
+            plan_store.record(nc.base_uri, query, results[0].get('profile') or results[0].get('plan'))
+        report = results_2_frame(results)
+        if compact:
+            report = compact_frame(report)
+        else:
+            report.replace(np.nan, '', regex=True, inplace=True)
+        if cache:
+            cache.put(key, report)
     report.name = report_name
     if column_order:
         out = report[column_order]
@@ -29,6 +208,488 @@ def gen_report(server, query, report_name, column_order=None):
         return report
 
 
+def census_query(match, categories, counted):
+    """Cypher counting, in a single pass over the rows produced by match, the distinct values of
+    each counted variable among the rows meeting each category's condition (conditional aggregation),
+    so several counts over the same nodes share one scan.
+    Args:
+        match: clauses producing the rows, binding the counted variables and whatever the conditions use
+        categories: dict of category name: boolean Cypher expression
+        counted: dict of column suffix: variable, e.g. {'': 'c', '_pubs': 'p'}
+    The query returns one row, with a column (category name + suffix) per category and counted variable."""
+    return "%s RETURN %s" % (match, ', '.join(
+        "COUNT(DISTINCT CASE WHEN %s THEN %s END) AS `%s`" % (condition, variable, name + suffix)
+        for name, condition in categories.items() for suffix, variable in counted.items()))
+
+
+def gen_reports_batch(server, queries, parameters=None, cache=None):
+    """Runs several independent queries against the specified server in a single
+    transactional request, giving one pandas dataframe per query.
+    Args:
+        server: server connection as [endpoint, usr, pwd]
+        queries: dict of report_name: cypher query
+        parameters: optional dict of report_name: query parameters
+        cache: QueryCache to use, as for gen_report.
+    Returns a dict of report_name: dataframe (with df.name set).  A query that fails
+    gives None (the error is printed) and does not affect the others.
+    Connection errors are raised as for gen_report."""
+    nc = get_connection(server)
+    parameters = parameters or {}
+    cache = query_cache if cache is None else cache
+    reports = {}
+    keys = {}
+    if cache:
+        fingerprint = cache.fingerprint(nc.base_uri, lambda: db_fingerprint(nc))
+        for name, query in queries.items():
+            keys[name] = cache.key(nc.base_uri, query, parameters.get(name), fingerprint=fingerprint)
+            report = cache.get(keys[name])
+            if report is not None:
+                reports[name] = report
+    pending = [name for name in queries if name not in reports]
+    if pending and plan_store and plan_store.mode == 'explain':
+        _explain(nc, [queries[n] for n in pending], [parameters.get(n) for n in pending])
+    profile = plan_store and plan_store.mode == 'profile'
+    alone = False
+    while pending:
+        batch = pending[:1] if alone else pending
+        print("Running %d queries in one request: %s" % (len(batch), ', '.join(batch)))
+        response = _post_statements(nc, [_statement(plan_store.statement(queries[n]) if profile else queries[n],
+                                                    parameters.get(n)) for n in batch])
+        payload = _decode_payload(response)
+        results = payload['results']
+        errors = payload.get('errors')
+        # The server stops at the first failed statement.  A statement that fails while running
+        # has a (partial) entry in results, one that fails before running (to compile, or to find
+        # a procedure) does not, and the error doesn't say which statement it is from.  So the
+        # statements before the last result succeeded, and if the batch was sent alone or has
+        # no results the first statement failed; otherwise the statement of the last result is
+        # run again on its own to tell whether it failed or the one after it did.
+        failed = errors and (len(batch) == 1 or not results)
+        if not errors:
+            done = len(batch)
+        elif failed:
+            done = 0
+        else:
+            done = len(results) - 1
+        for name, result in zip(batch[:done], results):
+            if profile:
+                plan_store.record(nc.base_uri, queries[name], result.get('profile') or result.get('plan'))
+            report = results_2_frame([result])
+            report.replace(np.nan, '', regex=True, inplace=True)
+            if cache:
+                cache.put(keys[name], report)
+            reports[name] = report
+        alone = bool(errors) and not failed
+        if failed:
+            for e in errors:
+                print("Query Error in %s: %s" % (batch[0], e))
+            reports[batch[0]] = None
+            done = 1
+        pending = pending[done:]
+    for name, report in reports.items():
+        if report is not None:
+            report.name = name
+    return {name: reports[name] for name in queries}
+
+
+def _explain(nc, queries, parameters):
+    """Records the plans of queries (see query_plans) using EXPLAIN, which doesn't run them."""
+    try:
+        payload = _decode_payload(_post_statements(nc, [_statement('EXPLAIN ' + q, p)
+                                                        for q, p in zip(queries, parameters)]))
+    except Exception as e:
+        print("Failed to get query plans: %s" % e)
+        return
+    # the server stops at the first query that fails to plan
+    for e in payload.get('errors', []):
+        print("Failed to get query plan: %s" % e.get('message', e))
+    for query, result in zip(queries, payload['results']):
+        plan_store.record(nc.base_uri, query, result.get('plan'))
+
+
+def _statement(query, parameters=None):
+    """A statement for the transactional endpoint, with bound parameters if given."""
+    if parameters:
+        return {'statement': query, 'parameters': parameters}
+    return {'statement': query}
+
+
+def _post_statements(nc, statements, stream=False, timeout=None):
+    """POSTs a list of statements (as dicts) to the transactional
+    commit endpoint of a neo4j_connect object and returns the response.
+    Uses the connection's keep-alive session if it has one (see get_connection).
+    timeout is passed to requests (seconds, None to wait indefinitely).
+    The request is recorded by query_profiler.PROFILER, finishing when the response is decoded."""
+    if hasattr(nc, 'session'):
+        nc.request_count += 1
+    record = PROFILER.start('neo4j', nc.base_uri, '\n'.join(s['statement'] for s in statements))
+    try:
+        response = getattr(nc, 'session', requests).post(url="%s%s" % (nc.base_uri, nc.commit),
+                                                         auth=(nc.usr, nc.pwd),
+                                                         data=json.dumps({'statements': statements}),
+                                                         headers=nc.headers, stream=stream, timeout=timeout)
+    except Exception as e:
+        PROFILER.finish(record, error=str(e))
+        raise
+    record['time_to_headers'] = response.elapsed.total_seconds()
+    response.profile = record
+    return response
+
+
+@contextmanager
+def _gc_paused():
+    """Pauses the cyclic garbage collector.  Decoding allocates millions of small
+    containers (none of them cyclic), which otherwise triggers repeated full collections."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def decode_results(response):
+    """Decodes the body of a transactional endpoint response (a requests.Response or bytes)
+    into a list of results, one per statement, using the fastest JSON parser available.
+    Raises an Exception if the server reports an error."""
+    payload = _decode_payload(response)
+    if payload.get('errors'):
+        for e in payload['errors']:
+            print("Query Error: " + str(e))
+        raise Exception("Query failed: %s" % payload['errors'][0].get('message', payload['errors'][0]))
+    return payload['results']
+
+
+def _decode_payload(response):
+    """Decodes a transactional endpoint response (a requests.Response or bytes)
+    into a dict of results and errors.  Raises an Exception on an HTTP error."""
+    record = None
+    if isinstance(response, requests.Response):
+        record = getattr(response, 'profile', None)
+        if response.status_code != 200:
+            if record:
+                PROFILER.finish(record, error="%s %s" % (response.status_code, response.reason))
+            raise Exception("Connection Error: %s (%s)" % (response.status_code, response.reason))
+        response = response.content
+    start = time.time()
+    with _gc_paused():
+        payload = _json_loads(response)
+    if record:
+        errors = payload.get('errors')
+        PROFILER.finish(record, decode=time.time() - start, bytes=len(response),
+                        rows=sum(len(r.get('data', ())) for r in payload.get('results', ())),
+                        error=errors[0].get('message', str(errors[0])) if errors else None)
+    return payload
+
+
+def results_2_columns(result):
+    """Decodes the result of a single statement ({'columns': [...], 'data': [...]})
+    into a dict of column name: numpy array, without building a dict per row.
+    Column dtypes are inferred (int64, float64, bool or object)."""
+    columns = result['columns']
+    with _gc_paused():
+        rows = [d['row'] for d in result['data']]
+        values = zip(*rows) if rows else [()] * len(columns)
+        return {c: pd.Series(v, dtype=None if v else object).to_numpy() for c, v in zip(columns, values)}
+
+
+def results_2_frame(results, statement=0):
+    """Columnar alternative to results_2_dict_list: converts commit_list style results
+    (or those from decode_results) into a pandas dataframe for one statement.
+    An empty result still gives a dataframe with the query's columns."""
+    if not results:
+        raise Exception("No results to convert - query failed?")
+    result = results[statement]
+    return pd.DataFrame(results_2_columns(result), columns=result['columns'])
+
+
+def compact_frame(report, int_columns=(), max_unique_ratio=0.5):
+    """Returns a copy of a report dataframe that takes less memory:
+    - string columns in which values repeat (at most max_unique_ratio distinct values per row,
+      e.g. labels, dataset short_forms, paper names) become categoricals
+    - integer columns with missing values become nullable Int64 rather than float or object,
+      as do int_columns (e.g. SKIDs returned as strings), with '' taken as missing
+    Missing values are left missing (rather than replaced with '' as by gen_report); they are
+    written to TSV as empty all the same.  Columns of lists are left as they are.
+    Joins and sorts work as before; use concat_frames to join compact frames end to end
+    and plain_frame to get back gen_report's representation."""
+    columns = {}
+    for column in report.columns:
+        values = report[column]
+        if column in int_columns:
+            values = pd.to_numeric(values.mask(values.astype(str) == '')).astype('Int64')
+        elif len(values) and not isinstance(values.dtype, pd.CategoricalDtype):
+            kind = pd.api.types.infer_dtype(values, skipna=True)
+            if kind == 'string':
+                if values.nunique() <= max_unique_ratio * len(values):
+                    values = values.astype('category')
+            elif kind in ('floating', 'integer', 'mixed-integer-float') and values.isna().any():
+                numbers = pd.to_numeric(values)
+                if (numbers.dropna() % 1 == 0).all():
+                    values = numbers.astype('Int64')
+        columns[column] = values
+    compact = pd.DataFrame(columns, index=report.index)
+    compact.name = getattr(report, 'name', None)
+    return compact
+
+
+def concat_frames(frames):
+    """pd.concat (with a new index) for compact dataframes: categorical columns stay
+    categorical, with the categories of all the frames, rather than becoming strings."""
+    frames = list(frames)
+    categorical = {c for f in frames for c in f.columns if isinstance(f[c].dtype, pd.CategoricalDtype)}
+    for column in categorical:
+        categories = pd.api.types.union_categoricals(
+            [pd.Categorical(f[column]) for f in frames if column in f.columns], ignore_order=True).categories
+        dtype = pd.CategoricalDtype(categories)
+        frames = [f.assign(**{column: f[column].astype(dtype)}) if column in f.columns else f for f in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+def plain_frame(report):
+    """The inverse of compact_frame: categoricals become plain strings and missing values
+    become '', as gen_report returns them."""
+    columns = {}
+    for column in report.columns:
+        values = report[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(values.cat.categories.dtype)
+        if values.isna().any():
+            values = values.astype(object).where(values.notna(), '')
+        columns[column] = values
+    plain = pd.DataFrame(columns, index=report.index)
+    plain.name = getattr(report, 'name', None)
+    return plain
+
+
+def _stream_rows(response, read_size=1 << 20):
+    """Incrementally parses the response to a single statement commit.
+    Yields the list of columns first, then each row (as a list) in turn,
+    so the full JSON response is never held in memory.
+    Raises an Exception if the server reports an error."""
+    if response.status_code != 200:
+        raise Exception("Connection Error: %s (%s)" % (response.status_code, response.reason))
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = response.iter_content(chunk_size=read_size)
+    buffer = ''
+    pos = 0
+    eof = False
+
+    def read_more():
+        nonlocal buffer, pos, eof
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            buffer = buffer[pos:] + utf8.decode(b'', final=True)
+        else:
+            buffer = buffer[pos:] + utf8.decode(chunk)
+        pos = 0
+        return not eof
+
+    def seek(token):
+        nonlocal pos
+        while True:
+            i = buffer.find(token, pos)
+            if i >= 0:
+                pos = i + len(token)
+                return True
+            pos = max(pos, len(buffer) - len(token))
+            if not read_more():
+                return False
+
+    def next_char():
+        # skips separators and returns the next significant character
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,:':
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if not read_more():
+                raise Exception("Incomplete response from server")
+
+    def decode_value():
+        nonlocal pos
+        next_char()
+        while True:
+            try:
+                value, pos = decoder.raw_decode(buffer, pos)
+                return value
+            except json.JSONDecodeError:
+                if not read_more():
+                    raise
+
+    def check_errors():
+        # Errors come after results (or in place of them if nothing ran)
+        if seek('"errors"'):
+            errors = decode_value()
+            if errors:
+                for e in errors:
+                    print("Query Error: " + str(e))
+                raise Exception("Query failed: %s" % errors[0].get('message', errors[0]))
+
+    if not seek('"results"'):
+        raise Exception("Unexpected response from server")
+    next_char()
+    pos += 1  # opening '[' of results
+    if next_char() == ']':
+        check_errors()
+        raise Exception("Query failed: no results returned")
+    seek('"columns"')
+    yield decode_value()
+    seek('"data"')
+    next_char()
+    pos += 1  # opening '[' of data
+    while next_char() != ']':
+        yield decode_value()['row']
+    pos += 1
+    check_errors()
+
+
+def gen_report_chunks(server, query, report_name, column_order=None, chunk_size=50000, parameters=None,
+                      cache=None):
+    """Streaming version of gen_report.  Yields the results of a cypher
+    query as a series of pandas dataframes of up to chunk_size rows, so
+    memory use does not grow with the size of the result.
+    Chunks can be passed straight to save_report.
+    Args:
+        server: server connection as [endpoint, usr, pwd]
+        query: cypher query
+        report_name: df.name of each chunk
+        column_order: optionally specify column order in each chunk.
+        chunk_size: maximum number of rows per chunk.
+        parameters: optional dict of query parameters, as for gen_report.
+        cache: QueryCache to use, as for gen_report.  Chunks are cached as they stream."""
+    nc = get_connection(server)
+    print(query)
+    cache = query_cache if cache is None else cache
+    if cache:
+        key = cache.key(nc.base_uri, query, parameters, variant=('chunks', chunk_size),
+                        fingerprint=cache.fingerprint(nc.base_uri, lambda: db_fingerprint(nc)))
+        cached = cache.get_stream(key)
+        if cached is None:
+            cached = cache.put_stream(key, _stream_chunks(nc, query, parameters, chunk_size))
+    else:
+        cached = _stream_chunks(nc, query, parameters, chunk_size)
+    for chunk in cached:
+        if column_order:
+            chunk = chunk[column_order]
+        chunk.name = report_name
+        yield chunk
+
+
+def _stream_chunks(nc, query, parameters, chunk_size):
+    """Runs a query, yielding its results as dataframes of up to chunk_size rows."""
+    if plan_store:  # a streamed PROFILE plan would only arrive after the rows, so always use EXPLAIN
+        _explain(nc, [query], [parameters])
+    response = _post_statements(nc, [_statement(query, parameters)], stream=True)
+    record = response.profile
+    decode = 0
+    row_count = 0
+    error = None
+    try:
+        start = time.time()
+        rows = _stream_rows(response)
+        columns = next(rows)
+        empty = True
+        while True:
+            batch = list(islice(rows, chunk_size))
+            if not batch and not empty:
+                break
+            empty = False
+            chunk = pd.DataFrame.from_records(batch, columns=columns)
+            chunk.replace(np.nan, '', regex=True, inplace=True)
+            row_count += len(batch)
+            decode += time.time() - start
+            yield chunk
+            deadlines.check("reading the results of %s" % query[:100])
+            start = time.time()
+            if len(batch) < chunk_size:
+                break
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        response.close()
+        # time spent waiting for the caller to use each chunk doesn't count
+        PROFILER.finish(record, wall=record['time_to_headers'] + decode, decode=decode, rows=row_count, error=error,
+                        bytes=response.raw.tell() if hasattr(response.raw, 'tell') else None)
+
+
+def page_boundaries(server, key_match, key, page_size=50000, parameters=None):
+    """Splits the distinct values of key (e.g. 'i.short_form') over the rows matched by key_match
+    (e.g. 'MATCH (i:Individual)') into pages of page_size values (the last may be smaller).
+    Each page's start is found by its own query, reading the next page_size + 1 keys in key order
+    from the previous start, so the server never holds more than that many keys at once (and
+    with key indexed, each is a range seek).
+    Returns the number of values and a list of (page_from, page_to) ranges, page_to being
+    None for the last page.  Rows where key is null are not in any page."""
+    nc = get_connection(server)
+    query = ("%s WITH DISTINCT %s AS key WHERE key IS NOT NULL AND ($page_from IS NULL OR key >= $page_from) "
+             "WITH key ORDER BY key LIMIT $page_limit "
+             "WITH collect(key) AS keys "
+             "RETURN size(keys) AS keys, keys[0] AS first, keys[-1] AS last" % (key_match, key))
+    starts = []
+    page_from = None
+    total = 0
+    while True:
+        result = decode_results(_post_statements(nc, [_statement(query, dict(
+            parameters or {}, page_from=page_from, page_limit=page_size + 1))]))
+        count, first, last = result[0]['data'][0]['row']
+        if not count:
+            break
+        starts.append(first)
+        if count <= page_size:
+            total += count
+            break
+        total += page_size
+        page_from = last
+    if not starts:
+        return 0, [(None, None)]  # one (empty) page, so the result still has its columns
+    return total, list(zip(starts, starts[1:] + [None]))
+
+
+def gen_report_paginated(server, query, report_name, key, key_match, column_order=None, page_size=50000,
+                         max_workers=4, parameters=None, cache=None, compact=False):
+    """Keyset-paginated version of gen_report for very large results.  Splits the query into
+    pages by ranges of a key (see page_boundaries), fetches up to max_workers pages at a time and yields them as dataframes, in key order.
+    Chunks can be passed straight to save_report, or joined with pd.concat (concat_frames if compact).
+    Args:
+        server: server connection as [endpoint, usr, pwd]
+        query: cypher query, which must restrict key to a page with the parameters $page_from and $page_to:
+            "... WHERE i.short_form >= $page_from AND ($page_to IS NULL OR i.short_form < $page_to) ..."
+            Each row must belong to a single key value (aggregate by key, if at all).
+        report_name: df.name of each chunk
+        key: the key expression, e.g. 'i.short_form' (ideally indexed, so pages are range seeks)
+        key_match: MATCH clause(s) binding key for every row of the result, e.g. 'MATCH (i:Individual)'
+        column_order: optionally specify column order in each chunk.
+        page_size: number of key values per page.
+        max_workers: pages fetched at once (also the most pages held in memory).
+        parameters: optional dict of query parameters, used for both query and key_match.
+        cache: QueryCache to use, as for gen_report (each page is cached separately).
+        compact: return compact dataframes, as for gen_report."""
+    total, pages = page_boundaries(server, key_match, key, page_size=page_size, parameters=parameters)
+    print("Fetching %s in %d pages of up to %d %s values (%d in all)" % (report_name, len(pages), page_size, key, total))
+
+    def fetch(page_from, page_to):
+        page_parameters = dict(parameters or {}, page_from=page_from, page_to=page_to)
+        return gen_report(server, query, report_name, column_order=column_order, parameters=page_parameters,
+                          cache=cache, compact=compact)
+
+    fetch = deadlines.bind(fetch)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pages = iter(pages)
+        pending = [pool.submit(fetch, *page) for page in islice(pages, max_workers)]
+        while pending:
+            chunk = pending.pop(0).result()
+            for page in islice(pages, 1):
+                pending.append(pool.submit(fetch, *page))
+            chunk.name = report_name
+            yield chunk
+
+
 def gen_dataset_report(server,
                        report_name,
                        production_only=False):
@@ -98,6 +759,86 @@ def diff_report(report1: pd.DataFrame, report2: pd.DataFrame):
     return merged
 
 
+def _row_hashes(report, columns):
+    """One 64 bit hash per row of the given columns."""
+    try:
+        return pd.util.hash_pandas_object(report[columns], index=False).to_numpy()
+    except TypeError:  # unhashable cells, e.g. lists
+        return pd.util.hash_pandas_object(report[columns].astype(str), index=False).to_numpy()
+
+
+def _cells_differ(old, new):
+    """Boolean dataframe marking cells of two aligned dataframes that differ (missing values compare equal)."""
+    out = {}
+    for c in old.columns:
+        a, b = old[c], new[c]
+        if a.dtype == object or b.dtype == object:
+            a, b = a.astype(str), b.astype(str)
+        out[c] = ~((a == b) | (a.isna() & b.isna()))
+    return pd.DataFrame(out, index=old.index)
+
+
+def diff_report_by_key(report1: pd.DataFrame, report2: pd.DataFrame, key_columns):
+    """Compare two dataframes row by row, matching rows on key_columns.
+    Each dataframe must have a .name attribute.
+    Returns a dataframe of rows that were removed (only in report1), added (only in report2)
+    or changed, with the key columns, a 'change' column, the names of the 'changed_columns',
+    and each other column's values in report1 and report2 (suffixed with the report names).
+    Rows with duplicate keys are matched in order.  Values that only differ in type
+    (e.g. 1, 1.0 and '1') are not changes."""
+    key_columns = [key_columns] if isinstance(key_columns, str) else list(key_columns)
+    value_columns = [c for c in report1.columns if c not in key_columns]
+    value_columns += [c for c in report2.columns if c not in key_columns and c not in value_columns]
+    name1, name2 = getattr(report1, 'name', None), getattr(report2, 'name', None)
+    old_suffix, new_suffix = ('_' + name1, '_' + name2) if name1 and name2 and name1 != name2 else ('_old', '_new')
+    # nullable integers, so counts stay integers where a row is missing from one side
+    report1 = report1.reindex(columns=key_columns + value_columns).convert_dtypes(
+        infer_objects=False, convert_string=False, convert_boolean=False, convert_floating=False)
+    report2 = report2.reindex(columns=key_columns + value_columns).convert_dtypes(
+        infer_objects=False, convert_string=False, convert_boolean=False, convert_floating=False)
+
+    # compare keys and per-row hashes first, so full rows are only aligned for changed keys
+    keys = key_columns + ['_occurrence']
+    k1 = report1[key_columns].assign(_occurrence=report1.groupby(key_columns, dropna=False).cumcount().to_numpy(),
+                                     _hash=_row_hashes(report1, value_columns), _row=np.arange(len(report1)))
+    k2 = report2[key_columns].assign(_occurrence=report2.groupby(key_columns, dropna=False).cumcount().to_numpy(),
+                                     _hash=_row_hashes(report2, value_columns), _row=np.arange(len(report2)))
+    merged = k1.merge(k2, on=keys, how='outer', suffixes=('_1', '_2'), indicator=True)
+    removed = merged[merged['_merge'] == 'left_only']
+    added = merged[merged['_merge'] == 'right_only']
+    both = merged[merged['_merge'] == 'both']
+    changed = both[both['_hash_1'] != both['_hash_2']]
+
+    old = report1.iloc[changed['_row_1'].astype(int).to_numpy()][value_columns].reset_index(drop=True)
+    new = report2.iloc[changed['_row_2'].astype(int).to_numpy()][value_columns].reset_index(drop=True)
+    differs = _cells_differ(old, new)
+    # hashes depend on dtypes, so drop rows whose values only differ in type
+    kept = differs.any(axis=1).to_numpy()
+    changed = changed[kept]
+    old, new, differs = (df[kept].reset_index(drop=True) for df in (old, new, differs))
+    changed_out = changed[key_columns].reset_index(drop=True)
+    changed_out['change'] = 'changed'
+    changed_out['changed_columns'] = differs.dot(pd.Index(value_columns) + ', ').str[:-2] if len(differs) else ''
+    changed_out = pd.concat([changed_out, old.add_suffix(old_suffix), new.add_suffix(new_suffix)], axis=1)
+
+    removed_out = removed[key_columns].reset_index(drop=True)
+    removed_out['change'] = 'removed'
+    removed_out = pd.concat([removed_out, report1.iloc[removed['_row_1'].astype(int).to_numpy()][value_columns]
+                            .reset_index(drop=True).add_suffix(old_suffix)], axis=1)
+    added_out = added[key_columns].reset_index(drop=True)
+    added_out['change'] = 'added'
+    added_out = pd.concat([added_out, report2.iloc[added['_row_2'].astype(int).to_numpy()][value_columns]
+                          .reset_index(drop=True).add_suffix(new_suffix)], axis=1)
+
+    columns = key_columns + ['change', 'changed_columns'] + \
+        [c + s for c in value_columns for s in (old_suffix, new_suffix)]
+    out = pd.concat([removed_out, added_out, changed_out], ignore_index=True).reindex(columns=columns)
+    out['changed_columns'] = out['changed_columns'].fillna('')
+    out.sort_values(key_columns + ['change'], inplace=True, ignore_index=True)
+    out.name = '%s_%s_changes' % (name1, name2)
+    return out
+
+
 """
 ## see Stack Overflow 36891977
 left_only = merged[merged['_merge'] == 'left_only']
@@ -108,60 +849,114 @@ return namedtuple('out', out.keys())(*out.values())
 """
 
 
+def _escape_name(name):
+    """Quotes a label or relationship type for use in Cypher."""
+    return '`%s`' % name.replace('`', '``')
+
+
+def _meta_stats_census(nc):
+    """Node label and relationship type counts from apoc.meta.stats (read from the count store).
+    Returns None if APOC is not available."""
+    try:
+        results = decode_results(_post_statements(nc, [_statement(
+            "CALL apoc.meta.stats() YIELD labels, relTypesCount RETURN labels, relTypesCount")]))
+    except Exception as e:
+        print("apoc.meta.stats not available (%s), counting each label separately" % e)
+        return None
+    labels, rel_types = results[0]['data'][0]['row']
+    return ([('node', label, count) for label, count in labels.items()] +
+            [('relationship', rel_type, count) for rel_type, count in rel_types.items()])
+
+
+def _counted_census(nc, timeout=60, max_workers=8):
+    """Node label and relationship type counts from one count query each, run in parallel.
+    Single label and single relationship type counts are answered from the count store.
+    A count that takes longer than timeout seconds is left empty (None)."""
+    results = decode_results(_post_statements(nc, [_statement("CALL db.labels() YIELD label RETURN label"),
+                                                   _statement("CALL db.relationshipTypes() YIELD relationshipType "
+                                                              "RETURN relationshipType")]))
+    labels = [r['row'][0] for r in results[0]['data']]
+    rel_types = [r['row'][0] for r in results[1]['data']]
+
+    def count(query, name):
+        try:
+            return decode_results(_post_statements(nc, [_statement(query)], timeout=timeout))[0]['data'][0]['row'][0]
+        except requests.exceptions.Timeout:
+            print("Timed out counting %s after %ss" % (name, timeout))
+        except Exception as e:
+            print("Failed to count %s: %s" % (name, e))
+        return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        count = deadlines.bind(count)
+        nodes = pool.map(lambda l: count('MATCH (n:%s) RETURN count(n)' % _escape_name(l), l), labels)
+        rels = pool.map(lambda t: count('MATCH ()-[r:%s]->() RETURN count(r)' % _escape_name(t), t), rel_types)
+        return ([('node', label, c) for label, c in zip(labels, nodes)] +
+                [('relationship', rel_type, c) for rel_type, c in zip(rel_types, rels)])
+
+
+def label_census(server, timeout=60, max_workers=8):
+    """Counts of every node label and relationship type in a database, as a dataframe
+    with columns type ('node' or 'relationship'), label and count.
+    Uses apoc.meta.stats if the server has it, otherwise counts each label and relationship
+    type in a separate query (max_workers at a time), giving up on any that take more than
+    timeout seconds (their count is empty).
+    Args:
+        server: server connection as [endpoint, usr, pwd]"""
+    nc = get_connection(server)
+    start = time.time()
+    census = _meta_stats_census(nc)
+    if census is None:
+        census = _counted_census(nc, timeout=timeout, max_workers=max_workers)
+    print("Counted %d labels and relationship types on %s in %.1fs" % (len(census), server[0], time.time() - start))
+    report = pd.DataFrame(census, columns=['type', 'label', 'count'])
+    report['count'] = report['count'].astype('Int64')
+    return report.sort_values(['type', 'label'], ignore_index=True)
+
+
 def gen_label_count_report(server, report_name):
     """Generates a report listing all Neo4j node labels and relationship types with their counts.
     This helps identify major issues by showing the distribution of different entity types.
+    See label_census.
     Args:
         server: server connection as [endpoint, usr, pwd]
         report_name: name for the report
     Returns:
         pandas DataFrame with columns: type, label, count
     """
-    # Query to get node label counts
-    node_query = """
-    CALL db.labels() YIELD label
-    CALL apoc.cypher.run('MATCH (n:`' + label + '`) RETURN count(n) as count', {}) YIELD value
-    RETURN 'node' as type, label, value.count as count
-    ORDER BY label
-    """
-    
-    # Query to get relationship type counts
-    rel_query = """
-    CALL db.relationshipTypes() YIELD relationshipType
-    CALL apoc.cypher.run('MATCH ()-[r:`' + relationshipType + '`]->() RETURN count(r) as count', {}) YIELD value
-    RETURN 'relationship' as type, relationshipType as label, value.count as count
-    ORDER BY relationshipType
-    """
-    
-    # Generate both reports
-    nc = neo4j_connect(*server)
-    
-    # Get node counts
-    print("Getting node label counts...")
-    node_results = nc.commit_list([node_query])
-    node_dc = results_2_dict_list(node_results)
-    node_df = pd.DataFrame.from_records(node_dc)
-    
-    # Get relationship counts
-    print("Getting relationship type counts...")
-    rel_results = nc.commit_list([rel_query])
-    rel_dc = results_2_dict_list(rel_results)
-    rel_df = pd.DataFrame.from_records(rel_dc)
-    
-    # Combine the results
-    if not node_df.empty and not rel_df.empty:
-        combined_df = pd.concat([node_df, rel_df], ignore_index=True)
-    elif not node_df.empty:
-        combined_df = node_df
-    elif not rel_df.empty:
-        combined_df = rel_df
-    else:
-        combined_df = pd.DataFrame(columns=['type', 'label', 'count'])
-    
-    combined_df.replace(np.nan, '', regex=True, inplace=True)
-    combined_df.name = report_name
-    
-    return combined_df
+    report = label_census(server)
+    report.name = report_name
+    return report
+
+
+def label_count_matrix(reports):
+    """Combines label count reports from several servers into one dataframe, with a row
+    per type and label and a count column per server.
+    Args:
+        reports: dict of server name: label count report (see label_census)"""
+    matrix = pd.concat({name: report.set_index(['type', 'label'])['count'] for name, report in reports.items()},
+                       axis=1)
+    matrix = matrix.sort_index().reset_index()
+    matrix.name = 'label_count_matrix'
+    return matrix
+
+
+def gen_label_count_matrix(servers, timeout=60):
+    """Counts labels on several servers at once and returns a label_count_matrix of the results.
+    A server that can't be reached gets an empty column.
+    Args:
+        servers: dict of server name: [endpoint, usr, pwd]"""
+    with ThreadPoolExecutor(max_workers=max(len(servers), 1)) as pool:
+        futures = {name: pool.submit(deadlines.bind(label_census), server, timeout) for name, server in servers.items()}
+    reports = {}
+    for name, future in futures.items():
+        try:
+            reports[name] = future.result()
+        except Exception as e:
+            print("Failed to count labels on %s: %s" % (name, e))
+            reports[name] = pd.DataFrame({'type': [], 'label': [], 'count': pd.array([], dtype='Int64')})
+    return label_count_matrix(reports)
+
 
 def template_painted_domain_report(server, report_name):
     """ Get all 'computer graphic's registered to each template and their FBbt annotations
@@ -176,5 +971,287 @@ def template_painted_domain_report(server, report_name):
     report = gen_report(server, query=query, report_name=report_name)
     return report
 
-def save_report(report, filename):
-    report.to_csv(filename, sep='\t', index=False)
+# each output directory has a manifest of the reports saved in it (see save_report)
+MANIFEST_NAME = 'report_manifest.json'
+_manifest_lock = threading.Lock()
+
+
+def load_manifest(directory):
+    """Returns the manifest of reports saved in a directory: a dict of file name:
+    {'sha256', 'rows', 'columns', 'bytes', 'updated'}, where updated is when the
+    content last changed."""
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+@contextmanager
+def _manifest_locked(directory):
+    """Holds the manifest lock of a directory: a thread lock and, where fcntl is available,
+    an exclusive lock on report_manifest.json.lock, shared with other processes."""
+    with _manifest_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(directory, MANIFEST_NAME + '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _update_manifest(filename, entry):
+    directory, name = os.path.split(os.path.abspath(filename))
+    with _manifest_locked(directory):
+        manifest = load_manifest(directory)
+        manifest[name] = entry
+        part_file = os.path.join(directory, '%s.%d.part' % (MANIFEST_NAME, os.getpid()))
+        with open(part_file, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(part_file, os.path.join(directory, MANIFEST_NAME))
+
+
+def _unchanged(filename, sha256, size=None):
+    """True if filename exists and the manifest says it already has this content
+    (sha256 is the hash of the report as TSV, whatever format the file is in)."""
+    directory, name = os.path.split(os.path.abspath(filename))
+    entry = load_manifest(directory).get(name)
+    return bool(entry) and entry['sha256'] == sha256 and os.path.exists(filename) \
+        and os.path.getsize(filename) == (entry['bytes'] if size is None else size)
+
+
+# formats reports are saved in by default, e.g. VFB_REPORT_FORMATS=tsv,parquet
+REPORT_FORMATS = os.environ.get('VFB_REPORT_FORMATS', 'tsv').split(',')
+SCHEMA_PREFIX = '#schema\t'
+
+
+def report_path(filename, report_format):
+    """The file a report saved as filename (a .tsv) is written to in another format:
+    'tsv', 'tsv.zst' (zstd compressed, with the column dtypes on the first line),
+    'parquet' (zstd compressed) or 'arrow' (uncompressed Arrow IPC, for memory-mapping)."""
+    if filename.endswith('.tsv'):
+        filename = filename[:-len('.tsv')]
+    return '%s.%s' % (filename, report_format)
+
+
+def _arrow_table(chunk, schema=None):
+    if schema is None:
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        # a column with no values in the first chunk may have some later
+        schema = pa.schema([f.with_type(pa.string()) if pa.types.is_null(f.type) else f for f in table.schema])
+    return pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+
+
+class _ReportWriter:
+    """Writes the chunks of a report to a file in one format."""
+
+    def __init__(self, report_format, path):
+        if report_format in ('parquet', 'arrow') and not ARROW_AVAILABLE:
+            raise ImportError("pyarrow is needed to save reports as %s" % report_format)
+        if report_format == 'tsv.zst' and not ZSTD_AVAILABLE:
+            raise ImportError("zstandard is needed to save reports as tsv.zst")
+        if report_format not in ('tsv', 'tsv.zst', 'parquet', 'arrow'):
+            raise ValueError("Unknown report format: %s" % report_format)
+        self.format = report_format
+        self.path = path
+        self.schema = None
+        self._writer = None
+        self._file = open(path, 'wb') if report_format in ('tsv', 'tsv.zst') else None
+        self._closed = False
+
+    def write(self, chunk, tsv):
+        """Writes a dataframe chunk, given as both the dataframe and its TSV."""
+        if self.format in ('parquet', 'arrow'):
+            table = _arrow_table(chunk, self.schema)
+            if self._writer is None:
+                self.schema = table.schema
+                if self.format == 'parquet':
+                    self._writer = pq.ParquetWriter(self.path, self.schema, compression='zstd')
+                else:
+                    self._writer = pa.ipc.new_file(self.path, self.schema)
+            self._writer.write_table(table)
+            return
+        if self.format == 'tsv.zst' and self._writer is None:
+            self._writer = zstandard.ZstdCompressor(level=10, threads=-1).stream_writer(self._file)
+            schema = {str(c): str(t) for c, t in chunk.dtypes.items()}
+            self._writer.write((SCHEMA_PREFIX + json.dumps(schema) + '\n').encode('utf-8'))
+        (self._writer or self._file).write(tsv)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._writer is not None:
+            self._writer.close()  # also closes the file for tsv.zst
+        elif self._file is not None:
+            self._file.close()
+
+
+def save_report(report, filename, skip_unchanged=True, formats=None):
+    """Saves a report as a TSV and/or other formats (see report_path).  report may be a
+    dataframe or an iterable of dataframe chunks (e.g. from gen_report_chunks), which
+    are appended to the file(s) one at a time.
+    formats defaults to REPORT_FORMATS (VFB_REPORT_FORMATS, or just 'tsv').
+    A file is only rewritten if the report has changed since it was last saved
+    (unless skip_unchanged is False), and the content hash, row count and columns are
+    recorded in the manifest for the directory (see load_manifest).
+    Returns True if any file was written, False if all were unchanged."""
+    paths = {f: report_path(filename, f) for f in (formats or REPORT_FORMATS)}
+    if isinstance(report, pd.DataFrame):
+        # small enough to check before writing anything
+        data = report.to_csv(sep='\t', index=False).encode('utf-8')
+        sha256 = hashlib.sha256(data).hexdigest()
+        if skip_unchanged and all(_unchanged(p, sha256, len(data) if f == 'tsv' else None)
+                                  for f, p in paths.items()):
+            print("Unchanged, not rewritten: %s" % ', '.join(paths.values()))
+            return False
+        report = [report]
+    # write to temporary files so a failed stream doesn't leave a partial report
+    writers = [_ReportWriter(f, '%s.%d.part' % (p, threading.get_ident())) for f, p in paths.items()]
+    h = hashlib.sha256()
+    rows = 0
+    columns = []
+    written = []
+    try:
+        header = True
+        for chunk in report:
+            data = chunk.to_csv(sep='\t', index=False, header=header).encode('utf-8')
+            h.update(data)
+            for writer in writers:
+                writer.write(chunk, data)
+            rows += len(chunk)
+            if header:
+                columns = [str(c) for c in chunk.columns]
+            header = False
+        for writer in writers:
+            if writer.schema is None and writer.format in ('parquet', 'arrow'):
+                writer.write(pd.DataFrame(columns=columns), b'')  # no chunks
+            writer.close()
+        sha256 = h.hexdigest()
+        for writer in writers:
+            path = paths[writer.format]
+            if skip_unchanged and _unchanged(path, sha256):
+                print("Unchanged, not rewritten: %s" % path)
+                continue
+            os.replace(writer.path, path)
+            written.append(path)
+    finally:
+        for writer in writers:
+            if os.path.exists(writer.path):
+                writer.close()
+                os.remove(writer.path)
+    updated = datetime.datetime.now(tz=datetime.timezone.utc).isoformat()
+    for path in written:
+        _update_manifest(path, {'sha256': sha256, 'rows': rows, 'columns': columns,
+                                'bytes': os.path.getsize(path), 'updated': updated})
+    return bool(written)
+
+
+def read_report(filename, columns=None):
+    """Reads a report saved by save_report.  Given the .tsv name of a report that was also
+    saved as Arrow or Parquet with the same content, reads that instead.  Arrow and Parquet
+    files are memory-mapped, so only the columns asked for are read from disk, and
+    column types are kept (tsv.zst files carry their column dtypes, plain TSVs don't)."""
+    if filename.endswith('.tsv') and ARROW_AVAILABLE:
+        directory, name = os.path.split(os.path.abspath(filename))
+        manifest = load_manifest(directory)
+        sha256 = manifest.get(name, {}).get('sha256')
+        for report_format in ('arrow', 'parquet'):
+            path = report_path(filename, report_format)
+            if sha256 and _unchanged(path, sha256) or not os.path.exists(filename) and os.path.exists(path):
+                filename = path
+                break
+    if filename.endswith('.arrow') or filename.endswith('.parquet'):
+        if not ARROW_AVAILABLE:
+            raise ImportError("pyarrow is needed to read %s" % filename)
+        if filename.endswith('.parquet'):
+            return pq.read_table(filename, columns=columns, memory_map=True).to_pandas()
+        with pa.memory_map(filename) as source:
+            table = pa.ipc.open_file(source).read_all()
+            return (table.select(columns) if columns else table).to_pandas()
+    if filename.endswith('.tsv.zst'):
+        if not ZSTD_AVAILABLE:
+            raise ImportError("zstandard is needed to read %s" % filename)
+        with open(filename, 'rb') as f:
+            text = codecs.getreader('utf-8')(zstandard.ZstdDecompressor().stream_reader(f))
+            first = text.readline()
+            if first.startswith(SCHEMA_PREFIX):
+                schema = json.loads(first[len(SCHEMA_PREFIX):])
+            else:
+                schema = {}
+                text = io.StringIO(first + text.read())
+            report = pd.read_csv(text, sep='\t', usecols=columns)
+        for column, dtype in schema.items():
+            if column in report.columns and dtype not in ('object', 'str', str(report[column].dtype)):
+                try:
+                    report[column] = report[column].astype(dtype)
+                except (TypeError, ValueError):
+                    pass
+        return report
+    return pd.read_csv(filename, sep='\t', usecols=columns)
+
+
+def run_reports(tasks, max_per_server=2, max_workers=None, timeout=None):
+    """Runs a set of report tasks concurrently, each as soon as the tasks it depends on have finished.
+    Args:
+        tasks: dict of task name: (server, function, dependencies).  function is called with the
+            results of its dependencies (a list of task names), in order.  server is any key
+            identifying the server the task queries, or None for tasks that only use local data.
+        max_per_server: maximum number of tasks running against any one server at a time.
+        max_workers: size of the thread pool (defaults to the number of tasks).
+        timeout: budget in seconds for each task, None for none (see deadlines.py).  A task
+            that runs out of it fails with a deadlines.ReportTimeout as its next query is sent.
+    Returns a dict of task name: result for tasks that succeeded and a dict of
+    task name: exception for those that failed, timed out or were skipped because a dependency failed."""
+    results = {}
+    failures = {}
+    waiting = dict(tasks)
+    running = {}
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max_workers or max(len(tasks), 1)) as pool:
+        while waiting or running:
+            busy = Counter(tasks[name][0] for name in running.values())
+            progress = False
+            for name, (server, function, dependencies) in list(waiting.items()):
+                failed = [d for d in dependencies if d in failures or d not in tasks]
+                if failed:
+                    del waiting[name]
+                    failures[name] = Exception("Skipped as %s failed" % ', '.join(failed))
+                    print("Skipping %s as %s failed" % (name, ', '.join(failed)))
+                    progress = True
+                elif all(d in results for d in dependencies) and (server is None or busy[server] < max_per_server):
+                    del waiting[name]
+                    busy[server] += 1
+                    running[pool.submit(_run_within, timeout, name, function,
+                                        *[results[d] for d in dependencies])] = name
+                    progress = True
+            if not running:
+                if not progress:  # what is left depends on itself
+                    for name in waiting:
+                        failures[name] = Exception("Circular dependency")
+                    waiting.clear()
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                    print("Finished %s (%.0fs)" % (name, time.time() - start))
+                except ReportTimeout as e:
+                    failures[name] = e
+                    print(f"Timed out running {name}: {e}")
+                except Exception as e:
+                    failures[name] = e
+                    print(f"An exception occurred running {name}: {e}")
+    timed_out = [name for name, e in failures.items() if isinstance(e, ReportTimeout)]
+    print("Ran %d tasks in %.0fs, %d failed (%d timed out%s)" % (len(tasks), time.time() - start, len(failures),
+                                                              len(timed_out), ': ' + ', '.join(timed_out) if timed_out else ''))
+    return results, failures
+
+
+def _run_within(timeout, name, function, *args):
+    with deadlines.deadline(timeout, name):
+        return function(*args)
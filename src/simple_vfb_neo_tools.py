@@ -1,5 +1,5 @@
-from uk.ac.ebi.vfb.neo4j.neo4j_tools import neo4j_connect
 from uk.ac.ebi.vfb.neo4j.neo4j_tools import results_2_dict_list
+from reporting_tools import get_connection
 from owlery_query_tools import OWLeryConnect
 
 
@@ -7,12 +7,13 @@ from owlery_query_tools import OWLeryConnect
 def get_lookup(limit_by_prefix=None):
     if limit_by_prefix:
         regex_string = ':.+|'.join(limit_by_prefix) + ':.+'
-        where = " AND a.obo_id =~ '%s' " % regex_string
+        where = " AND a.obo_id =~ $regex "
     else:
+        regex_string = None
         where = ''
-    nc = neo4j_connect("https://pdb.virtualflybrain.org", "neo4j", "neo4j")
+    nc = get_connection(("https://pdb.virtualflybrain.org", "neo4j", "neo4j"))
     lookup_query = "MATCH (a:VFB:Class) WHERE exists (a.obo_id)" + where + " RETURN a.obo_id as id, a.label as name"
-    q = nc.commit_list([lookup_query])
+    q = nc.commit_list([lookup_query], parameters=[{'regex': regex_string}])
     r = results_2_dict_list(q)
     lookup = {x['name']: x['id'] for x in r}
     #print(lookup['neuron'])
@@ -25,8 +26,8 @@ def get_lookup(limit_by_prefix=None):
 
 
 def gen_simple_report(terms):
-    nc = neo4j_connect("https://pdb.virtualflybrain.org", "neo4j", "neo4j")
-    query = """MATCH (n:Class) WHERE n.iri in %s WITH n 
+    nc = get_connection(("https://pdb.virtualflybrain.org", "neo4j", "neo4j"))
+    query = """MATCH (n:Class) WHERE n.iri in $terms WITH n 
                 OPTIONAL MATCH  (n)-[r]->(p:pub) WHERE r.typ = 'syn' 
                 WITH n, 
                 COLLECT({ synonym: r.synonym, PMID: 'PMID:' + p.PMID, 
@@ -38,9 +39,9 @@ def gen_simple_report(terms):
                 RETURN n.short_form as short_form, n.label as label, 
                 n.description as description, syns, pubs,
                 super.label, super.short_form
-                 """ % str(terms)
+                 """
     #print(query)
-    q = nc.commit_list([query])
+    q = nc.commit_list([query], parameters=[{'terms': list(terms)}])
     return results_2_dict_list(q)
 
 def get_terms_by_region(region, cells_only = False, verbose=True):
@@ -0,0 +1,143 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmark'))
+from neo4j_standin import LABELS, RELATIONSHIP_TYPES, Neo4jStandIn
+import VFB_content_report_generator
+from VFB_content_report_generator import CONTENT_QUERIES, VFBContentReport, prepare_delta_report, \
+    run_content_reports
+
+
+class CensusStandIn(Neo4jStandIn):
+    """Stand-in with settable label counts, recording the content queries it is sent."""
+
+    def __init__(self):
+        super().__init__(rows=5)
+        self.labels = {label: 1000 * (i + 1) for i, label in enumerate(LABELS)}
+        self.queries = []
+
+    def result(self, statement):
+        if 'apoc.meta.stats' in statement['statement']:
+            return {'columns': ['labels', 'relTypesCount'],
+                    'data': [{'row': [self.labels, {t: 10 for t in RELATIONSHIP_TYPES}], 'meta': [None, None]}]}
+        if statement['statement'] in CONTENT_QUERIES.values():
+            self.queries.append(statement['statement'])
+        return super().result(statement)
+
+
+class IncrementalRefreshTest(unittest.TestCase):
+
+    def test_unchanged_queries_reused(self):
+        with tempfile.TemporaryDirectory() as directory, CensusStandIn() as standin:
+            state_file = os.path.join(directory, 'state.json')
+            server = (standin.url, 'neo4j', 'vfb')
+            first = VFBContentReport(server)
+            first.get_info(state_file=state_file)
+            self.assertEqual(first.reused, {})
+            self.assertEqual(len(standin.queries), len(CONTENT_QUERIES))
+
+            standin.queries = []
+            second = VFBContentReport(server)
+            second.get_info(state_file=state_file)
+            self.assertEqual(set(second.reused), set(CONTENT_QUERIES))
+            self.assertEqual(standin.queries, [])
+            self.assertEqual(second.metrics(), first.metrics())
+            self.assertTrue(second.templates_data.equals(first.templates_data))
+
+            standin.labels['Gene'] += 1
+            third = VFBContentReport(server)
+            third.get_info(state_file=state_file)
+            self.assertEqual(set(CONTENT_QUERIES) - set(third.reused), {'scrnaseq_totals'})
+            self.assertEqual(len(standin.queries), 1)
+
+            filename = os.path.join(directory, 'content_report')
+            third.prepare_report(filename)
+            with open(filename + '.md') as f:
+                report = f.read()
+            self.assertIn('Reused Values', report)
+            self.assertIn('|templates_data|', report)
+            self.assertNotIn('|scrnaseq_totals|', report)
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def test_render_from_snapshot(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with CensusStandIn() as standin:
+                report = VFBContentReport((standin.url, 'neo4j', 'vfb'))
+                report.get_info()
+            report.save(os.path.join(directory, 'content_report.json'))
+            loaded = VFBContentReport.load(os.path.join(directory, 'content_report.json'))
+            self.assertEqual(loaded.metrics(), report.metrics())
+            self.assertEqual(loaded.timestamp, report.timestamp)
+            self.assertTrue(loaded.em_project_data.equals(report.em_project_data))
+            self.assertTrue(loaded.templates_data.equals(report.templates_data))
+
+            rendered = []
+            for r, name in [(report, 'queried'), (loaded, 'loaded')]:
+                r.prepare_report(os.path.join(directory, name))
+                with open(os.path.join(directory, name + '.md')) as f:
+                    rendered.append(f.read())
+            self.assertEqual(rendered[0], rendered[1])
+
+
+class DeltaReportTest(unittest.TestCase):
+
+    def test_values_and_differences(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with CensusStandIn() as standin:
+                pdb = VFBContentReport((standin.url, 'neo4j', 'vfb'))
+                pdb.get_info()
+            pdb.save(os.path.join(directory, 'pdb.json'))
+            preview = VFBContentReport.load(os.path.join(directory, 'pdb.json'))
+            preview.all_terms_number += 12
+            preview.scrnaseq_gene_number = None
+            prepare_delta_report({'pdb': pdb, 'pdb-preview': preview}, os.path.join(directory, 'delta'),
+                                 failures={'pdb-alpha': Exception("Connection refused")})
+            with open(os.path.join(directory, 'delta.md')) as f:
+                report = f.read()
+            self.assertIn('|all_terms_number|%d|%d|+12|' % (pdb.all_terms_number, preview.all_terms_number), report)
+            self.assertIn('|all_terms_pubs|%d|%d|+0|' % (pdb.all_terms_pubs, pdb.all_terms_pubs), report)
+            self.assertIn('|scrnaseq_gene_number|%d|||' % pdb.scrnaseq_gene_number, report)
+            self.assertIn('``pdb-alpha``: failed (Connection refused)', report)
+
+    def test_report_never_run(self):
+        with tempfile.TemporaryDirectory() as directory:
+            unrun = VFBContentReport(('http://127.0.0.1:9', 'neo4j', 'vfb'))
+            unrun.prepare_report(os.path.join(directory, 'content_report'))
+            prepare_delta_report({'pdb': unrun}, os.path.join(directory, 'delta'))
+            with open(os.path.join(directory, 'delta.md')) as f:
+                self.assertIn('``pdb``: http://127.0.0.1:9 on unknown date', f.read())
+
+
+class MultiServerTest(unittest.TestCase):
+
+    def test_unreachable_server_reported_separately(self):
+        with tempfile.TemporaryDirectory() as directory, CensusStandIn() as pdb, CensusStandIn() as preview:
+            servers = {'pdb': (pdb.url, 'neo4j', 'vfb'), 'pdb-preview': (preview.url, 'neo4j', 'vfb'),
+                       'pdb-alpha': ('http://127.0.0.1:9', 'neo4j', 'vfb')}
+            files = {s: os.path.join(directory, s + '.md') for s in servers}
+            snapshots = {s: os.path.join(directory, s + '.json') for s in servers}
+            with mock.patch.dict(VFB_content_report_generator.VFB_servers, servers), \
+                    mock.patch.dict(VFB_content_report_generator.output_files, files), \
+                    mock.patch.dict(VFB_content_report_generator.snapshot_files, snapshots), \
+                    mock.patch.object(VFB_content_report_generator, 'delta_file', os.path.join(directory, 'delta.md')):
+                reports, failures = run_content_reports(['pdb', 'pdb-preview', 'pdb-alpha'], timeout=5,
+                                                        state_file=None)
+            self.assertEqual(list(reports), ['pdb', 'pdb-preview', 'pdb-alpha'])
+            self.assertEqual(failures, {})
+            self.assertIsNone(reports['pdb-alpha'].all_terms_number)
+            self.assertEqual(reports['pdb-preview'].all_terms_number, reports['pdb'].all_terms_number)
+            for s in servers:
+                self.assertTrue(os.path.exists(files[s]) and os.path.exists(snapshots[s]))
+            with open(os.path.join(directory, 'delta.md')) as f:
+                self.assertIn('|all_terms_number|%d|%d|+0||' % (reports['pdb'].all_terms_number,
+                                                                reports['pdb'].all_terms_number), f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
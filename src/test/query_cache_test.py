@@ -0,0 +1,94 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import pandas as pd
+from query_cache import QueryCache, normalize_query
+
+
+class QueryCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = QueryCache(self.directory.name)
+        self.report = pd.DataFrame({'n.short_form': ['FBbt_1', 'FBbt_2'], 'count': [3, 4]})
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def age(self, key, seconds):
+        """Makes an entry look as if it was stored (and last used) seconds ago."""
+        path = self.cache._path(key)
+        then = time.time() - seconds
+        os.utime(path, (then, then))
+
+    def test_round_trip(self):
+        key = self.cache.key('http://pdb.virtualflybrain.org/', "MATCH (n)\n  RETURN n", {'ids': [1]}, 'fp')
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, self.report)
+        self.assertTrue(self.cache.get(key).equals(self.report))
+        # reformatted query, same endpoint
+        self.assertEqual(self.cache.key('http://pdb.virtualflybrain.org', "MATCH (n) RETURN n", {'ids': [1]}, 'fp'),
+                         key)
+        self.assertNotEqual(self.cache.key('http://pdb.virtualflybrain.org', "MATCH (n) RETURN n", {'ids': [2]},
+                                           'fp'), key)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+        self.assertEqual(normalize_query("MATCH  (n {label: 'a  b'})\nRETURN n"), "MATCH (n {label: 'a  b'}) RETURN n")
+
+    def test_stream_round_trip(self):
+        key = self.cache.key('http://pdb', "MATCH (n) RETURN n", variant='chunked')
+        chunks = [self.report, self.report.iloc[:1]]
+        self.assertEqual(len(list(self.cache.put_stream(key, iter(chunks)))), 2)
+        cached = list(self.cache.get_stream(key))
+        self.assertEqual(len(cached), 2)
+        self.assertTrue(cached[1].equals(chunks[1]))
+
+    def test_expiry(self):
+        self.cache.max_age = 60
+        key = self.cache.key('http://pdb', "MATCH (n) RETURN n")
+        self.cache.put(key, self.report)
+        self.age(key, 30)
+        self.assertIsNotNone(self.cache.get(key))
+        self.age(key, 120)
+        self.assertIsNone(self.cache.get(key))
+        self.assertFalse(os.path.exists(self.cache._path(key)))
+
+    def test_least_recently_used_evicted(self):
+        keys = [self.cache.key('http://pdb', "RETURN %d" % i) for i in range(3)]
+        for i, key in enumerate(keys):
+            self.cache.put(key, self.report)
+            self.age(key, 100 - i)
+        size = os.path.getsize(self.cache._path(keys[0]))
+        self.cache.get(keys[0])  # now the most recently used
+        self.cache.max_bytes = 2 * size
+        self.cache.put(self.cache.key('http://pdb', "RETURN 3"), self.report)
+        self.assertEqual([os.path.exists(self.cache._path(key)) for key in keys], [True, False, False])
+        self.assertEqual(self.cache.stats()['evictions'], 2)
+
+    def test_fingerprint_invalidates(self):
+        counts = {'nodes': 10, 'relationships': 20}
+        fetches = []
+
+        def fetch():
+            fetches.append(dict(counts))
+            return dict(counts)
+        query = "MATCH (n) RETURN n"
+        key = self.cache.key('http://pdb', query, fingerprint=self.cache.fingerprint('http://pdb', fetch))
+        self.cache.put(key, self.report)
+        counts['nodes'] += 1
+        # reused within fingerprint_ttl
+        self.assertEqual(self.cache.fingerprint('http://pdb', fetch), {'nodes': 10, 'relationships': 20})
+        self.assertEqual(len(fetches), 1)
+        self.cache.fingerprint_ttl = 0
+        new_key = self.cache.key('http://pdb', query, fingerprint=self.cache.fingerprint('http://pdb', fetch))
+        self.assertEqual(len(fetches), 2)
+        self.assertNotEqual(new_key, key)
+        self.assertIsNone(self.cache.get(new_key))
+
+
+if __name__ == '__main__':
+    unittest.main()
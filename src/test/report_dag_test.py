@@ -0,0 +1,73 @@
+import datetime
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from report_dag import ReportDAG
+
+
+class SkipTest(unittest.TestCase):
+    """Which tasks run again, given the fingerprints and state of the last run."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.state_file = os.path.join(self.directory.name, 'state.json')
+        self.output = os.path.join(self.directory.name, 'report.tsv')
+        self.fingerprint = 1
+        self.runs = []
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_dag(self, **kwargs):
+        """Runs a report task and one depending on it; returns the names of the tasks that ran."""
+        def report():
+            self.runs.append('report')
+            with open(self.output, 'w') as f:
+                f.write('a\t1\n')
+            return self.fingerprint
+
+        def summary(value):
+            self.runs.append('summary')
+        self.runs = []
+        dag = ReportDAG(state_file=self.state_file, **kwargs)
+        dag.add('report', report, fingerprint=lambda: self.fingerprint, outputs=[self.output])
+        dag.add('summary', summary, inputs=['report'])
+        self.assertEqual(dag.run(), {})
+        return self.runs
+
+    def test_unchanged_inputs_skipped(self):
+        self.assertEqual(self.run_dag(), ['report', 'summary'])
+        self.assertEqual(self.run_dag(), [])
+
+    def test_changed_fingerprint_runs(self):
+        self.run_dag()
+        self.fingerprint = 2
+        self.assertEqual(self.run_dag(), ['report', 'summary'])
+
+    def test_missing_output_runs(self):
+        self.run_dag()
+        os.remove(self.output)
+        self.assertEqual(self.run_dag(), ['report'])
+
+    def test_old_run_repeated(self):
+        self.run_dag()
+        with open(self.state_file) as f:
+            state = json.load(f)
+        state['report']['finished'] = (datetime.datetime.now(tz=datetime.timezone.utc)
+                                       - datetime.timedelta(days=8)).isoformat()
+        with open(self.state_file, 'w') as f:
+            json.dump(state, f)
+        self.assertEqual(self.run_dag(max_age_days=7), ['report'])
+        self.assertEqual(self.run_dag(max_age_days=7), [])
+
+    def test_max_age_zero_always_runs(self):
+        self.run_dag()
+        self.assertEqual(self.run_dag(max_age_days=0), ['report', 'summary'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import datetime
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import pandas as pd
+from report_history import ReportHistory
+
+
+class ReportHistoryTest(unittest.TestCase):
+
+    def test_daily_deltas(self):
+        server = ('http://pdb.virtualflybrain.org', 'neo4j', 'vfb')
+        with tempfile.TemporaryDirectory() as directory:
+            history = ReportHistory(os.path.join(directory, 'history.sqlite'))
+            for day, individuals in [(1, [1, 5]), (2, [2, 5]), (3, [2, 7])]:
+                report = pd.DataFrame({'ds.short_form': ['a', 'b'], 'ds.label': ['A', 'B'],
+                                       'individuals': individuals})
+                history.record_report('pdb', server, report, ['ds.short_form'],
+                                      taken_at=datetime.datetime(2026, 1, day, 12))
+            deltas = history.daily_deltas('pdb', server)
+            self.assertEqual(deltas['day'].tolist(), ['2026-01-02', '2026-01-03'])
+            self.assertEqual(deltas['key'].tolist(), ['a', 'b'])
+            self.assertEqual(deltas['change'].tolist(), [1, 2])
+            self.assertEqual(deltas['status'].tolist(), ['changed', 'changed'])
+            values = history.query('pdb', 'pdb.virtualflybrain.org', metric='individuals', key='b',
+                                   start=datetime.date(2026, 1, 2))
+            self.assertEqual(values['value'].tolist(), [5, 7])
+            self.assertEqual(history.trend('pdb', server, 'individuals')['a'].tolist(), [1, 2, 2])
+
+    def test_added_and_removed_keys(self):
+        with tempfile.TemporaryDirectory() as directory:
+            history = ReportHistory(os.path.join(directory, 'history.sqlite'))
+            for day, keys in [(1, ['a', 'b']), (2, ['a', 'c'])]:
+                history.record_report('pdb', 'pdb', pd.DataFrame({'ds.short_form': keys, 'individuals': [1, 2]}),
+                                      ['ds.short_form'], taken_at=datetime.datetime(2026, 1, day, 12))
+            deltas = history.daily_deltas('pdb', 'pdb')
+            self.assertEqual(deltas['key'].tolist(), ['b', 'c'])
+            self.assertEqual(deltas['status'].tolist(), ['removed', 'added'])
+            self.assertEqual(deltas['previous'].tolist()[0], 2)
+            self.assertTrue(pd.isna(deltas['value'][0]) and pd.isna(deltas['previous'][1]))
+            all_rows = history.daily_deltas('pdb', 'pdb', changed_only=False)
+            self.assertEqual(all_rows['status'].tolist(), ['unchanged', 'removed', 'added'])
+            trend = history.trend('pdb', 'pdb', 'individuals')
+            self.assertEqual(trend['a'].tolist(), [1, 1])
+            self.assertTrue(pd.isna(trend['b']['2026-01-02']) and pd.isna(trend['c']['2026-01-01']))
+
+    def test_duplicate_keys(self):
+        # the dataset report has a row per license of a dataset
+        with tempfile.TemporaryDirectory() as directory:
+            history = ReportHistory(os.path.join(directory, 'history.sqlite'))
+            for day in [1, 2]:
+                report = pd.DataFrame({'ds.short_form': ['a', 'a', 'b'], 'pub': ['p', 'p', 'q'],
+                                       'license': ['CC-BY', 'CC0', 'CC-BY'], 'individuals': [3, 3, day]})
+                history.record_report('pdb', 'pdb', report, ['ds.short_form', 'pub'],
+                                      taken_at=datetime.datetime(2026, 1, day, 12))
+            self.assertEqual(len(history.query('pdb', 'pdb', start='2026-01-02')), 2)
+            self.assertEqual(history.trend('pdb', 'pdb', 'individuals')['a\tp'].tolist(), [3, 3])
+            self.assertEqual(history.daily_deltas('pdb', 'pdb')['key'].tolist(), ['b\tq'])
+            # histories recorded before duplicate keys were dropped
+            history.record('pdb', 'pdb', [('a\tp', 'individuals', 4), ('a\tp', 'individuals', 4)],
+                           taken_at=datetime.datetime(2026, 1, 3, 12))
+            self.assertEqual(history.trend('pdb', 'pdb', 'individuals')['a\tp'].tolist(), [3, 3, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,742 @@
+import json
+import os
+import re
+import runpy
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import pandas as pd
+import requests
+import reporting_tools
+from cassette import Cassette
+from deadlines import ReportTimeout, deadline
+from query_plans import PlanStore, compare, operators, summarize, totals
+from query_profiler import PROFILE_COLUMNS, PROFILER, QueryProfiler, profiled_session, query_id
+from reporting_tools import _counted_census, _read_only_request, _stream_rows, compact_frame, concat_frames, \
+    decode_results, diff_report_by_key, gen_label_count_matrix, gen_report, gen_report_chunks, gen_report_paginated, \
+    gen_reports_batch, get_connection, label_census, load_manifest, page_boundaries, plain_frame, read_report, \
+    report_path, results_2_frame, run_reports, save_report
+
+
+class FakeResponse:
+    """Minimal stand-in for a streamed requests.Response."""
+
+    def __init__(self, payload, status_code=200):
+        self.content = json.dumps(payload).encode('utf-8')
+        self.status_code = status_code
+        self.reason = 'OK'
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+
+class StreamRowsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.payload = {'results': [{'columns': ['id', 'label', 'count'],
+                                     'data': [{'row': ['FBbt_1', 'neuron ]', 3], 'meta': [None]},
+                                              {'row': ['FBbt_2', 'café', None], 'meta': [None]},
+                                              {'row': ['FBbt_3', ['a', 'b'], 0], 'meta': [None]}]}],
+                        'errors': []}
+
+    def test_rows_across_read_boundaries(self):
+        for read_size in [1, 2, 7, 64, 1 << 20]:
+            rows = list(_stream_rows(FakeResponse(self.payload), read_size=read_size))
+            self.assertEqual(rows[0], ['id', 'label', 'count'])
+            self.assertEqual(rows[1:], [d['row'] for d in self.payload['results'][0]['data']])
+
+    def test_empty_result(self):
+        self.payload['results'][0]['data'] = []
+        rows = list(_stream_rows(FakeResponse(self.payload), read_size=3))
+        self.assertEqual(rows, [['id', 'label', 'count']])
+
+    def test_errors_raise(self):
+        failed = {'results': [], 'errors': [{'code': 'Neo.ClientError', 'message': 'bad "columns"'}]}
+        with self.assertRaises(Exception):
+            list(_stream_rows(FakeResponse(failed), read_size=5))
+        with self.assertRaises(Exception):
+            list(_stream_rows(FakeResponse(self.payload, status_code=500)))
+
+
+class ColumnarDecoderTest(unittest.TestCase):
+
+    def test_results_2_frame(self):
+        content = json.dumps({'results': [{'columns': ['id', 'count', 'types'],
+                                           'data': [{'row': ['a', 1, ['x']], 'meta': []},
+                                                    {'row': ['b', 2, []], 'meta': []}]},
+                                          {'columns': ['id'], 'data': []}],
+                              'errors': []}).encode('utf-8')
+        results = decode_results(content)
+        report = results_2_frame(results)
+        self.assertEqual(list(report.columns), ['id', 'count', 'types'])
+        self.assertEqual(report['count'].dtype, 'int64')
+        self.assertEqual(report['types'].tolist(), [['x'], []])
+        empty = results_2_frame(results, statement=1)
+        self.assertTrue(empty.empty)
+        self.assertEqual(list(empty.columns), ['id'])
+
+    def test_errors_raise(self):
+        with self.assertRaises(Exception):
+            decode_results(json.dumps({'results': [], 'errors': [{'message': 'bad'}]}).encode('utf-8'))
+
+
+class DiffReportByKeyTest(unittest.TestCase):
+
+    def test_added_removed_changed(self):
+        pdb = pd.DataFrame({'ds.short_form': ['a', 'b', 'c'], 'pub': ['p1', 'p2', 'p3'],
+                            'individuals': [1, 2, 3], 'types': [['x'], ['y'], ['z']]})
+        pdb.name = 'pdb'
+        staging = pd.DataFrame({'ds.short_form': ['a', 'b', 'd'], 'pub': ['p1', 'p2', 'p4'],
+                                'individuals': [1, 5, 4], 'types': [['x'], ['y', 'w'], ['z']]})
+        staging.name = 'staging'
+        diff = diff_report_by_key(pdb, staging, ['ds.short_form'])
+        self.assertEqual(diff['ds.short_form'].tolist(), ['b', 'c', 'd'])
+        self.assertEqual(diff['change'].tolist(), ['changed', 'removed', 'added'])
+        self.assertEqual(diff['changed_columns'][0], 'individuals, types')
+        self.assertEqual(diff['individuals_pdb'][0], 2)
+        self.assertEqual(diff['individuals_staging'][0], 5)
+        self.assertEqual(diff['pub_pdb'][1], 'p3')
+        self.assertTrue(diff_report_by_key(pdb, pdb, ['ds.short_form']).empty)
+
+    def test_values_differing_only_in_type(self):
+        old = pd.DataFrame({'id': ['a', 'b', 'c'], 'count': [1, 2, 3], 'label': ['1', '2', 'x']})
+        old.name = 'old'
+        new = pd.DataFrame({'id': ['a', 'b', 'c'], 'count': [1.0, 2.0, 4.0], 'label': [1, 2, 'x']})
+        new.name = 'new'
+        diff = diff_report_by_key(old, new, 'id')
+        self.assertEqual(diff['id'].tolist(), ['c'])
+        self.assertEqual(diff['change'].tolist(), ['changed'])
+        self.assertEqual(diff['changed_columns'].tolist(), ['count'])
+
+
+class CompactFrameTest(unittest.TestCase):
+
+    def test_compact_frame(self):
+        report = results_2_frame([{'columns': ['skid', 'paper', 'count', 'tags'],
+                                   'data': [{'row': ['10', 'Smith 2020', 3, ['a']]},
+                                            {'row': ['11', 'Smith 2020', None, ['b']]},
+                                            {'row': ['', 'Jones 2021', 5, []]},
+                                            {'row': ['13', 'Smith 2020', 7, ['c']]}]}])
+        compact = compact_frame(report, int_columns=['skid'])
+        self.assertEqual(str(compact['skid'].dtype), 'Int64')
+        self.assertEqual(str(compact['paper'].dtype), 'category')
+        self.assertEqual(str(compact['count'].dtype), 'Int64')
+        self.assertEqual(compact['tags'].tolist(), [['a'], ['b'], [], ['c']])
+        self.assertEqual(plain_frame(compact)['count'].tolist(), [3, '', 5, 7])
+        joined = concat_frames([compact.head(2), compact.tail(2)])
+        self.assertEqual(str(joined['paper'].dtype), 'category')
+        self.assertEqual(joined['paper'].tolist(), report['paper'].tolist())
+        self.assertTrue(compact.merge(pd.DataFrame({'paper': ['Jones 2021'], 'ds': ['x']}))['skid'].isna().all())
+
+
+class SaveReportTest(unittest.TestCase):
+
+    def test_unchanged_report_not_rewritten(self):
+        report = pd.DataFrame({'a': [1, 2], 'b': ['x', None]})
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'report.tsv')
+            self.assertTrue(save_report(report, filename))
+            self.assertFalse(save_report(report, filename))
+            self.assertFalse(save_report(iter([report]), filename))
+            self.assertEqual(load_manifest(directory)['report.tsv']['rows'], 2)
+            self.assertTrue(save_report(report.head(1), filename))
+            self.assertEqual(load_manifest(directory)['report.tsv']['rows'], 1)
+            self.assertEqual(os.listdir(directory).count('report.tsv'), 1)
+
+    @unittest.skipUnless(reporting_tools.fcntl, "needs fcntl")
+    def test_manifest_shared_between_processes(self):
+        script = ("import sys; sys.path.insert(0, %r); import pandas as pd; from reporting_tools import save_report\n"
+                  "for i in range(30):\n"
+                  "    save_report(pd.DataFrame({'a': [i]}), sys.argv[1] + '/%%s_%%d.tsv' %% (sys.argv[2], i))"
+                  % os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+        with tempfile.TemporaryDirectory() as directory:
+            processes = [subprocess.Popen([sys.executable, '-c', script, directory, name], stdout=subprocess.DEVNULL)
+                         for name in ('a', 'b', 'c')]
+            self.assertEqual([p.wait() for p in processes], [0, 0, 0])
+            self.assertEqual(len(load_manifest(directory)), 90)
+
+    @unittest.skipUnless(reporting_tools.ARROW_AVAILABLE and reporting_tools.ZSTD_AVAILABLE, "needs pyarrow and zstandard")
+    def test_formats_round_trip(self):
+        report = pd.DataFrame({'id': ['a', 'b', 'c'], 'count': [1, 2, 3], 'score': [0.5, None, 1.5]})
+        chunks = [report.head(1), report.tail(2)]
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'report.tsv')
+            formats = ['tsv', 'tsv.zst', 'parquet', 'arrow']
+            self.assertTrue(save_report(iter(chunks), filename, formats=formats))
+            self.assertFalse(save_report(report, filename, formats=formats))
+            for report_format in formats:
+                loaded = read_report(report_path(filename, report_format))
+                self.assertEqual(loaded['count'].dtype, 'int64')
+                self.assertEqual(loaded['id'].tolist(), ['a', 'b', 'c'])
+            self.assertEqual(list(read_report(filename, columns=['score']).columns), ['score'])
+
+
+PAYLOAD = json.dumps({'results': [{'columns': ['id', 'count'], 'data': [{'row': ['a', 1], 'meta': [None]},
+                                                                        {'row': ['b', 2], 'meta': [None]}]}],
+                      'errors': []}).encode('utf-8')
+
+
+class Neo4jHandler(BaseHTTPRequestHandler):
+    """Answers every query with PAYLOAD, after sleeping for queries containing 'slow' and
+    with a 503 to the first request for each query containing 'flaky'."""
+    seen = set()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+        if 'slow' in body:
+            time.sleep(2)
+        if 'flaky' in body and body not in self.seen:
+            self.seen.add(body)
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_payload(PAYLOAD)
+
+    def send_payload(self, payload):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        try:
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client timed out
+
+
+def start_server(handler=Neo4jHandler):
+    """Serves handler on a free port; returns the server and its connection ([endpoint, usr, pwd])."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, ('http://127.0.0.1:%d' % server.server_address[1], 'neo4j', 'neo4j')
+
+
+class ServerTestCase(unittest.TestCase):
+    """Runs a server with the class's handler for each test, as self.neo4j."""
+    handler = Neo4jHandler
+
+    def setUp(self):
+        self.server, self.neo4j = start_server(self.handler)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class ConnectionRegistryTest(ServerTestCase):
+
+    def test_one_connection_per_server(self):
+        nc = get_connection(self.neo4j)
+        uses = nc.use_count
+        self.assertIs(get_connection(list(self.neo4j)), nc)
+        self.assertEqual(nc.use_count, uses + 1)
+        connections = []
+        threads = [threading.Thread(target=lambda: connections.append(get_connection(self.neo4j)))
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(set(map(id, connections)), {id(nc)})
+        other = get_connection((self.neo4j[0], 'reader', 'secret'))
+        self.assertIsNot(other, nc)
+        self.assertIsNot(other.session, nc.session)
+        requests_sent = nc.request_count
+        gen_report(self.neo4j, 'MATCH (n) RETURN n.short_form AS id, 1 AS count', 'test', cache=False)
+        self.assertEqual(nc.request_count, requests_sent + 1)
+        stats = reporting_tools.connection_stats()
+        self.assertEqual(stats[stats['server'] == self.neo4j[0]]['uses'].sum(), nc.use_count + other.use_count)
+
+    def test_only_reads_retried(self):
+        def request(statement):
+            return requests.Request('POST', self.neo4j[0], data=json.dumps(
+                {'statements': [{'statement': 'MATCH (n) RETURN n'}, {'statement': statement}]})).prepare()
+        self.assertTrue(_read_only_request(request("MATCH (n:Class) WHERE n.label = 'created' RETURN n")))
+        for write in ["CREATE (n:A)", "MATCH (n) SET n.x = 1", "MATCH (n) DETACH DELETE n", "MATCH (n) REMOVE n:A",
+                      "LOAD CSV FROM 'file:///a.csv' AS row RETURN row", "CALL apoc.create.node(['A'], {})",
+                      "CALL apoc.periodic.iterate('MATCH (n) RETURN n', 'SET n.x = 1', {})", "drop index a"]:
+            self.assertFalse(_read_only_request(request(write)), write)
+        self.assertFalse(_read_only_request(requests.Request('POST', self.neo4j[0], data='not json').prepare()))
+        # a write that gets a 503 fails rather than being sent again
+        adapter = get_connection(self.neo4j).session.get_adapter(self.neo4j[0])
+        backoff, adapter.backoff = adapter.backoff, 0.01
+        try:
+            with self.assertRaises(Exception):
+                gen_report(self.neo4j, 'MERGE (n:A {label: "flaky write"}) RETURN n.short_form AS id', 'write',
+                           cache=False)
+        finally:
+            adapter.backoff = backoff
+
+
+class ParameterHandler(Neo4jHandler):
+    """Records each statement and its parameters, answering with no rows (with a column per alias)."""
+    posted = []
+
+    def do_POST(self):
+        results = []
+        for statement in json.loads(self.rfile.read(int(self.headers['Content-Length'])))['statements']:
+            self.posted.append((statement['statement'], statement.get('parameters')))
+            columns = re.findall(r'\bAS\s+`?(\w+)`?', statement['statement'], re.IGNORECASE)
+            results.append({'columns': columns, 'data': []})
+        self.send_payload(json.dumps({'results': results, 'errors': []}).encode('utf-8'))
+
+
+class ParameterTest(ServerTestCase):
+    """Values reach the server as parameters, not pasted into the query text."""
+    handler = ParameterHandler
+
+    def setUp(self):
+        super().setUp()
+        ParameterHandler.posted = []
+
+    def sent(self, name):
+        """The parameter name of every statement that has it."""
+        return [parameters[name] for _, parameters in ParameterHandler.posted if parameters and name in parameters]
+
+    def test_newmeta_curation_file_maker(self):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'make_curation_records',
+                              'newmeta_curation_file_maker.py')
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            os.makedirs(os.path.join(directory, 'Management', 'FAFB'))
+            os.makedirs(os.path.join(directory, 'VFB_reporting_results', 'CATMAID_SKID_reports'))
+            os.makedirs(os.path.join(directory, 'a', 'b', 'c'))
+            typings = pd.DataFrame({'skid': ['1', '2', '3', '4'],
+                                    'FBbt_id': ['FBbt:00000001', 'FBbt:00000002', 'FBbt:00000001', None]})
+            typings.to_csv(os.path.join(directory, 'Management', 'FAFB', 'FAFB_skid_FBbt.tsv'),
+                           sep='\t', index=False)
+            reports = os.path.join(directory, 'VFB_reporting_results', 'CATMAID_SKID_reports')
+            skids = pd.DataFrame({'skid': ['1', '2', '3'], 'paper_id': ['100', '200', '100'],
+                                  'paper_name': 'x', 'synonyms': 'y'})
+            skids.to_csv(os.path.join(reports, 'FAFB_all_skids_officialnames.tsv'), sep='\t', index=False)
+            pd.DataFrame({'Paper_ID': ['100', '200', '300'], 'VFB_name': ['Smith2020', None, "O'Neil2021"]}
+                         ).to_csv(os.path.join(reports, 'FAFB_comparison.tsv'), sep='\t', index=False)
+            os.chdir(os.path.join(directory, 'a', 'b', 'c'))
+            try:
+                with mock.patch.object(reporting_tools, 'get_connection', lambda server: get_connection(self.neo4j)):
+                    runpy.run_path(script, run_name='__main__')
+            finally:
+                os.chdir(cwd)
+        self.assertEqual(self.sent('ids'), [['FBbt_00000001', 'FBbt_00000002']])
+        self.assertEqual(self.sent('paper_ids'), [['100', '200']])
+        self.assertEqual(self.sent('ds_names'), [['Smith2020', "O'Neil2021"]])
+        for statement, _ in ParameterHandler.posted:
+            self.assertNotIn('FBbt_0', statement)
+            self.assertNotIn('Smith2020', statement)
+
+    def test_simple_vfb_neo_tools(self):
+        import simple_vfb_neo_tools
+        with mock.patch.object(simple_vfb_neo_tools, 'get_connection', lambda server: get_connection(self.neo4j)):
+            self.assertEqual(simple_vfb_neo_tools.get_lookup(limit_by_prefix=['FBbt', 'GO']), {})
+            simple_vfb_neo_tools.get_lookup()
+            self.assertEqual(simple_vfb_neo_tools.gen_simple_report(
+                ('http://purl.obolibrary.org/obo/FBbt_00000001', "http://example.org/it's")), [])
+        self.assertEqual(self.sent('regex'), ['FBbt:.+|GO:.+', None])
+        self.assertEqual(self.sent('terms'), [['http://purl.obolibrary.org/obo/FBbt_00000001',
+                                               "http://example.org/it's"]])
+        self.assertFalse([s for s, _ in ParameterHandler.posted if 'FBbt:' in s or 'obolibrary' in s])
+
+
+class CensusHandler(Neo4jHandler):
+    """Answers label census queries for LABELS and RELATIONSHIP_TYPES, from apoc.meta.stats if apoc is set
+    (otherwise that procedure is missing) or one count query each, sleeping before counting 'Slow'."""
+    LABELS = {'Class': 30, 'Neuron': 20, 'odd`label': 1, 'Slow': 5}
+    RELATIONSHIP_TYPES = {'SUBCLASSOF': 40, 'part_of': 10}
+    apoc = True
+    counted = []
+
+    def do_POST(self):
+        results = []
+        errors = []
+        for statement in json.loads(self.rfile.read(int(self.headers['Content-Length'])))['statements']:
+            statement = statement['statement']
+            if 'apoc.meta.stats' in statement and not self.apoc:
+                errors.append({'code': 'Neo.ClientError.Procedure.ProcedureNotFound',
+                               'message': 'There is no procedure with the name `apoc.meta.stats` registered'})
+                break
+            if 'apoc.meta.stats' in statement:
+                result = {'columns': ['labels', 'relTypesCount'],
+                          'data': [{'row': [self.LABELS, self.RELATIONSHIP_TYPES]}]}
+            elif 'db.labels' in statement:
+                result = {'columns': ['label'], 'data': [{'row': [label]} for label in self.LABELS]}
+            elif 'db.relationshipTypes' in statement:
+                result = {'columns': ['relationshipType'], 'data': [{'row': [t]} for t in self.RELATIONSHIP_TYPES]}
+            elif 'count(' in statement:
+                name = re.search(r':`((?:[^`]|``)*)`', statement).group(1).replace('``', '`')
+                self.counted.append(name)
+                if name == 'Slow':
+                    time.sleep(2)
+                result = {'columns': ['count'],
+                          'data': [{'row': [self.LABELS.get(name, self.RELATIONSHIP_TYPES.get(name))]}]}
+            else:
+                result = {'columns': ['n'], 'data': []}
+            results.append(result)
+        self.send_payload(json.dumps({'results': results, 'errors': errors}).encode('utf-8'))
+
+
+class CensusTest(ServerTestCase):
+    handler = CensusHandler
+
+    def setUp(self):
+        super().setUp()
+        CensusHandler.apoc = True
+        CensusHandler.counted = []
+
+    def test_from_meta_stats(self):
+        census = label_census(self.neo4j)
+        self.assertEqual(list(census.columns), ['type', 'label', 'count'])
+        self.assertEqual(census['type'].tolist(), ['node'] * 4 + ['relationship'] * 2)
+        self.assertEqual(census['label'].tolist(), ['Class', 'Neuron', 'Slow', 'odd`label', 'SUBCLASSOF', 'part_of'])
+        self.assertEqual(census['count'].tolist(), [30, 20, 5, 1, 40, 10])
+        self.assertEqual(str(census['count'].dtype), 'Int64')
+        self.assertEqual(CensusHandler.counted, [])
+
+    def test_counted_without_apoc(self):
+        CensusHandler.apoc = False
+        census = label_census(self.neo4j, timeout=0.5, max_workers=4)
+        counts = dict(zip(census['label'], census['count']))
+        self.assertEqual({k: v for k, v in counts.items() if k != 'Slow'},
+                         {'Class': 30, 'Neuron': 20, 'odd`label': 1, 'SUBCLASSOF': 40, 'part_of': 10})
+        self.assertTrue(pd.isna(counts['Slow']))  # timed out
+        self.assertEqual(sorted(CensusHandler.counted),
+                         sorted(list(CensusHandler.LABELS) + list(CensusHandler.RELATIONSHIP_TYPES)))
+        self.assertEqual(_counted_census(get_connection(self.neo4j), timeout=5)[:2],
+                         [('node', 'Class', 30), ('node', 'Neuron', 20)])
+
+    def test_matrix_with_unreachable_server(self):
+        matrix = gen_label_count_matrix({'local': self.neo4j, 'down': ('http://127.0.0.1:9', 'neo4j', 'neo4j')},
+                                        timeout=1)
+        self.assertEqual(list(matrix.columns), ['type', 'label', 'local', 'down'])
+        self.assertEqual(matrix['local'].tolist(), [30, 20, 5, 1, 40, 10])
+        self.assertTrue(matrix['down'].isna().all())
+
+
+class BatchHandler(Neo4jHandler):
+    """Runs statements in order as Neo4j does, stopping at the first that fails: statements
+    containing 'runtime' fail while running (leaving a partial result), 'syntax' fail to
+    compile and 'apoc.missing' call a procedure that doesn't exist (neither leaving a result)."""
+    requests = []
+
+    def do_POST(self):
+        statements = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['statements']
+        self.requests.append([s['statement'] for s in statements])
+        results = []
+        errors = []
+        for statement in (s['statement'] for s in statements):
+            if 'syntax' in statement:
+                errors.append({'code': 'Neo.ClientError.Statement.SyntaxError', 'message': 'Invalid input'})
+            elif 'apoc.missing' in statement:
+                errors.append({'code': 'Neo.ClientError.Procedure.ProcedureNotFound', 'message': 'No procedure'})
+            else:
+                quoted = re.search("'(\\w+)'", statement)
+                results.append({'columns': ['id'], 'data': [{'row': [quoted and quoted.group(1)], 'meta': [None]}]})
+                if 'runtime' in statement:
+                    errors.append({'code': 'Neo.ClientError.Statement.ArithmeticError', 'message': '/ by zero'})
+            if errors:
+                break
+        self.send_payload(json.dumps({'results': results, 'errors': errors}).encode('utf-8'))
+
+
+class BatchTest(ServerTestCase):
+    handler = BatchHandler
+
+    def check(self, failing):
+        queries = {'a': "RETURN 'a' AS id", 'b': failing + " RETURN 'b' AS id", 'c': "RETURN 'c' AS id"}
+        reports = gen_reports_batch(self.neo4j, queries, cache=False)
+        self.assertIsNone(reports['b'])
+        self.assertEqual(reports['a']['id'].tolist(), ['a'])
+        self.assertEqual(reports['c']['id'].tolist(), ['c'])
+
+    def test_runtime_error(self):
+        self.check("WITH 1 / 0 AS runtime")
+
+    def test_compile_error(self):
+        self.check("syntax")
+
+    def test_procedure_not_found(self):
+        self.check("CALL apoc.missing()")
+
+    def test_first_query_fails(self):
+        BatchHandler.requests = []
+        reports = gen_reports_batch(self.neo4j, {'a': "CALL apoc.missing() RETURN 'a' AS id",
+                                                 'b': "RETURN 'b' AS id"}, cache=False)
+        self.assertIsNone(reports['a'])
+        self.assertEqual(reports['b']['id'].tolist(), ['b'])
+        # a failed without a result, so it is known to have failed without running it again
+        self.assertEqual(len([r for r in BatchHandler.requests if "CALL apoc.missing() RETURN 'a' AS id" in r]), 1)
+
+
+class ProfilerTest(ServerTestCase):
+    handler = BatchHandler
+
+    def records(self, query):
+        return [r for r in PROFILER.records if r['id'] == query_id(query)]
+
+    def test_neo4j_queries_recorded(self):
+        query = "RETURN  'profiled' AS id"
+        gen_report(self.neo4j, query, 'profiled', cache=False)
+        list(gen_report_chunks(self.neo4j, query, 'profiled', cache=False))
+        with self.assertRaises(Exception):
+            gen_report(self.neo4j, "syntax RETURN 'x' AS id", 'failed', cache=False)
+        plain, streamed = self.records("RETURN 'profiled' AS id")[-2:]
+        for record in plain, streamed:
+            self.assertEqual((record['service'], record['endpoint'], record['rows']), ('neo4j', self.neo4j[0], 1))
+            self.assertEqual(record['query'], "RETURN 'profiled' AS id")
+            self.assertGreater(record['bytes'], 0)
+            self.assertGreaterEqual(record['wall'], record['time_to_headers'])
+            self.assertIsNone(record['error'])
+        self.assertEqual(self.records("syntax RETURN 'x' AS id")[-1]['error'], 'Invalid input')
+
+    def test_session_calls_recorded(self):
+        profiled_session('catmaid').get(self.neo4j[0] + '/project/1/skeletons?x=1')
+        record = self.records('catmaid GET /project/1/skeletons')[-1]
+        self.assertEqual((record['service'], record['bytes'], record['error']), ('catmaid', 2, None))
+        self.assertIsNone(record['rows'])
+
+    def test_summary_and_output(self):
+        profiler = QueryProfiler()
+        for query, wall, error in [("MATCH (n) RETURN n", 1.0, None), ("MATCH (n)\n RETURN n", 2.0, None),
+                                   ("MATCH (m) RETURN m", 5.0, 'timed out')]:
+            profiler.finish(profiler.start('neo4j', 'http://pdb', query), wall=wall, time_to_headers=wall / 2,
+                            decode=0.1, rows=10, bytes=100, error=error)
+        summary = profiler.summary()
+        self.assertEqual(list(summary.columns), PROFILE_COLUMNS)
+        self.assertEqual(summary['query'].tolist(), ["MATCH (m) RETURN m", "MATCH (n) RETURN n"])
+        self.assertEqual(summary['calls'].tolist(), [1, 2])
+        self.assertEqual(summary['total_wall'].tolist(), [5.0, 3.0])
+        self.assertEqual(summary['total_time_to_headers'].tolist(), [2.5, 1.5])
+        self.assertEqual(summary['rows'].tolist(), [10, 20])
+        self.assertEqual(summary['errors'].tolist(), [1, 0])
+        with tempfile.TemporaryDirectory() as directory:
+            profiler.write(directory)
+            with open(os.path.join(directory, 'query_profile.json')) as f:
+                written = json.load(f)
+            slow = pd.read_csv(os.path.join(directory, 'slow_queries.tsv'), sep='\t', dtype={'id': str})
+        self.assertEqual(len(written['calls']), 3)
+        self.assertEqual([q['id'] for q in written['queries']], summary['id'].tolist())
+        self.assertEqual(slow['id'].tolist(), summary['id'].tolist())
+        self.assertTrue(QueryProfiler().summary().empty)
+
+
+def plan(operator, children=(), db_hits=None, estimated_rows=100, details=''):
+    """An operator of a plan as the transactional endpoint returns it (db_hits only under PROFILE)."""
+    args = {'EstimatedRows': estimated_rows, 'Details': details}
+    if db_hits is not None:
+        args['DbHits'] = db_hits
+        args['Rows'] = estimated_rows
+    return {'operatorType': operator + '@neo4j', 'args': args, 'identifiers': ['n'], 'children': list(children)}
+
+
+class PlanHandler(Neo4jHandler):
+    """Answers PROFILE queries with PAYLOAD's rows and the class's PLAN."""
+    PLAN = plan('ProduceResults', [plan('NodeIndexSeek', db_hits=10, details='n:Class(short_form)')], db_hits=5)
+
+    def do_POST(self):
+        statement = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['statements'][0]['statement']
+        payload = json.loads(PAYLOAD)
+        if statement.startswith('PROFILE'):
+            payload['results'][0]['profile'] = {'root': self.PLAN}
+        self.send_payload(json.dumps(payload).encode('utf-8'))
+
+
+class PlanTest(ServerTestCase):
+    handler = PlanHandler
+
+    def test_summarize(self):
+        tree = summarize({'root': plan('ProduceResults', [plan('Filter', [plan('AllNodesScan', db_hits=1000)],
+                                                                    db_hits=200)], db_hits=1, estimated_rows=7)})
+        self.assertEqual([o['operator'] for o in operators(tree)], ['ProduceResults', 'Filter', 'AllNodesScan'])
+        self.assertEqual(totals(tree), (1201, 7))
+        explained = summarize(plan('ProduceResults', [plan('AllNodesScan')], estimated_rows=7))
+        self.assertEqual(totals(explained), (None, 7))
+        self.assertEqual(explained['details'], 'n')
+
+    def test_compare(self):
+        seek = plan('ProduceResults', [plan('NodeIndexSeek', db_hits=20000, details='n:Class(short_form)')])
+        scan = plan('ProduceResults', [plan('NodeByLabelScan', db_hits=20000, details='n:Class')])
+        self.assertEqual(compare(summarize(seek), summarize(scan)), ['new NodeByLabelScan (n:Class)'])
+        self.assertEqual(compare(summarize(scan), summarize(scan)), [])
+        self.assertEqual(compare(summarize(scan), summarize(seek)), [])
+        more = plan('ProduceResults', [plan('NodeIndexSeek', db_hits=50000, details='n:Class(short_form)')],
+                    estimated_rows=30000)
+        self.assertEqual(compare(summarize(seek), summarize(more)),
+                         ['db hits up from 20000 to 50000', 'estimated rows up from 100 to 30000'])
+        # growth below min_db_hits is not flagged
+        small = plan('ProduceResults', [plan('NodeIndexSeek', db_hits=5, details='n:Class(short_form)')])
+        smaller = plan('ProduceResults', [plan('NodeIndexSeek', db_hits=5000, details='n:Class(short_form)')])
+        self.assertEqual(compare(summarize(small), summarize(smaller)), [])
+
+    def test_regression_recorded(self):
+        query = 'MATCH (n:Class) WHERE n.short_form = $id RETURN n.short_form AS id, 1 AS count'
+        with tempfile.TemporaryDirectory() as directory:
+            store = PlanStore('profile', directory)
+            self.assertEqual(store.statement(query), 'PROFILE ' + query)
+            self.assertEqual(store.statement('EXPLAIN ' + query), 'EXPLAIN ' + query)
+            with mock.patch.object(reporting_tools, 'plan_store', store):
+                report = gen_report(self.neo4j, query, 'test', parameters={'id': 'FBbt_1'}, cache=False)
+                worse = plan('ProduceResults', [plan('NodeByLabelScan', db_hits=90000, details='n:Class')], db_hits=5)
+                with mock.patch.object(PlanHandler, 'PLAN', worse):
+                    gen_report(self.neo4j, query, 'test', parameters={'id': 'FBbt_1'}, cache=False)
+            self.assertEqual(report['id'].tolist(), ['a', 'b'])
+            with open(store.path(self.neo4j[0], query)) as f:
+                stored = json.load(f)
+            self.assertEqual((stored['mode'], stored['db_hits']), ('profile', 90005))
+            self.assertEqual(stored['regressions'], ['new NodeByLabelScan (n:Class)', 'db hits up from 15 to 90005'])
+            store.write_regressions()
+            regressions = pd.read_csv(os.path.join(directory, 'plan_regressions.tsv'), sep='\t')
+        self.assertEqual(regressions['query'].tolist(), [query])
+        self.assertEqual(len(store.regressions), 1)
+        with self.assertRaises(ValueError):
+            PlanStore('analyze')
+
+
+class CassetteTest(unittest.TestCase):
+
+    def test_replay_without_server(self):
+        server, neo4j = start_server()
+        query = 'MATCH (n) RETURN n.short_form AS id, 1 AS count'
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'run.cassette.gz')
+            cassette = Cassette(path, 'record').install()
+            try:
+                recorded = gen_report(neo4j, query, 'test', cache=False)
+            finally:
+                cassette.close()
+                server.shutdown()
+                server.server_close()
+            cassette = Cassette(path, 'replay').install()
+            try:
+                replayed = gen_report(neo4j, query, 'test', cache=False)
+                with self.assertRaises(Exception):
+                    gen_report(neo4j, query + ' LIMIT 1', 'test', cache=False)
+            finally:
+                cassette.close()
+        pd.testing.assert_frame_equal(recorded, replayed)
+        self.assertEqual(replayed['id'].tolist(), ['a', 'b'])
+
+    def test_streamed_while_recording(self):
+        server, neo4j = start_server()
+        query = 'MATCH (n) RETURN n.short_form AS id, 1 AS count'
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'run.cassette.gz')
+            cassette = Cassette(path, 'record').install()
+            try:
+                chunks = gen_report_chunks(neo4j, query, 'test', chunk_size=1, cache=False)
+                recorded = [next(chunks)]
+                # recorded once read, not before the first chunk is returned
+                before = cassette.recorded
+                recorded += list(chunks)
+                self.assertEqual(cassette.recorded, before + 1)
+            finally:
+                cassette.close()
+                server.shutdown()
+                server.server_close()
+            cassette = Cassette(path, 'replay').install()
+            try:
+                replayed = list(gen_report_chunks(neo4j, query, 'test', chunk_size=1, cache=False))
+            finally:
+                cassette.close()
+        self.assertEqual([c['id'].tolist() for c in replayed], [['a'], ['b']])
+        pd.testing.assert_frame_equal(pd.concat(recorded), pd.concat(replayed))
+
+
+class DeadlineTest(ServerTestCase):
+
+    def test_timed_out_report_does_not_block_others(self):
+        slow = 'MATCH (n) WHERE n.label = "slow" RETURN n.short_form AS id, 1 AS count'
+        fast = 'MATCH (n) RETURN n.short_form AS id, 1 AS count'
+        start = time.time()
+        results, failures = run_reports({
+            'slow': (None, lambda: gen_report(self.neo4j, slow, 'slow', cache=False), []),
+            'fast': (None, lambda: gen_report(self.neo4j, fast, 'fast', cache=False), [])}, timeout=0.5)
+        self.assertLess(time.time() - start, 1.5)
+        self.assertIsInstance(failures['slow'], ReportTimeout)
+        self.assertEqual(results['fast']['id'].tolist(), ['a', 'b'])
+
+    def test_commit_list_raises_timeout(self):
+        nc = get_connection(self.neo4j)
+        with deadline(0.5):
+            with self.assertRaises(ReportTimeout):
+                nc.commit_list(['MATCH (n) WHERE n.label = "slow" RETURN n'])
+        self.assertTrue(nc.commit_list(['MATCH (n) RETURN n']))
+
+    def test_read_retried_after_503(self):
+        flaky = 'MATCH (n) WHERE n.label = "flaky" RETURN n.short_form AS id, 1 AS count'
+        adapter = get_connection(self.neo4j).session.get_adapter(self.neo4j[0])
+        backoff, adapter.backoff = adapter.backoff, 0.01
+        try:
+            self.assertEqual(gen_report(self.neo4j, flaky, 'flaky', cache=False)['id'].tolist(), ['a', 'b'])
+        finally:
+            adapter.backoff = backoff
+        self.assertFalse(_read_only_request(requests.Request(
+            'POST', self.neo4j[0], data=json.dumps({'statements': [{'statement': 'MERGE (n:A) RETURN n'}]})).prepare()))
+
+
+class PagedHandler(Neo4jHandler):
+    """Pages through KEYS: answers page_boundaries' query, and page queries with the keys in the page."""
+    KEYS = ['VFB_%08d' % i for i in range(25)]
+    boundary_queries = 0
+
+    def do_POST(self):
+        statement = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['statements'][0]
+        parameters = statement.get('parameters', {})
+        if '$page_limit' in statement['statement']:
+            PagedHandler.boundary_queries += 1
+            keys = [k for k in self.KEYS if parameters['page_from'] is None
+                    or k >= parameters['page_from']][:parameters['page_limit']]
+            result = {'columns': ['keys', 'first', 'last'],
+                      'data': [{'row': [len(keys), keys[0] if keys else None, keys[-1] if keys else None]}]}
+        else:
+            page_from, page_to = parameters.get('page_from'), parameters.get('page_to')
+            page = [k for k in self.KEYS if page_from is not None and k >= page_from
+                    and (page_to is None or k < page_to)]
+            result = {'columns': ['id', 'count'], 'data': [{'row': [k, i]} for i, k in enumerate(page)]}
+        self.send_payload(json.dumps({'results': [result], 'errors': []}).encode('utf-8'))
+
+
+class PaginatedTest(unittest.TestCase):
+
+    def test_pages_in_key_order(self):
+        server, neo4j = start_server(PagedHandler)
+        query = ("MATCH (i:Individual) WHERE i.short_form >= $page_from "
+                 "AND ($page_to IS NULL OR i.short_form < $page_to) RETURN i.short_form AS id, 1 AS count")
+        try:
+            pages = list(gen_report_paginated(neo4j, query, 'paged', 'i.short_form', 'MATCH (i:Individual)',
+                                              page_size=10, max_workers=2, cache=False))
+            # one query per page, each reading at most page_size + 1 keys
+            self.assertEqual(PagedHandler.boundary_queries, 3)
+            PagedHandler.KEYS = PagedHandler.KEYS[:20]
+            self.assertEqual(page_boundaries(neo4j, 'MATCH (i:Individual)', 'i.short_form', page_size=10),
+                             (20, [('VFB_00000000', 'VFB_00000010'), ('VFB_00000010', None)]))
+            PagedHandler.KEYS = []
+            empty = list(gen_report_paginated(neo4j, query, 'paged', 'i.short_form', 'MATCH (i:Individual)',
+                                              cache=False))
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual([len(p) for p in pages], [10, 10, 5])
+        self.assertEqual(pd.concat(pages)['id'].tolist(), ['VFB_%08d' % i for i in range(25)])
+        self.assertEqual(len(empty), 1)
+        self.assertEqual(list(empty[0].columns), ['id', 'count'])
+
+
+if __name__ == '__main__':
+    unittest.main()